@@ -0,0 +1,149 @@
+import contextvars
+import math
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+import metrics
+
+#admission control for calls to the OpenAI API -> bursts wait in a bounded queue instead of overrunning the upstream rate limit
+#and tying up every worker, and a call that can't start in time fails fast so the endpoint can answer 429 with Retry-After
+#chat and embedding calls have their own limits, as OpenAI rate limits them separately
+
+ADMISSION_BACKOFF_BASE_SECONDS = float(os.environ.get('ADMISSION_BACKOFF_BASE_SECONDS', 1)) #first pause after an upstream 429 without Retry-After
+ADMISSION_BACKOFF_MAX_SECONDS = float(os.environ.get('ADMISSION_BACKOFF_MAX_SECONDS', 60))
+
+#the user a request is for -> set by the endpoints, None for background jobs, which only count towards the global limit
+current_caller = contextvars.ContextVar('current_caller', default=None)
+
+
+class Rejected(Exception):
+    """Raised when a call could not be admitted in time -> main.py answers it with 429 and Retry-After."""
+
+    def __init__(self, kind: str, reason: str, retry_after: int):
+        super().__init__(f'Too many {kind} requests right now, please retry in {retry_after} seconds')
+        self.kind = kind
+        self.reason = reason #queue_full, timeout or upstream_rate_limit
+        self.retry_after = retry_after
+
+
+def upstream_retry_after(error): #None if the error is not an upstream rate limit, else the seconds it asked for (0 if it didn't say)
+    if getattr(error, 'status_code', None) != 429:
+        return None
+    response = getattr(error, 'response', None)
+    try:
+        return float(response.headers.get('retry-after', 0)) if response is not None else 0
+    except ValueError:
+        return 0
+
+
+class AdmissionController:
+    """Limits the calls of one kind running at once, overall and per caller, with a bounded queue of waiting calls.
+
+    The overall limit adapts: an upstream 429 halves it and pauses new calls for the time asked (or an exponential backoff),
+    and each successful call raises it again by 1/limit, so it climbs back by about one call per round of calls.
+    """
+
+    def __init__(self, kind: str, max_concurrent: int, max_per_caller: int, queue_size: int, wait_seconds: float):
+        self.kind = kind
+        self.max_concurrent = max_concurrent
+        self.max_per_caller = max_per_caller
+        self.queue_size = queue_size
+        self.wait_seconds = wait_seconds
+        self.limit = float(max_concurrent) #current overall limit, between 1 and max_concurrent
+        self.active = 0
+        self.active_by_caller = {}
+        self.waiting = 0
+        self.paused_until = 0.0 #monotonic time before which no call starts, after an upstream 429
+        self.backoff = 0.0
+        self.call_seconds = 1.0 #moving average of call duration -> used to suggest when to retry
+        self.condition = threading.Condition()
+        metrics.record_admission_limit(kind, max_concurrent)
+
+    def can_start(self, caller, now):
+        return (now >= self.paused_until
+                and self.active < max(1, int(self.limit))
+                and (caller is None or self.active_by_caller.get(caller, 0) < self.max_per_caller))
+
+    def reject(self, reason: str, now: float):
+        metrics.record_admission_rejected(self.kind, reason)
+        raise Rejected(self.kind, reason, max(1, math.ceil(max(self.paused_until - now, self.call_seconds))))
+
+    def acquire(self, caller):
+        start = time.monotonic()
+        with self.condition:
+            now = start
+            if not self.can_start(caller, now):
+                if self.waiting >= self.queue_size:
+                    self.reject('queue_full', now)
+                deadline = now + self.wait_seconds
+                self.waiting += 1
+                metrics.record_admission_queue(self.kind, self.waiting)
+                try:
+                    while not self.can_start(caller, now):
+                        if now >= deadline:
+                            self.reject('timeout', now)
+                        #releases notify, the end of a pause doesn't -> wake up for it too
+                        wake = min(deadline, self.paused_until) if self.paused_until > now else deadline
+                        self.condition.wait(wake - now)
+                        now = time.monotonic()
+                finally:
+                    self.waiting -= 1
+                    metrics.record_admission_queue(self.kind, self.waiting)
+            self.active += 1
+            if caller is not None:
+                self.active_by_caller[caller] = self.active_by_caller.get(caller, 0) + 1
+        metrics.record_admission_wait(self.kind, time.monotonic() - start)
+
+    def release(self, caller, seconds: float, retry_after=None): #retry_after is None after a call that was not rate limited
+        with self.condition:
+            self.active -= 1
+            if caller is not None:
+                self.active_by_caller[caller] -= 1
+                if not self.active_by_caller[caller]:
+                    del self.active_by_caller[caller]
+            self.call_seconds = 0.8 * self.call_seconds + 0.2 * seconds
+            if retry_after is None:
+                self.backoff = 0.0
+                self.limit = min(self.max_concurrent, self.limit + 1 / self.limit)
+            else:
+                self.backoff = min(max(self.backoff * 2, ADMISSION_BACKOFF_BASE_SECONDS), ADMISSION_BACKOFF_MAX_SECONDS)
+                pause = retry_after or self.backoff * random.uniform(1, 1.1)
+                self.paused_until = max(self.paused_until, time.monotonic() + pause)
+                self.limit = max(1.0, self.limit / 2)
+            metrics.record_admission_limit(self.kind, int(self.limit))
+            self.condition.notify_all()
+
+    @contextmanager
+    def admit(self):
+        """Runs the body as one admitted call of the current caller.
+
+        Raises Rejected if the call can't start within wait_seconds, or if it was still rate limited upstream after the
+        client's own retries -> either way the caller is told when to try again.
+        """
+        caller = current_caller.get()
+        self.acquire(caller)
+        start = time.monotonic()
+        try:
+            yield
+        except BaseException as error: #the slot must come back whatever went wrong
+            retry_after = upstream_retry_after(error)
+            self.release(caller, time.monotonic() - start, retry_after)
+            if retry_after is None:
+                raise
+            self.reject('upstream_rate_limit', time.monotonic())
+        else:
+            self.release(caller, time.monotonic() - start)
+
+
+def controller(kind: str, max_concurrent: int, max_per_caller: int, queue_size: int, wait_seconds: float):
+    #e.g. ADMISSION_CHAT_MAX_CONCURRENT overrides the default given here
+    def setting(name, default, cast):
+        return cast(os.environ.get(f'ADMISSION_{kind.upper()}_{name}', default))
+    return AdmissionController(kind, setting('MAX_CONCURRENT', max_concurrent, int), setting('MAX_PER_USER', max_per_caller, int),
+                               setting('QUEUE_SIZE', queue_size, int), setting('WAIT_SECONDS', wait_seconds, float))
+
+
+chat = controller('chat', max_concurrent=8, max_per_caller=2, queue_size=32, wait_seconds=10)
+embedding = controller('embedding', max_concurrent=16, max_per_caller=4, queue_size=64, wait_seconds=5)
@@ -0,0 +1,129 @@
+import concurrent.futures
+import os
+import threading
+import time
+from sqlalchemy import func, literal_column, select, text
+from sqlalchemy.orm import Session
+from cache import get_cache
+from database import SessionLocal
+import models
+
+#registration and recommendation analytics for /admin/analytics, computed with grouped aggregates in the database
+#the report is cached with the data generation it was computed for -> once the data changes, the cached report is still
+#served at once (marked stale) while a new one is computed in the background, so requests never wait for a scan of the users
+
+ANALYTICS_AGE_BANDS = [int(age) for age in os.environ.get('ANALYTICS_AGE_BANDS', '18,25,35,50,65').split(',')] #lower bounds of the age bands after the first
+ANALYTICS_TOP_RECOMMENDED = int(os.environ.get('ANALYTICS_TOP_RECOMMENDED', 10)) #events listed as most recommended
+ANALYTICS_REFRESH_SECONDS = float(os.environ.get('ANALYTICS_REFRESH_SECONDS', 10)) #least time between two computations after the data changed
+ANALYTICS_MAX_AGE_SECONDS = float(os.environ.get('ANALYTICS_MAX_AGE_SECONDS', 300)) #a report this old is computed again even if the generation is the same, e.g. after users were deleted
+
+executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='analytics')
+refreshing = threading.Event() #set while this process computes a report in the background -> at most one at a time
+
+def data_generation(db: Session): #changes whenever an event or user is written or a recommendation list is stored -> reads no table rows
+    row = db.execute(text('SELECT (SELECT last_value FROM event_version_seq), (SELECT last_value FROM user_version_seq)')).one()
+    recommended = db.query(func.max(models.UserRecommendation.updated_at)).scalar()
+    return f'{row[0]}:{row[1]}:{recommended}'
+
+def age_band_labels(bands=ANALYTICS_AGE_BANDS): #width_bucket numbers below the first bound 0, then 1, 2, ...
+    return [f'<{bands[0]}'] + [f'{low}-{high - 1}' for low, high in zip(bands, bands[1:])] + [f'{bands[-1]}+']
+
+def event_stats(db: Session):
+    registrations = func.coalesce(func.cardinality(models.Event.users_registered), 0)
+    fill_rate = registrations / func.nullif(models.Event.capacity, 0)
+    totals = db.query(func.count(models.Event.id), func.coalesce(func.sum(registrations), 0), func.coalesce(func.sum(models.Event.capacity), 0),
+                      func.count().filter(registrations >= models.Event.capacity)).one()
+    rows = (db.query(models.Event.title, models.Event.capacity, registrations, fill_rate)
+            .order_by(fill_rate.desc().nulls_last(), registrations.desc(), models.Event.title)
+            .all())
+    return {'events': totals[0],
+            'registrations': int(totals[1]),
+            'capacity': int(totals[2]),
+            'fill_rate': round(totals[1] / totals[2], 4) if totals[2] else None,
+            'full_events': totals[3],
+            'per_event': [{'title': title, 'capacity': capacity, 'registrations': registered, 'fill_rate': round(rate, 4) if rate is not None else None}
+                          for title, capacity, registered, rate in rows]}
+
+def demographics(db: Session):
+    """Users, volunteers (users registered for at least one event) and registrations by work status, immigration status and
+    age band, and in total, from one scan of the users with GROUPING SETS."""
+    registrations = func.coalesce(func.cardinality(models.User.events_registered), 0)
+    work_status, immigration_status = func.lower(models.User.work_status), func.lower(models.User.immigration_status) #profiles are stored as typed, e.g. 'Student'
+    #written out rather than bound -> the same expression in SELECT and GROUP BY, as Postgres requires
+    age_band = func.width_bucket(models.User.age, literal_column('ARRAY[' + ','.join(str(age) for age in ANALYTICS_AGE_BANDS) + ']'))
+    rows = (db.query(func.grouping(work_status), func.grouping(immigration_status), func.grouping(age_band),
+                     work_status, immigration_status, age_band,
+                     func.count(), func.count().filter(registrations > 0), func.coalesce(func.sum(registrations), 0))
+            .group_by(func.grouping_sets(work_status, immigration_status, age_band, literal_column('()')))
+            .all())
+
+    labels = age_band_labels()
+    result = {'work_status': {}, 'immigration_status': {}, 'age_band': {label: {'users': 0, 'volunteers': 0, 'registrations': 0} for label in labels}}
+    for work_grouped, immigration_grouped, band_grouped, work, immigration, band, users, volunteers, registered in rows:
+        counts = {'users': users, 'volunteers': volunteers, 'registrations': int(registered)}
+        if not work_grouped: #grouping() is 0 for the columns a row is grouped by
+            result['work_status'][work] = counts
+        elif not immigration_grouped:
+            result['immigration_status'][immigration] = counts
+        elif not band_grouped:
+            result['age_band'][labels[band]] = counts
+        else:
+            result['total'] = counts
+    result.setdefault('total', {'users': 0, 'volunteers': 0, 'registrations': 0}) #no users -> the grand total has no row
+    return result
+
+def top_recommended(db: Session, limit: int = ANALYTICS_TOP_RECOMMENDED): #events in the most users' latest personalized lists
+    recommended = select(func.unnest(models.UserRecommendation.event_ids).label('event_id')).subquery()
+    users = func.count().label('users')
+    rows = (db.query(models.Event.title, users)
+            .join(recommended, recommended.c.event_id == models.Event.id)
+            .group_by(models.Event.id)
+            .order_by(users.desc(), models.Event.title)
+            .limit(limit)
+            .all())
+    return {'users_with_recommendations': db.query(func.count(models.UserRecommendation.user_id)).scalar(),
+            'events': [{'title': title, 'users': count} for title, count in rows]}
+
+def compute(generation: str):
+    db = SessionLocal()
+    try:
+        return {'generation': generation,
+                'computed_at': time.time(),
+                'events': event_stats(db),
+                'users': demographics(db),
+                'recommended': top_recommended(db)}
+    finally:
+        db.close()
+
+def build(generation: str): #computes the report of a generation once, even if several processes ask for it at the same time
+    cache = get_cache('analytics')
+    result = cache.get_or_set(f'report:{generation}', lambda: compute(generation), ANALYTICS_MAX_AGE_SECONDS)
+    latest = cache.get('latest')
+    if latest is None or latest['computed_at'] <= result['computed_at']: #a slower computation of an older generation must not win
+        cache.set('latest', result)
+    return result
+
+def refresh(generation: str):
+    try:
+        build(generation)
+    except Exception as error:
+        print(f'Analytics refresh failed: {error!r}')
+    finally:
+        refreshing.clear()
+
+def report(db: Session):
+    """Returns the latest analytics report with 'stale': True if the data changed since, in which case a new one is on its way.
+
+    Only the first request ever waits for the aggregates, every later one is answered from the cache.
+    """
+    generation = data_generation(db)
+    latest = get_cache('analytics').get('latest')
+    if latest is None:
+        return {**build(generation), 'stale': False}
+
+    age = time.time() - latest['computed_at']
+    stale = latest['generation'] != generation or age >= ANALYTICS_MAX_AGE_SECONDS
+    if stale and (age >= ANALYTICS_REFRESH_SECONDS or latest['generation'] == generation) and not refreshing.is_set():
+        refreshing.set()
+        executor.submit(refresh, generation)
+    return {**latest, 'stale': stale}
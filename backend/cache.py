@@ -0,0 +1,273 @@
+import os
+import pickle
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import lru_cache
+import metrics
+
+#one cache interface for the backend -> in-process LRU by default, Redis when CACHE_URL is set so all workers and nodes share it
+#get a namespace with get_cache('embeddings') -> keys of different namespaces never collide and each can be cleared on its own
+
+CACHE_URL = os.environ.get('CACHE_URL') #e.g. redis://localhost:6379/0 -> needs the redis package
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 10000)) #per process, for the in-process cache
+CACHE_PREFIX = os.environ.get('CACHE_PREFIX', 'c4g') #lets several deployments share one Redis
+CACHE_LOCK_SECONDS = float(os.environ.get('CACHE_LOCK_SECONDS', 30)) #longest a get_or_set computation holds its key before others compute it too
+
+MISSING = object()
+
+
+class Cache:
+    """Base of the cache stores. Subclasses implement the _ methods on full keys, the rest is shared.
+
+    Values can be anything pickle can store. ttl is in seconds, None keeps the value until it is evicted.
+    """
+
+    def __init__(self, namespace: str = 'default'):
+        self.namespace_name = namespace
+
+    def namespace(self, name: str): #a view of the same store with its own key space
+        view = object.__new__(type(self))
+        view.__dict__.update(self.__dict__)
+        view.namespace_name = name
+        return view
+
+    def full_key(self, key):
+        return f'{CACHE_PREFIX}:{self.namespace_name}:{key}'
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def get_many(self, keys): #returns a dict with the keys that were found
+        keys = list(keys)
+        found = self._get_many([self.full_key(key) for key in keys])
+        values = {key: found[self.full_key(key)] for key in keys if self.full_key(key) in found}
+        metrics.record_cache(self.namespace_name, hits=len(values), misses=len(keys) - len(values))
+        return values
+
+    def set(self, key, value, ttl: float = None):
+        self.set_many({key: value}, ttl)
+
+    def set_many(self, mapping, ttl: float = None):
+        if mapping:
+            self._set_many({self.full_key(key): value for key, value in mapping.items()}, ttl)
+
+    def delete(self, *keys):
+        if keys:
+            self._delete([self.full_key(key) for key in keys])
+
+    def clear(self): #removes every key of this namespace
+        self._clear_prefix(self.full_key(''))
+
+    def get_or_set(self, key, compute, ttl: float = None):
+        """Returns the cached value of key, or computes, stores and returns it.
+
+        Stampede protection: when many callers miss the same key at once, only the one that takes the key's lock computes
+        it. The others wait for its result, and only compute themselves if it doesn't arrive within CACHE_LOCK_SECONDS.
+        """
+        value = self.get(key, MISSING)
+        if value is not MISSING:
+            return value
+
+        lock_key, token = self.full_key(f'{key}:lock'), uuid.uuid4().hex
+        if self._add(lock_key, token, CACHE_LOCK_SECONDS):
+            try:
+                value = compute()
+                self.set(key, value, ttl)
+                return value
+            finally:
+                self._release(lock_key, token)
+
+        metrics.record_cache(self.namespace_name, waits=1)
+        deadline = time.monotonic() + CACHE_LOCK_SECONDS
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            found = self._get_many([self.full_key(key)])
+            if self.full_key(key) in found:
+                return found[self.full_key(key)]
+            if not self._exists(lock_key): #the computation failed -> don't wait for the full timeout
+                break
+        value = compute()
+        self.set(key, value, ttl)
+        return value
+
+
+    def update(self, key, change, ttl: float = None):
+        """Stores change(current value or None) under key while holding the key's lock, and returns it -> concurrent updates
+        of one shared value (e.g. a list several requests add to) are applied one after the other instead of overwriting
+        each other. Nothing is stored if change returns None.
+
+        A caller that can't get the lock within CACHE_LOCK_SECONDS updates anyway, as get_or_set computes anyway.
+        """
+        lock_key, token = self.full_key(f'{key}:lock'), uuid.uuid4().hex
+        deadline = time.monotonic() + CACHE_LOCK_SECONDS
+        locked = self._add(lock_key, token, CACHE_LOCK_SECONDS)
+        if not locked:
+            metrics.record_cache(self.namespace_name, waits=1)
+        while not locked and time.monotonic() < deadline:
+            time.sleep(0.01) #updates are short -> poll more often than get_or_set
+            locked = self._add(lock_key, token, CACHE_LOCK_SECONDS)
+        try:
+            value = change(self.get(key))
+            if value is not None:
+                self.set(key, value, ttl)
+            return value
+        finally:
+            if locked:
+                self._release(lock_key, token)
+
+
+class MemoryCache(Cache):
+    """LRU cache in this process, for single-process deployments and tests."""
+
+    def __init__(self, namespace: str = 'default', max_entries: int = CACHE_MAX_ENTRIES):
+        super().__init__(namespace)
+        self.entries = OrderedDict() #full key -> (expiry time or None, value), least recently used first
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+
+    def _live(self, full_key, now):
+        entry = self.entries.get(full_key)
+        if entry is None:
+            return MISSING
+        expires, value = entry
+        if expires is not None and expires <= now:
+            del self.entries[full_key]
+            return MISSING
+        self.entries.move_to_end(full_key)
+        return value
+
+    def _get_many(self, full_keys):
+        now, found = time.monotonic(), {}
+        with self.lock:
+            for full_key in full_keys:
+                value = self._live(full_key, now)
+                if value is not MISSING:
+                    found[full_key] = value
+        return found
+
+    def _put_many(self, mapping, ttl): #callers hold the lock
+        expires = time.monotonic() + ttl if ttl else None
+        for full_key, value in mapping.items():
+            self.entries[full_key] = (expires, value)
+            self.entries.move_to_end(full_key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _set_many(self, mapping, ttl):
+        with self.lock:
+            self._put_many(mapping, ttl)
+
+    def _delete(self, full_keys):
+        with self.lock:
+            for full_key in full_keys:
+                self.entries.pop(full_key, None)
+
+    def _clear_prefix(self, prefix):
+        with self.lock:
+            for full_key in [full_key for full_key in self.entries if full_key.startswith(prefix)]:
+                del self.entries[full_key]
+
+    def _add(self, full_key, value, ttl): #sets the key only if it is not there -> True if it was set
+        with self.lock: #checked and set under one lock -> two callers can't both take the key
+            if self._live(full_key, time.monotonic()) is not MISSING:
+                return False
+            self._put_many({full_key: value}, ttl)
+            return True
+
+    def _exists(self, full_key):
+        with self.lock:
+            return self._live(full_key, time.monotonic()) is not MISSING
+
+    def _release(self, full_key, token):
+        with self.lock:
+            entry = self.entries.get(full_key)
+            if entry is not None and entry[1] == token:
+                del self.entries[full_key]
+
+
+class RedisCache(Cache):
+    """Cache in Redis (or anything speaking its protocol), shared by every worker and node.
+
+    A Redis that is down or slow makes lookups miss and writes do nothing -> requests carry on without the cache.
+    """
+
+    def __init__(self, url: str = CACHE_URL, namespace: str = 'default', client=None):
+        super().__init__(namespace)
+        if client is None:
+            import redis #optional dependency, only needed when CACHE_URL is set
+            client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.client = client
+
+    def _failed(self, operation, error):
+        metrics.record_cache(self.namespace_name, errors=1)
+        print(f'Cache {operation} failed: {error!r}')
+
+    def _get_many(self, full_keys):
+        try:
+            blobs = self.client.mget(full_keys)
+        except Exception as error:
+            self._failed('get', error)
+            return {}
+        return {full_key: pickle.loads(blob) for full_key, blob in zip(full_keys, blobs) if blob is not None}
+
+    def _set_many(self, mapping, ttl):
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            for full_key, value in mapping.items():
+                pipeline.set(full_key, pickle.dumps(value), px=int(ttl * 1000) if ttl else None)
+            pipeline.execute()
+        except Exception as error:
+            self._failed('set', error)
+
+    def _delete(self, full_keys):
+        try:
+            self.client.delete(*full_keys)
+        except Exception as error:
+            self._failed('delete', error)
+
+    def _clear_prefix(self, prefix):
+        try:
+            batch = []
+            for full_key in self.client.scan_iter(match=prefix + '*', count=1000):
+                batch.append(full_key)
+                if len(batch) >= 1000:
+                    self.client.delete(*batch)
+                    batch = []
+            if batch:
+                self.client.delete(*batch)
+        except Exception as error:
+            self._failed('clear', error)
+
+    def _add(self, full_key, value, ttl):
+        try:
+            return bool(self.client.set(full_key, pickle.dumps(value), nx=True, px=int(ttl * 1000)))
+        except Exception as error:
+            self._failed('add', error)
+            return True #without Redis there is nothing to coordinate with -> compute
+
+    def _exists(self, full_key):
+        try:
+            return bool(self.client.exists(full_key))
+        except Exception as error:
+            self._failed('exists', error)
+            return False
+
+    def _release(self, full_key, token):
+        try:
+            #only delete the lock if it is still ours -> it may have timed out and been taken by another caller
+            #not atomic, so in a rare race the other caller's lock goes and one extra computation runs
+            blob = self.client.get(full_key)
+            if blob is not None and pickle.loads(blob) == token:
+                self.client.delete(full_key)
+        except Exception as error:
+            self._failed('release', error)
+
+
+@lru_cache(maxsize=None)
+def get_store():
+    return RedisCache(CACHE_URL) if CACHE_URL else MemoryCache()
+
+def get_cache(namespace: str): #the shared cache, seen through a namespace
+    return get_store().namespace(namespace)
@@ -0,0 +1,142 @@
+import os
+import threading
+import numpy as np
+import scipy.sparse as sparse
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+import models
+
+#how often events are registered for together -> the collaborative half of the recommendations in recommendations.py
+#every process keeps the user x event registration matrix A and the event x event co-registration counts C = A'A
+#registering or unregistering changes the event's version -> a refresh only reads the events whose version moved
+#and adds the few changed counts to C as one sparse matrix, the full product is only taken again after events are deleted
+
+#versions are taken when a write happens, not when it commits -> look back this many versions to catch writes that committed late
+REFRESH_OVERLAP_VERSIONS = int(os.environ.get('COREGISTRATION_OVERLAP_VERSIONS', 1000))
+
+
+class CoRegistrations:
+    """Co-registration counts of every pair of events, kept in step with events.users_registered."""
+
+    def __init__(self):
+        self.event_ids = []
+        self.positions = {} #event id -> row and column of C
+        self.registrants = {} #event id -> set of user ids
+        self.user_events = {} #user id -> set of event ids
+        self.counts = sparse.csr_matrix((0, 0), dtype=np.int32) #C without its diagonal -> C[i, j] users registered for both i and j
+        self.sizes = np.zeros(0, dtype=np.int32) #registrations per event, the diagonal of C
+        self.state = None #(highest event version, number of events, highest delete version) last read
+        self.lock = threading.Lock()
+
+    def build(self, rows): #rows of (event id, registered user ids)
+        self.event_ids = [event_id for event_id, registered in rows]
+        self.positions = {event_id: position for position, event_id in enumerate(self.event_ids)}
+        self.registrants = {event_id: set(registered or []) for event_id, registered in rows}
+        self.user_events = {}
+        for event_id, registered in self.registrants.items():
+            for user_id in registered:
+                self.user_events.setdefault(user_id, set()).add(event_id)
+
+        user_positions = {user_id: position for position, user_id in enumerate(self.user_events)}
+        pairs = [(user_positions[user_id], self.positions[event_id]) for event_id, registered in self.registrants.items() for user_id in registered]
+        users, events = zip(*pairs) if pairs else ((), ())
+        matrix = sparse.csr_matrix((np.ones(len(pairs), dtype=np.int32), (users, events)), shape=(len(user_positions), len(self.event_ids)))
+        counts = (matrix.T @ matrix).tocsr()
+        self.sizes = counts.diagonal().astype(np.int32)
+        counts = (counts - sparse.diags(self.sizes, dtype=np.int32)).tocsr() #setdiag would change the sparsity structure in place
+        counts.eliminate_zeros()
+        self.counts = counts
+
+    def apply(self, rows):
+        """Brings the counts in line with the current registrants of the given events -> returns the number of changed registrations.
+
+        Only the difference to what was seen before is applied, so applying the same rows twice changes nothing.
+        """
+        added = [event_id for event_id, registered in rows if event_id not in self.positions]
+        if added:
+            for event_id in added:
+                self.positions[event_id] = len(self.event_ids)
+                self.event_ids.append(event_id)
+                self.registrants[event_id] = set()
+            self.counts.resize((len(self.event_ids), len(self.event_ids)))
+            self.sizes = np.concatenate([self.sizes, np.zeros(len(added), dtype=np.int32)])
+
+        pair_rows, pair_columns, deltas, changed = [], [], [], 0
+        for event_id, registered in rows:
+            registered, seen = set(registered or []), self.registrants[event_id]
+            position = self.positions[event_id]
+            for user_id, delta in [(user_id, 1) for user_id in registered - seen] + [(user_id, -1) for user_id in seen - registered]:
+                others = self.user_events.setdefault(user_id, set())
+                others.discard(event_id)
+                for other_id in others:
+                    pair_rows += [position, self.positions[other_id]]
+                    pair_columns += [self.positions[other_id], position]
+                    deltas += [delta, delta]
+                if delta > 0:
+                    others.add(event_id)
+                elif not others:
+                    del self.user_events[user_id]
+                self.sizes[position] += delta
+                changed += 1
+            self.registrants[event_id] = registered
+
+        if deltas:
+            shape = self.counts.shape
+            self.counts = (self.counts + sparse.csr_matrix((np.asarray(deltas, dtype=np.int32), (pair_rows, pair_columns)), shape=shape)).tocsr()
+            self.counts.eliminate_zeros()
+        return changed
+
+    def refresh(self, db: Session):
+        state = tuple(db.query(func.coalesce(func.max(models.Event.version), 0), func.count(models.Event.id),
+                               select(func.coalesce(func.max(models.DeletedEvent.version), 0)).scalar_subquery()).one())
+        if state == self.state:
+            return
+        #a new delete -> take the full product, even if events created since brought the count back to what it was
+        rebuild = self.state is None or state[2] != self.state[2]
+        if not rebuild:
+            self.apply(db.query(models.Event.id, models.Event.users_registered).filter(models.Event.version > self.state[0] - REFRESH_OVERLAP_VERSIONS).all())
+        if rebuild or len(self.event_ids) != state[1]: #first use, events deleted, or the counts drifted -> take the full product
+            self.build(db.query(models.Event.id, models.Event.users_registered).all())
+        self.state = state
+
+    def scores(self, event_ids, user_id=None):
+        """Returns how strongly every event is co-registered with the given events, as a dict of event id -> score between 0 and 1.
+
+        The score of event j is the sum over the given events i of C[i, j] / sqrt(size i * size j), the cosine of the two events'
+        columns of A -> events that many of the same volunteers joined score high without large events crowding out the rest.
+        With a user_id, that user's own row of A is taken out of C and the sizes first -> only other volunteers count.
+        """
+        rows = [self.positions[event_id] for event_id in event_ids if event_id in self.positions]
+        if not rows or not len(self.event_ids):
+            return {}
+        own = sorted(self.positions[event_id] for event_id in self.user_events.get(user_id, ())) if user_id is not None else []
+        sizes = self.sizes.copy()
+        sizes[own] -= 1
+        counts = self.counts[rows] #only the rows of the given events are needed
+        if own:
+            own_set = set(own)
+            pairs = [(row, column) for row, position in enumerate(rows) if position in own_set for column in own if column != position]
+            if pairs:
+                pair_rows, pair_columns = zip(*pairs)
+                counts = (counts - sparse.csr_matrix((np.ones(len(pairs), dtype=np.int32), (pair_rows, pair_columns)), shape=counts.shape)).tocsr()
+                counts.eliminate_zeros()
+        norms = np.sqrt(np.maximum(sizes, 1)).astype(np.float32)
+        weights = sparse.csr_matrix((1 / norms[rows], ([0] * len(rows), list(range(len(rows))))), shape=(1, len(rows)))
+        totals = (weights @ counts).toarray().ravel() / norms / len(rows)
+        return {self.event_ids[column]: float(totals[column]) for column in np.flatnonzero(totals)}
+
+co_registrations = CoRegistrations()
+
+def refresh(db: Session):
+    with co_registrations.lock:
+        co_registrations.refresh(db)
+
+def registrations_changed(event_id: str, registered): #called after a registration commits, so this process sees it without waiting for a refresh
+    with co_registrations.lock:
+        if co_registrations.state is not None:
+            co_registrations.apply([(event_id, registered)])
+
+def event_scores(db: Session, event_ids, user_id=None):
+    with co_registrations.lock:
+        co_registrations.refresh(db)
+        return co_registrations.scores(event_ids, user_id)
@@ -0,0 +1,56 @@
+"""
+Minimal stand-in for the OpenAI API, used by loadtest.py so the backend can be measured without network calls or cost.
+
+Serves /v1/embeddings and /v1/chat/completions with a configurable delay:
+    FAKE_OPENAI_EMBED_LATENCY=0.05 FAKE_OPENAI_CHAT_LATENCY=0.8 uvicorn fake_openai:app --port 8100
+Embeddings are deterministic pseudo-random unit vectors seeded by the input text, so similar runs rank events the same way.
+"""
+import asyncio
+import hashlib
+import os
+import time
+
+import numpy as np
+from fastapi import FastAPI, Request
+
+EMBED_LATENCY = float(os.environ.get('FAKE_OPENAI_EMBED_LATENCY', 0.05))
+CHAT_LATENCY = float(os.environ.get('FAKE_OPENAI_CHAT_LATENCY', 0.5))
+EMBED_DIM = 1536
+
+app = FastAPI()
+
+
+def fake_embedding(text: str, dimensions: int):
+    seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(dimensions)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+@app.post('/v1/embeddings')
+async def embeddings(request: Request):
+    body = await request.json()
+    await asyncio.sleep(EMBED_LATENCY)
+    
+    inputs = body['input'] if isinstance(body['input'], list) else [body['input']]
+    dimensions = body.get('dimensions') or EMBED_DIM
+    return {'object': 'list',
+            'model': body['model'],
+            'data': [{'object': 'embedding', 'index': i, 'embedding': fake_embedding(text, dimensions)} for i, text in enumerate(inputs)],
+            'usage': {'prompt_tokens': sum(len(text.split()) for text in inputs), 'total_tokens': sum(len(text.split()) for text in inputs)}
+            }
+
+
+@app.post('/v1/chat/completions')
+async def chat_completions(request: Request):
+    body = await request.json()
+    await asyncio.sleep(CHAT_LATENCY)
+    
+    prompt_tokens = sum(len(str(message.get('content', '')).split()) for message in body['messages'])
+    content = 'Help set up the registration desk, guide new volunteers to their stations and keep the supply table stocked.'
+    return {'id': 'chatcmpl-fake',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body['model'],
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(content.split()), 'total_tokens': prompt_tokens + len(content.split())}
+            }
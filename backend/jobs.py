@@ -0,0 +1,190 @@
+import os
+import random
+import threading
+import time
+from datetime import timedelta
+from sqlalchemy import event as sqlalchemy_event, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from database import SessionLocal
+import admission, metrics, models, related, vectors
+
+#background jobs -> endpoints enqueue work in the same transaction as their write and return, worker threads run it afterwards
+#jobs live in the jobs table so they survive restarts, and the jobs table only allows one pending job per kind and entity
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2)) #worker threads per backend process, 0 to only enqueue
+JOB_POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', 1.0)) #how long an idle worker waits before looking for jobs again
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 300)) #a running job not finished within this is picked up again, e.g. after a crash
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+JOB_RETRY_BASE_SECONDS = float(os.environ.get('JOB_RETRY_BASE_SECONDS', 5)) #wait before the first retry, doubled for every further attempt
+JOB_RETRY_MAX_SECONDS = float(os.environ.get('JOB_RETRY_MAX_SECONDS', 600))
+JOB_KEEP_HOURS = float(os.environ.get('JOB_KEEP_HOURS', 24)) #finished jobs older than this are deleted
+
+HANDLERS = {}
+
+def handler(kind): #registers a function as the handler of a job kind -> it gets a session and the entity id
+    def decorator(function):
+        HANDLERS[kind] = function
+        return function
+    return decorator
+
+
+@handler('embed_event')
+def embed_event(db: Session, event_id: str):
+    event = db.get(models.Event, event_id)
+    if event: #the event may have been deleted since the job was enqueued
+        vectors.embed_event(db, event)
+        related.update_event(db, event_id)
+
+@handler('embed_user')
+def embed_user(db: Session, user_id: str):
+    user = db.get(models.User, user_id)
+    if user:
+        vectors.embed_user(db, user)
+
+@handler('fill_related')
+def fill_related(db: Session, entity_id: str): #entity_id is 'all' -> one job covers any number of deletes
+    related.fill_incomplete(db)
+
+@handler('rebuild_related')
+def rebuild_related(db: Session, entity_id: str): #embeds events that have no vector in the configured format yet, then rebuilds the whole graph
+    current = db.query(models.EventVector.event_id).filter(*vectors.is_current(models.EventVector))
+    missing = db.query(models.Event).filter(models.Event.id.not_in(current)).all()
+    vectors.embed_events(db, missing)
+    related.rebuild(db)
+
+
+_wake = threading.Event()
+_stop = threading.Event()
+_workers = []
+_last_prune = 0.0
+
+def enqueue(db: Session, kind: str, entity_id: str): #adds a job to the caller's transaction -> nothing is queued if the write is rolled back
+    statement = insert(models.Job).values(kind=kind, entity_id=entity_id, status='pending')
+    db.execute(statement.on_conflict_do_nothing(index_elements=['kind', 'entity_id'], index_where=(models.Job.status == 'pending')))
+    sqlalchemy_event.listen(db, 'after_commit', lambda session: _wake.set(), once=True) #wake an idle worker once the job is visible
+
+def claim_job(): #marks the next due job as running and returns it, or None -> SKIP LOCKED lets workers in several processes share the table
+    db = SessionLocal()
+    try:
+        job = (db.query(models.Job)
+               .filter(models.Job.status.in_(['pending', 'running']), models.Job.run_after <= func.now()) #running jobs past their lease are retried
+               .order_by(models.Job.run_after, models.Job.id)
+               .with_for_update(skip_locked=True)
+               .first())
+        if not job:
+            return None
+        job.status = 'running'
+        job.attempts += 1
+        job.run_after = func.now() + timedelta(seconds=JOB_LEASE_SECONDS)
+        db.commit()
+        return job
+    finally:
+        db.close()
+
+def retry_delay(attempts: int):
+    delay = min(JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1), JOB_RETRY_MAX_SECONDS)
+    return delay * random.uniform(1, 1.1) #jitter so jobs that failed together don't all retry together
+
+def finish_job(job, error=None):
+    db = SessionLocal()
+    try:
+        current = db.get(models.Job, job.id)
+        if error is None:
+            current.status = 'done'
+            current.last_error = None
+        elif isinstance(error, admission.Rejected): #OpenAI calls were over capacity -> try again when told, without using up an attempt
+            current.status = 'pending'
+            current.attempts -= 1
+            current.last_error = repr(error)
+            current.run_after = func.now() + timedelta(seconds=error.retry_after * random.uniform(1, 1.1))
+        elif current.attempts >= JOB_MAX_ATTEMPTS:
+            current.status = 'failed'
+            current.last_error = repr(error)
+        else:
+            current.status = 'pending'
+            current.last_error = repr(error)
+            current.run_after = func.now() + timedelta(seconds=retry_delay(current.attempts))
+        try:
+            db.commit()
+        except IntegrityError: #the same work was enqueued again while this job ran -> the newer pending job covers the retry
+            db.rollback()
+            current = db.get(models.Job, job.id)
+            current.status = 'superseded'
+            current.last_error = repr(error)
+            db.commit()
+    finally:
+        db.close()
+
+def run_job(job):
+    start = time.perf_counter()
+    function = HANDLERS.get(job.kind)
+    db = SessionLocal()
+    try:
+        if function is None:
+            raise LookupError(f'No handler for job kind {job.kind}')
+        function(db, job.entity_id)
+        db.commit()
+        error = None
+    except Exception as exception:
+        db.rollback()
+        error = exception
+        print(f'Job {job.id} ({job.kind} {job.entity_id}) failed on attempt {job.attempts}: {exception!r}')
+    finally:
+        db.close()
+    finish_job(job, error)
+    metrics.record_job(job.kind, time.perf_counter() - start, 'done' if error is None else 'error')
+
+def prune_jobs(): #deletes old finished jobs so the table stays small
+    global _last_prune
+    if time.monotonic() - _last_prune < 600:
+        return
+    _last_prune = time.monotonic()
+    db = SessionLocal()
+    try:
+        db.query(models.Job).filter(models.Job.status.in_(['done', 'superseded']), models.Job.updated_at < func.now() - timedelta(hours=JOB_KEEP_HOURS)).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+def work():
+    while not _stop.is_set():
+        try:
+            job = claim_job()
+            if job:
+                run_job(job)
+                continue
+            prune_jobs()
+        except Exception as error: #e.g. the database is down -> keep the worker alive and try again later
+            print(f'Job worker error: {error!r}')
+        _wake.wait(JOB_POLL_SECONDS)
+        _wake.clear()
+
+def start_workers(count: int = JOB_WORKERS):
+    _stop.clear()
+    for number in range(count):
+        worker = threading.Thread(target=work, name=f'job-worker-{number}', daemon=True)
+        worker.start()
+        _workers.append(worker)
+
+def stop_workers(timeout: float = 5.0): #lets running jobs finish -> a job cut off by shutdown is retried once its lease runs out
+    _stop.set()
+    _wake.set()
+    for worker in _workers:
+        worker.join(timeout)
+    _workers.clear()
+
+def status_summary(db: Session, failures: int = 10): #job counts by kind and status, the oldest waiting job and the latest failures
+    counts = {}
+    for kind, job_status, count in db.query(models.Job.kind, models.Job.status, func.count()).group_by(models.Job.kind, models.Job.status):
+        counts.setdefault(kind, {})[job_status] = count
+
+    oldest_pending = db.query(func.extract('epoch', func.now() - func.min(models.Job.created_at))).filter(models.Job.status == 'pending').scalar()
+    failed = db.query(models.Job).filter(models.Job.last_error.isnot(None)).order_by(models.Job.updated_at.desc()).limit(failures).all()
+
+    return {'workers': sum(worker.is_alive() for worker in _workers),
+            'counts': counts,
+            'oldest_pending_seconds': float(oldest_pending) if oldest_pending is not None else None,
+            'recent_errors': [{'id': job.id, 'kind': job.kind, 'entity_id': job.entity_id, 'status': job.status, 'attempts': job.attempts, 'last_error': job.last_error, 'updated_at': job.updated_at.isoformat()} for job in failed]
+            }
@@ -1,21 +1,259 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, Header, HTTPException, Request, Response, status
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+from sqlalchemy import func, update
 from sqlalchemy.orm import Session
 import schemas, models #schemas represents format expecting from frontend, models represents database format
-from database import Base, engine, SessionLocal
+from database import SessionLocal, check_db_connection, init_db, read_session
 from utils import get_password_hash, verify_password, reset_db
-from openai_llm import generate_tasks, get_embeddings, get_cosine_similarity
+from openai_llm import generate_tasks, is_configured
+import admission, analytics, coregistration, jobs, maintenance, metrics, profiling, prompts, recommendations, related, task_cache, vectors, volunteers
+import os
 import uuid
 
-Base.metadata.create_all(bind=engine) #creates the tables in the database if they don't exist
+BULK_MAX_USERS = int(os.environ.get('BULK_MAX_USERS', 1000)) #most users one bulk register or kick call may name
 
-def get_session(): #function to get the database session
+def request_keys(request: Request): #the users and events a request names -> see database.read_session
+    return [f'{name}:{request.query_params[name]}' for name in ('email', 'title') if name in request.query_params]
+
+def get_session(request: Request): #function to get the database session
     session = SessionLocal()
+    session.info['write_keys'] = request_keys(request) #what the request writes, besides the rows it changes, is read from the primary for a while
+    try:
+        yield session
+    finally:
+        session.close()
+
+def get_read_session(request: Request): #session for read-only endpoints -> on a replica when REPLICA_URLS is set
+    session = read_session(request_keys(request))
     try:
         yield session
     finally:
         session.close()
 
-app = FastAPI()
+db_initialised = False
+
+@asynccontextmanager
+async def lifespan(app: FastAPI): #runs once when the server starts -> the app still starts if the database is down, /readyz reports it
+    global db_initialised
+    db_initialised = init_db()
+    jobs.start_workers() #embeddings and other slow side work run here, off the request path -> see jobs.py
+    yield
+    jobs.stop_workers()
+
+
+#paths whose responses grow with the number of events or users -> only these are gzip-compressed, single records stay small
+#and compressing them would cost CPU on every read for a few saved bytes
+GZIP_PATHS = set(os.environ.get('GZIP_PATHS', '/event/get_events,/event/changes,/event/page,/event/get_users_registered,/user/get_user_events,'
+                                              '/admin/match_volunteers,/admin/analytics,/admin/jobs,/metrics').split(','))
+
+class ListGZipMiddleware: #GZipMiddleware for GZIP_PATHS only
+    def __init__(self, app, minimum_size: int):
+        self.app = app
+        self.gzip = GZipMiddleware(app, minimum_size=minimum_size)
+    
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] in GZIP_PATHS:
+            await self.gzip(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+
+app = FastAPI(lifespan=lifespan)
+app.router.route_class = profiling.ProfiledRoute #lets single requests be profiled -> see profiling.py
+app.add_middleware(ListGZipMiddleware, minimum_size=int(os.environ.get('GZIP_MIN_SIZE', 1000))) #compresses list responses bigger than this many bytes
+
+
+#returns the titles of the given event ids in the same order, skipping events that no longer exist -> one query for all of them
+def event_titles(db: Session, event_ids):
+    if not event_ids:
+        return []
+    titles = dict(db.query(models.Event.id, models.Event.title).filter(models.Event.id.in_(event_ids)).all())
+    return [titles[event_id] for event_id in event_ids if event_id in titles]
+
+
+#returns a 304 response if the client's If-None-Match header already holds the current ETag, otherwise None
+def not_modified(etag: str, if_none_match: str = None):
+    if if_none_match and (if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+    return None
+
+
+#records count, latency and SQL usage of every request under its route template (e.g. /event/get_event)
+#and profiles the request if it carries an X-Profile header or profile query parameter
+@app.middleware('http')
+async def record_metrics(request: Request, call_next):
+    stats = metrics.RequestStats()
+    token = metrics.current_request.set(stats)
+    profile_email = request.headers.get('X-Profile') or request.query_params.get('profile')
+    profile_request = profiling.ProfileRequest(email=profile_email) if profile_email else None
+    profile_token = profiling.current_profile.set(profile_request)
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        if profile_request and profile_request.profile:
+            response.headers['X-Profile-File'] = profiling.save_profile(stats.route, profile_request.profile)
+        return response
+    finally:
+        route = stats.route or getattr(request.scope.get('route'), 'path', 'unmatched') #requests rejected before their endpoint ran
+        metrics.record_request(request.method, route, status_code, stats)
+        profiling.current_profile.reset(profile_token)
+        metrics.current_request.reset(token)
+
+
+#OpenAI calls that could not be admitted in time (see admission.py) -> 429 with the seconds to wait in Retry-After
+@app.exception_handler(admission.Rejected)
+async def over_capacity(request: Request, error: admission.Rejected):
+    return JSONResponse(status_code=status.HTTP_429_TOO_MANY_REQUESTS, content={'detail': str(error)}, headers={'Retry-After': str(error.retry_after)})
+
+
+#call this endpoint to scrape request, database and OpenAI metrics
+#not expecting any input
+#returning the metrics in the Prometheus text format
+@app.get('/metrics', response_class=PlainTextResponse)
+def get_metrics():
+    return metrics.render_all()
+
+
+#call this endpoint to check the server process is up (liveness)
+#not expecting any input
+#returning a JSON in the form {'status': 'ok'}
+@app.get('/healthz')
+def healthz():
+    return {'status': 'ok'}
+
+
+#call this endpoint to check the server can handle requests (readiness) - the database must be reachable and OpenAI configured
+#not expecting any input
+#returning a JSON with a boolean per dependency, with status 200 if all are ready and 503 otherwise
+@app.get('/readyz')
+def readyz():
+    global db_initialised
+    database_ready = check_db_connection()
+    if database_ready and not db_initialised: #database came up after startup -> create the tables now
+        db_initialised = init_db()
+    
+    checks = {'database': database_ready and db_initialised, 'openai': is_configured()}
+    return JSONResponse(status_code=status.HTTP_200_OK if all(checks.values()) else status.HTTP_503_SERVICE_UNAVAILABLE, content=checks)
+
+
+#call this endpoint to read a profile saved by a request sent with the X-Profile header
+#expecting the email of an admin user and the profile file name from the X-Profile-File response header as strings
+#returning the profile as text, sorted by cumulative time, or an error message
+@app.get('/admin/get_profile', response_class=PlainTextResponse)
+def get_profile(email: str, name: str, db: Session = Depends(get_session)):
+    user = db.query(models.User).filter(models.User.email == email).first()
+    if not user:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User not found')
+    if not user.is_admin: #PROFILING_ENABLED lets anyone profile, but profiles may show other users' data -> reading stays with admins
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User is not an admin')
+    
+    profile = profiling.read_profile(name)
+    if profile is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Profile not found')
+    return profile
+
+
+#call this endpoint to let an admin user see the state of the background job queue
+#expecting the email of the admin user as a string
+#returning a JSON in the form {'workers': number, 'counts': {kind: {status: count}}, 'oldest_pending_seconds': seconds or None, 'recent_errors': [jobs]}
+@app.get('/admin/jobs')
+def get_jobs(email: str, db: Session = Depends(get_session)):
+    user = db.query(models.User).filter(models.User.email == email).first()
+    if not user:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User not found')
+    if not user.is_admin:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User is not an admin')
+    
+    return jobs.status_summary(db)
+
+
+#call this endpoint to let an admin user rebuild the related events of all events, e.g. after restoring the database
+#expecting the email of the admin user as a string
+#returning a JSON with a success message in the form {'message': message} - the rebuild runs as a background job, see /admin/jobs
+@app.post('/admin/rebuild_related')
+def rebuild_related(email: str, db: Session = Depends(get_session)):
+    user = db.query(models.User).filter(models.User.email == email).first()
+    if not user:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User not found')
+    if not user.is_admin:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User is not an admin')
+    
+    jobs.enqueue(db, 'rebuild_related', 'all')
+    db.commit()
+    return {'message': 'Related events rebuild queued'}
+
+
+#call this endpoint to let an admin user remove registrations that point at deleted users or events, across all users and events
+#expecting the email of the admin user as a string, optionally the number of rows per batch and dry_run=true to only count them
+#returning a JSON with counts per table in the form {'users': {...}, 'events': {...}}
+@app.post('/admin/repair_registrations')
+def repair_registrations(email: str, batch_size: int = 1000, dry_run: bool = False, db: Session = Depends(get_session)):
+    user = db.query(models.User).filter(models.User.email == email).first()
+    if not user:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User not found')
+    if not user.is_admin:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User is not an admin')
+    if batch_size <= 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Please enter a valid value for Batch Size')
+    
+    return maintenance.repair_registrations(db, batch_size, dry_run)
+
+
+#call this endpoint to let an admin user find the volunteers whose profiles best fit an event
+#expecting the email of the admin user and the title of the event as strings, optionally work_status, min_age, max_age,
+#unregistered_only=true to leave out users already registered for the event, and limit and offset to page through the ranking
+#returning a JSON in the form {'total': matching users, 'volunteers': [{'email', 'full_name', 'age', 'work_status', 'score'}]}, best fit first
+#note: users are ranked once their embedding job has run, see /admin/jobs
+@app.get('/admin/match_volunteers')
+def match_volunteers(email: str, title: str, work_status: str = None, min_age: int = None, max_age: int = None,
+                     unregistered_only: bool = False, limit: int = 20, offset: int = 0, db: Session = Depends(get_session)):
+    user = db.query(models.User).filter(models.User.email == email).first()
+    if not user:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User not found')
+    if not user.is_admin:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User is not an admin')
+    
+    event = db.query(models.Event).filter(models.Event.title == title).first()
+    if not event:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Event not found')
+    if work_status is not None and work_status.lower() not in schemas.profile_choices['work_status']:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Please enter a valid value for Work Status: Student, Employed, or Unemployed')
+    if limit <= 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Please enter a valid value for Limit')
+    if offset < 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Please enter a valid value for Offset')
+    
+    admission.current_caller.set(user.id)
+    total, ranked = volunteers.rank_users(db, event, work_status, min_age, max_age, unregistered_only, limit, offset)
+    db.commit() #keeps the event's vector if it had to be embedded here
+    
+    profiles = {profile.id: profile for profile in db.query(models.User.id, models.User.email, models.User.full_name, models.User.age, models.User.work_status).filter(models.User.id.in_([user_id for user_id, score in ranked]))} if ranked else {}
+    return {'total': total,
+            'volunteers': [{'email': profiles[user_id].email,
+                            'full_name': profiles[user_id].full_name,
+                            'age': profiles[user_id].age,
+                            'work_status': profiles[user_id].work_status,
+                            'score': round(score, 4)} for user_id, score in ranked if user_id in profiles]}
+
+
+#call this endpoint to get analytics on events, volunteers and recommendations for admins
+#expecting the email of the admin user as a string
+#returning a JSON in the form {'events': {'events', 'registrations', 'capacity', 'fill_rate', 'full_events', 'per_event': [{'title', 'capacity', 'registrations', 'fill_rate'}]},
+#'users': {'total', 'work_status', 'immigration_status', 'age_band'}, 'recommended': {'users_with_recommendations', 'events': [{'title', 'users'}]}, 'computed_at', 'stale'}
+#where each breakdown maps a value to {'users', 'volunteers', 'registrations'} -> volunteers are users registered for at least one event
+#note: the report is cached -> when the data changed since it was computed, 'stale' is true and a new report is ready a few seconds later
+@app.get('/admin/analytics')
+def get_analytics(email: str, db: Session = Depends(get_session)):
+    user = db.query(models.User).filter(models.User.email == email).first()
+    if not user:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User not found')
+    if not user.is_admin:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User is not an admin')
+    
+    return analytics.report(db)
 
 
 #call this endpoint to register a user
@@ -42,6 +280,7 @@ def register_user(request: schemas.UserCreate, db: Session = Depends(get_session
     new_user = models.User(id=unique_id, email=request.email, full_name=request.full_name, password=password, age=request.age, gender=request.gender, phone_number=request.phone_number, work_status=request.work_status, immigration_status=request.immigration_status, skills=request.skills, interests=request.interests, past_volunteer_experience=request.past_volunteer_experience)
     
     db.add(new_user)
+    jobs.enqueue(db, 'embed_user', unique_id)
     db.commit()
     db.refresh(new_user)
     
@@ -76,18 +315,24 @@ def reset_database():
 #call this endpoint to get all information about a user
 #expecting the email of the user as a string
 #returning a JSON with all the information about the user - see format below 
+#send the ETag from an earlier response in the If-None-Match header to get an empty 304 response if nothing changed
 @app.get('/user/get_user')
-def get_user(email: str, db: Session = Depends(get_session)):
+def get_user(email: str, response: Response, if_none_match: str = Header(None), db: Session = Depends(get_read_session)):
     user = db.query(models.User).filter(models.User.email == email).first()
     if not user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User not found')
     
-    events_registered = []
-    for event_id in user.events_registered:
-        event = db.query(models.Event).filter(models.Event.id == event_id).first()
-        if not event:
-            continue
-        events_registered.append(event.title)
+    events = db.query(models.Event.id, models.Event.title, models.Event.version).filter(models.Event.id.in_(user.events_registered)).all() if user.events_registered else []
+    
+    #the response changes when the user changes or when one of their events is updated or deleted
+    etag = f'"{user.id}-{user.version}-{len(events)}-{max((event.version for event in events), default=0)}"'
+    cached = not_modified(etag, if_none_match)
+    if cached:
+        return cached
+    response.headers['ETag'] = etag
+    
+    titles = {event.id: event.title for event in events}
+    events_registered = [titles[event_id] for event_id in user.events_registered if event_id in titles]
     
     return {'email': user.email,
             'full_name': user.full_name,
@@ -137,6 +382,7 @@ def update_user(request: schemas.UserCreate, db: Session = Depends(get_session))
     user.interests = request.interests
     user.past_volunteer_experience = request.past_volunteer_experience
     
+    jobs.enqueue(db, 'embed_user', user.id)
     db.commit()
     return {'message': 'User and Profile updated successfully'}
 
@@ -150,6 +396,8 @@ def delete_user(email: str, db: Session = Depends(get_session)):
     if not user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User not found')
     
+    #one UPDATE takes the user off every event they registered for, in the same transaction as the delete
+    db.execute(update(models.Event).where(models.Event.users_registered.contains([user.id])).values(users_registered=func.array_remove(models.Event.users_registered, user.id)), execution_options={'synchronize_session': False})
     db.delete(user)
     db.commit()
     return {'message': 'User and Profile deleted successfully'}
@@ -159,7 +407,7 @@ def delete_user(email: str, db: Session = Depends(get_session)):
 #expecting the email of the user as a string
 #returning a JSON with a boolean value in the form {'is_admin': is_admin} or an error message if user not found
 @app.get('/user/is_admin')
-def is_admin(email: str, db: Session = Depends(get_session)):
+def is_admin(email: str, db: Session = Depends(get_read_session)):
     user = db.query(models.User).filter(models.User.email == email).first()
     if not user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User not found')
@@ -227,6 +475,7 @@ def create_event(request: schemas.ChangeEvent, db: Session = Depends(get_session
     new_event = models.Event(id=unique_id, title=request.title, date=request.date, time=request.time, requirements=request.requirements, capacity=request.capacity, deadline=request.deadline, location=request.location, description=request.description, tasks=request.tasks)
 
     db.add(new_event)
+    jobs.enqueue(db, 'embed_event', unique_id)
     db.commit()
     db.refresh(new_event)
     
@@ -261,6 +510,7 @@ def update_event(request: schemas.ChangeEvent, db: Session = Depends(get_session
     event.description = request.description
     event.tasks = request.tasks
     
+    jobs.enqueue(db, 'embed_event', event.id)
     db.commit()
     return {'message': 'Event updated successfully'}
 
@@ -280,7 +530,12 @@ def delete_event(request: schemas.AdminEvent, db: Session = Depends(get_session)
     if not event:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Event not found')
     
-    db.delete(event)
+    db.merge(models.DeletedEvent(id=event.id, title=event.title)) #record the delete for the change feed
+    #one UPDATE takes the event off every user registered for it, in the same transaction as the delete
+    db.execute(update(models.User).where(models.User.events_registered.contains([event.id])).values(events_registered=func.array_remove(models.User.events_registered, event.id)), execution_options={'synchronize_session': False})
+    related.lock(db) #wait for any running related events update, so it can't add the event back as someone's related event
+    db.delete(event) #also removes it from the related events of other events
+    jobs.enqueue(db, 'fill_related', 'all') #those events now have a free slot to fill
     db.commit()
     return {'message': 'Event deleted successfully'}
 
@@ -288,12 +543,19 @@ def delete_event(request: schemas.AdminEvent, db: Session = Depends(get_session)
 #call this endpoint to get all information about a volunteer event
 #expecting the title of the event as a string
 #returning a JSON with all the information about the event - see format below
+#send the ETag from an earlier response in the If-None-Match header to get an empty 304 response if nothing changed
 @app.get('/event/get_event')
-def get_event(title: str, db: Session = Depends(get_session)):
+def get_event(title: str, response: Response, if_none_match: str = Header(None), db: Session = Depends(get_read_session)):
     event = db.query(models.Event).filter(models.Event.title == title).first()
     if not event:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Event not found')
     
+    etag = f'"{event.id}-{event.version}"'
+    cached = not_modified(etag, if_none_match)
+    if cached:
+        return cached
+    response.headers['ETag'] = etag
+    
     return {'title': event.title,
             'date': event.date,
             'time': event.time,
@@ -306,6 +568,60 @@ def get_event(title: str, db: Session = Depends(get_session)):
             }
     
 
+#call this endpoint to get everything the event page needs in one call
+#expecting the title of the event and the email of the current user as strings (email can be 'None' if not logged in)
+#returning a JSON with the event details, remaining capacity, the user's registration and admin status, and the list of registered user emails (only filled in for admins)
+@app.get('/event/page')
+def event_page(title: str, email: str = 'None', db: Session = Depends(get_read_session)):
+    #single joined query for the event and the current user -> the user side is empty if the email does not exist
+    row = db.query(models.Event, models.User).outerjoin(models.User, models.User.email == email).filter(models.Event.title == title).first()
+    if not row:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Event not found')
+    event, user = row
+    
+    is_admin = bool(user and user.is_admin)
+    users_registered = []
+    if is_admin and event.users_registered:
+        emails = dict(db.query(models.User.id, models.User.email).filter(models.User.id.in_(event.users_registered)).all())
+        users_registered = [emails[user_id] for user_id in event.users_registered if user_id in emails] #IN returns rows in any order -> keep registration order
+    
+    return {'event': {'title': event.title,
+                      'date': event.date,
+                      'time': event.time,
+                      'requirements': event.requirements,
+                      'capacity': event.capacity,
+                      'deadline': event.deadline,
+                      'location': event.location,
+                      'description': event.description,
+                      'tasks': event.tasks
+                      },
+            'remaining_capacity': max(event.capacity - len(event.users_registered), 0),
+            'is_registered': bool(user and user.id in event.users_registered),
+            'is_admin': is_admin,
+            'users_registered': users_registered #note this is empty unless the current user is an admin
+            }
+    
+
+#call this endpoint to get the events most similar to an event, e.g. for a "similar events" section on the event page
+#expecting the title of the event as a string, and optionally how many events to return (at most RELATED_K)
+#returning a JSON with a list of similar event titles, most similar first, in the form {'related_events': [titles]} - empty until the event's embedding job has run
+@app.get('/event/related')
+def get_related_events(title: str, limit: int = 5, db: Session = Depends(get_read_session)):
+    event = db.query(models.Event.id).filter(models.Event.title == title).first()
+    if not event:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Event not found')
+    if limit <= 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Please enter a valid value for Limit')
+    
+    rows = (db.query(models.Event.title)
+            .join(models.RelatedEvent, models.RelatedEvent.related_id == models.Event.id)
+            .filter(models.RelatedEvent.event_id == event.id)
+            .order_by(models.RelatedEvent.score.desc())
+            .limit(limit)
+            .all())
+    return {'related_events': [related_title for (related_title,) in rows]}
+
+
 #call this endpoint to let user register for a volunteer event
 #expecting the email of the user and the title of the event as strings
 #returning a JSON with a success message in the form {'message': message} or a corresponding error message
@@ -315,7 +631,8 @@ def register_event(email: str, title: str, db: Session = Depends(get_session)):
     if not user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User not found')
     
-    event = db.query(models.Event).filter(models.Event.title == title).first()
+    #lock the event row like the bulk endpoints do, so concurrent registrations can't push it over capacity or overwrite each other
+    event = db.query(models.Event).filter(models.Event.title == title).with_for_update().first()
     if not event:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Event not found')
     if len(event.users_registered) >= event.capacity:
@@ -326,8 +643,11 @@ def register_event(email: str, title: str, db: Session = Depends(get_session)):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User already registered for event')
     
     event.users_registered = event.users_registered + [user.id]
-    user.events_registered = user.events_registered + [event.id]
+    #appended in the database rather than from the copy read above -> a registration for another event at the same time isn't lost
+    db.execute(update(models.User).where(models.User.id == user.id, func.array_position(models.User.events_registered, event.id).is_(None))
+               .values(events_registered=func.array_append(models.User.events_registered, event.id)))
     db.commit()
+    coregistration.registrations_changed(event.id, event.users_registered) #this process ranks with it right away, others on their next refresh
     return {'message': 'User registered for event successfully'}
 
 
@@ -340,7 +660,7 @@ def unregister_event(email: str, title: str, db: Session = Depends(get_session))
     if not user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User not found')
     
-    event = db.query(models.Event).filter(models.Event.title == title).first()
+    event = db.query(models.Event).filter(models.Event.title == title).with_for_update().first()
     if not event:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Event not found')
     
@@ -349,8 +669,9 @@ def unregister_event(email: str, title: str, db: Session = Depends(get_session))
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User not registered for event')
     
     event.users_registered = [x for x in event.users_registered if x != user.id]
-    user.events_registered = [x for x in user.events_registered if x != event.id]
+    db.execute(update(models.User).where(models.User.id == user.id).values(events_registered=func.array_remove(models.User.events_registered, event.id)))
     db.commit()
+    coregistration.registrations_changed(event.id, event.users_registered)
     return {'message': 'User unregistered from event successfully'}
 
 
@@ -369,11 +690,9 @@ def get_event_registers(request: schemas.AdminEvent, db: Session = Depends(get_s
     if not event:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Event not found')
     
-    users_registered = []
-    for user_id in event.users_registered:
-        user = db.query(models.User).filter(models.User.id == user_id).first()
-        users_registered.append(user.email)
-        
+    #one query for all of them, in registration order -> ids of users deleted since are skipped
+    emails = dict(db.query(models.User.id, models.User.email).filter(models.User.id.in_(event.users_registered)).all())
+    users_registered = [emails[user_id] for user_id in event.users_registered if user_id in emails]
     return {'users_registered': users_registered}
 
 
@@ -392,10 +711,7 @@ def admin_get_user(request: schemas.ChangeAdmin, db: Session = Depends(get_sessi
     if not new_user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='New User not found')
     
-    events_registered = []
-    for event_id in new_user.events_registered:
-        event = db.query(models.Event).filter(models.Event.id == event_id).first()
-        events_registered.append(event.title)
+    events_registered = event_titles(db, new_user.events_registered)
     
     return {'email': new_user.email,
             'full_name': new_user.full_name,
@@ -427,7 +743,7 @@ def admin_kick_user(request: schemas.KickUser, db: Session = Depends(get_session
     if not new_user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='New User not found')
     
-    event = db.query(models.Event).filter(models.Event.title == request.title).first()
+    event = db.query(models.Event).filter(models.Event.title == request.title).with_for_update().first()
     if not event:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Event not found')
     
@@ -435,44 +751,178 @@ def admin_kick_user(request: schemas.KickUser, db: Session = Depends(get_session
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='New User not registered for event')
     
     event.users_registered = [x for x in event.users_registered if x != new_user.id]
-    new_user.events_registered = [x for x in new_user.events_registered if x != event.id]
+    db.execute(update(models.User).where(models.User.id == new_user.id).values(events_registered=func.array_remove(models.User.events_registered, event.id)))
     db.commit()
+    coregistration.registrations_changed(event.id, event.users_registered)
     
     return {'message': 'User kicked from event successfully'}
 
 
+def bulk_event_users(request: schemas.BulkEventUsers, db: Session): #shared checks of the bulk endpoints -> returns the event, locked, and the named users by email
+    admin = db.query(models.User).filter(models.User.email == request.email).first()
+    if not admin:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Admin User not found')
+    if not admin.is_admin:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Current User is not an admin')
+    if len(request.user_emails) > BULK_MAX_USERS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f'Please send at most {BULK_MAX_USERS} users at once')
+    
+    #lock the event row so concurrent registrations can't push it over capacity or overwrite this change
+    event = db.query(models.Event).filter(models.Event.title == request.title).with_for_update().first()
+    if not event:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Event not found')
+    
+    users = db.query(models.User.id, models.User.email).filter(models.User.email.in_(set(request.user_emails))).all()
+    return event, {user.email: user.id for user in users}
+
+
+#call this endpoint to let an admin user register many users for a volunteer event at once
+#users are registered in the order given until the event is full, and all changes are saved together
+#expecting a JSON in the schema of BulkEventUsers
+#returning a JSON in the form {'results': [{'email': email, 'status': status}], 'registered': number, 'remaining_capacity': number}
+#where status is one of 'registered', 'already_registered', 'event_full', 'user_not_found' or 'duplicate' (email named earlier in the list)
+@app.post('/admin/bulk_register')
+def admin_bulk_register(request: schemas.BulkEventUsers, db: Session = Depends(get_session)):
+    event, user_ids = bulk_event_users(request, db)
+    
+    registered = set(event.users_registered)
+    remaining = event.capacity - len(event.users_registered)
+    added, results, seen = [], [], set()
+    for email in request.user_emails:
+        user_id = user_ids.get(email)
+        if email in seen:
+            outcome = 'duplicate'
+        elif user_id is None:
+            outcome = 'user_not_found'
+        elif user_id in registered:
+            outcome = 'already_registered'
+        elif len(added) >= remaining:
+            outcome = 'event_full'
+        else:
+            outcome = 'registered'
+            added.append(user_id)
+        seen.add(email)
+        results.append({'email': email, 'status': outcome})
+    
+    if added:
+        event.users_registered = event.users_registered + added
+        #users whose own list already names the event (e.g. left behind by an old unregister) don't get it twice
+        db.execute(update(models.User).where(models.User.id.in_(added), func.array_position(models.User.events_registered, event.id).is_(None))
+                   .values(events_registered=func.array_append(models.User.events_registered, event.id)))
+    db.commit()
+    if added:
+        coregistration.registrations_changed(event.id, event.users_registered)
+    
+    return {'results': results, 'registered': len(added), 'remaining_capacity': max(remaining - len(added), 0)}
+
+
+#call this endpoint to let an admin user kick many users from a volunteer event at once, all changes are saved together
+#expecting a JSON in the schema of BulkEventUsers
+#returning a JSON in the form {'results': [{'email': email, 'status': status}], 'kicked': number}
+#where status is one of 'kicked', 'not_registered', 'user_not_found' or 'duplicate' (email named earlier in the list)
+@app.post('/admin/bulk_kick')
+def admin_bulk_kick(request: schemas.BulkEventUsers, db: Session = Depends(get_session)):
+    event, user_ids = bulk_event_users(request, db)
+    
+    registered = set(event.users_registered)
+    removed, results, seen = set(), [], set()
+    for email in request.user_emails:
+        user_id = user_ids.get(email)
+        if email in seen:
+            outcome = 'duplicate'
+        elif user_id is None:
+            outcome = 'user_not_found'
+        elif user_id not in registered:
+            outcome = 'not_registered'
+        else:
+            outcome = 'kicked'
+            removed.add(user_id)
+        seen.add(email)
+        results.append({'email': email, 'status': outcome})
+    
+    if removed:
+        event.users_registered = [x for x in event.users_registered if x not in removed]
+        db.execute(update(models.User).where(models.User.id.in_(removed)).values(events_registered=func.array_remove(models.User.events_registered, event.id)))
+    db.commit()
+    if removed:
+        coregistration.registrations_changed(event.id, event.users_registered)
+    
+    return {'results': results, 'kicked': len(removed)}
+
+
 #call this endpoint to get a list of all events
 #not expecting any input
 #returning a JSON with a list of all event titles
+#send the ETag from an earlier response in the If-None-Match header to get an empty 304 response if nothing changed
 @app.get('/event/get_events')
-def get_events(db: Session = Depends(get_session)):
-    events = db.query(models.Event).all()
+def get_events(response: Response, if_none_match: str = Header(None), db: Session = Depends(get_read_session)):
+    #any create or update raises the highest version and any delete lowers the count -> together they identify the list
+    latest_version, count = db.query(func.max(models.Event.version), func.count(models.Event.id)).one()
+    etag = f'"events-{latest_version or 0}-{count}"'
+    cached = not_modified(etag, if_none_match)
+    if cached:
+        return cached
+    response.headers['ETag'] = etag
+    
+    events = db.query(models.Event.title).all()
     event_titles = [event.title for event in events]
     return {'event_titles': event_titles}
+
+
+#call this endpoint to get every event created, updated or deleted after a given version - used to keep a local copy of the events in sync
+#expecting the last version already seen as an integer (0 for everything) and optionally the maximum number of changes to return
+#returning a JSON with the changed events, the ids of deleted events and the version to ask from next time - see format below
+#note: versions are taken when a write happens, not when it commits, so clients should do a full resync (since=0) now and then
+@app.get('/event/changes')
+def event_changes(since: int = 0, limit: int = 500, db: Session = Depends(get_read_session)):
+    if limit <= 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Please enter a valid value for Limit')
+    
+    events = db.query(models.Event).filter(models.Event.version > since).order_by(models.Event.version).limit(limit).all()
+    deleted = db.query(models.DeletedEvent).filter(models.DeletedEvent.version > since).order_by(models.DeletedEvent.version).limit(limit).all()
+    
+    #if either list was cut off at the limit, only report up to where it stopped so nothing in between is skipped
+    has_more = len(events) == limit or len(deleted) == limit
+    if has_more:
+        version = min(rows[-1].version for rows in (events, deleted) if len(rows) == limit)
+    else:
+        version = max([rows[-1].version for rows in (events, deleted) if rows], default=since)
+    
+    return {'version': version,
+            'has_more': has_more,
+            'events': [{'id': event.id,
+                        'title': event.title,
+                        'date': event.date,
+                        'time': event.time,
+                        'requirements': event.requirements,
+                        'capacity': event.capacity,
+                        'deadline': event.deadline,
+                        'location': event.location,
+                        'description': event.description,
+                        'tasks': event.tasks,
+                        'registered': len(event.users_registered),
+                        'version': event.version
+                        } for event in events if event.version <= version],
+            'deleted': [event.id for event in deleted if event.version <= version] #note this is a list of event ids
+            }
     
 
 #call this endpoint to get the list of events a user is registered for
 #expecting the email of the user as a string
 #returning a JSON with a list of all event titles the user is registered for
 @app.get('/user/get_user_events')
-def get_user_events(email: str, db: Session = Depends(get_session)):
+def get_user_events(email: str, db: Session = Depends(get_read_session)):
     user = db.query(models.User).filter(models.User.email == email).first()
     if not user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User not found')
     
-    events_registered = []
-    for event_id in user.events_registered:
-        event = db.query(models.Event).filter(models.Event.id == event_id).first()
-        if not event:
-            continue
-        events_registered.append(event.title)
-    
-    return {'events_registered': events_registered}
+    return {'events_registered': event_titles(db, user.events_registered)}
 
 
 #call this endpoint to generate personalized tasks for a user based on an event
 #expecting a JSON in the schema of GenerateTasks
-#returning a JSON containing a single string that is the model's response
+#returning a JSON in the form {'response': the model's response, 'metadata': {'prompt_tokens': tokens, 'sections': {section: {'tokens', 'original_tokens'}}, 'usage': {'prompt_tokens', 'completion_tokens', 'cached'}}}
+#when the tasks were generated earlier for a volunteer with a nearly identical profile, usage also has the 'similarity' of the two profiles - see task_cache.py
 @app.post('/user/generate_tasks')
 def generate_tasks_llm(request: schemas.GenerateTasks, db: Session = Depends(get_session)):
     event = db.query(models.Event).filter(models.Event.title == request.event_title).first()
@@ -483,33 +933,42 @@ def generate_tasks_llm(request: schemas.GenerateTasks, db: Session = Depends(get
     if not user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User not found')
     
-    event_description = 'Event Description: \n' + event.description + '\n\n' + 'Event Tasks: \n' + event.tasks
-    user_description = 'User Skills: \n' + user.skills + '\n\n' + 'User Interests: \n' + user.interests + '\n\n' + 'User Past Volunteer Experience: \n' + user.past_volunteer_experience
+    admission.current_caller.set(user.id) #counts the call towards this user's limit -> see admission.py
+    prompt = prompts.build_task_prompt(event, user) #each section is trimmed to its token budget -> see prompts.py
     
-    return {'response': generate_tasks(event_description, user_description)}
+    try:
+        user_vector, user_scale = vectors.get_user_vector(db, user)
+        db.commit()
+    except Exception as error: #e.g. the embedding provider is down -> generate the tasks without looking for a similar profile
+        db.rollback()
+        print(f'No profile vector for the task cache: {error!r}')
+        user_vector = None
+    
+    match = task_cache.lookup(event, user_vector, user_scale) if user_vector is not None else None
+    if match:
+        response, similarity = match
+        return {'response': response, 'metadata': {**prompt.metadata(), 'usage': {'prompt_tokens': 0, 'completion_tokens': 0, 'cached': True, 'similarity': round(similarity, 4)}}}
+    
+    response, usage = generate_tasks(prompt.text)
+    if user_vector is not None:
+        task_cache.store(event, user.id, user_vector, user_scale, response)
+    
+    return {'response': response, 'metadata': {**prompt.metadata(), 'usage': usage}}
 
 
 #call this endpoint to get the top 5 most similar events to a given user's profile
 #expecting the email of the user as a string
-#returning a JSON with a list of the top 5 most similar event titles - will return less than 5 if there are less than 5 events in the database
+#returning a JSON with a list of the top 5 most similar event titles and the strategy that chose them, in the form {'top_5_events': [titles], 'strategy': strategy}
+#strategy is 'personalized', or 'last_cached' / 'popular' when the ranking took too long or the embedding provider failed - see recommendations.py
+#will return less than 5 if there are less than 5 events in the database
 @app.get('/user/get_similar_events')
 def match_events(email: str, db: Session = Depends(get_session)):
     user = db.query(models.User).filter(models.User.email == email).first()
     if not user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User not found')
     
-    events = db.query(models.Event).all()
-    event_descriptions = [event.description for event in events]
-    user_description = user.skills + ' ' + user.interests + ' ' + user.past_volunteer_experience
-    
-    event_embeddings = [get_embeddings(event) for event in event_descriptions]
-    user_embedding = get_embeddings(user_description)
-    
-    similarities = [get_cosine_similarity(user_embedding, event_embedding) for event_embedding in event_embeddings]
-    top_5_indices = sorted(range(len(similarities)), key=lambda i: similarities[i], reverse=True)[:5]
-    top_5_events = [events[i].title for i in top_5_indices]
-    
-    return {'top_5_events': top_5_events}
+    titles, strategy = recommendations.recommend(db, user)
+    return {'top_5_events': titles, 'strategy': strategy}
 
 
 #call this endpoint to check if a user is registered for an event
@@ -0,0 +1,51 @@
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+#repairs registrations that point at users or events that no longer exist, e.g. left behind by deletes before they cleaned up after themselves
+#each batch is its own short transaction, so the repair can run on a live database
+
+#(table, array column, table the array points at, version sequence of table)
+REFERENCES = [('users', 'events_registered', 'events', 'user_version_seq'),
+              ('events', 'users_registered', 'users', 'event_version_seq')]
+
+def repair_batch(db: Session, table: str, column: str, target: str, sequence: str, after: str, batch_size: int):
+    """Removes dangling ids from column for the next batch_size rows of table with an id above after.
+
+    Returns the last id of the batch (None when the table is done) and the number of rows repaired.
+    """
+    ids = [row_id for (row_id,) in db.execute(text(f'SELECT id FROM {table} WHERE id > :after ORDER BY id LIMIT :batch_size'), {'after': after, 'batch_size': batch_size})]
+    if not ids:
+        return None, 0
+
+    #keep the ids that still exist, in their original order -> only rows with at least one dangling id are written
+    repaired = db.execute(text(f'''
+        UPDATE {table} AS r SET
+            {column} = ARRAY(SELECT item FROM unnest(r.{column}) WITH ORDINALITY AS t(item, position)
+                             WHERE EXISTS (SELECT 1 FROM {target} WHERE {target}.id = item) ORDER BY position),
+            version = nextval('{sequence}')
+        WHERE r.id = ANY(:ids)
+          AND EXISTS (SELECT 1 FROM unnest(r.{column}) AS item WHERE NOT EXISTS (SELECT 1 FROM {target} WHERE {target}.id = item))'''), {'ids': ids}).rowcount
+    db.commit()
+    return ids[-1], repaired
+
+def repair_registrations(db: Session, batch_size: int = 1000, dry_run: bool = False):
+    """Walks users and events in id order, batch_size rows at a time, and removes registrations of missing rows.
+
+    With dry_run the dangling references are only counted. Returns the counts per table.
+    """
+    report = {}
+    for table, column, target, sequence in REFERENCES:
+        if dry_run:
+            count = db.execute(text(f'''
+                SELECT count(*) FROM {table} AS r
+                WHERE EXISTS (SELECT 1 FROM unnest(r.{column}) AS item WHERE NOT EXISTS (SELECT 1 FROM {target} WHERE {target}.id = item))''')).scalar()
+            report[table] = {'rows_with_dangling_references': count}
+            continue
+
+        after, repaired, batches = '', 0, 0
+        while after is not None:
+            after, count = repair_batch(db, table, column, target, sequence, after, batch_size)
+            repaired += count
+            batches += after is not None
+        report[table] = {'rows_repaired': repaired, 'batches': batches}
+    return report
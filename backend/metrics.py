@@ -0,0 +1,229 @@
+"""
+In-process request, database and OpenAI metrics, rendered in the Prometheus text format by the /metrics endpoint.
+
+Request handling records into the current request's RequestStats (a context variable set by the middleware in main.py),
+so SQL time and query counts can be attributed to the route that caused them.
+"""
+import bisect
+import contextvars
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Optional
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _label_string(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+    
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_label_string(self.labelnames, key)} {value}')
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+    
+    def render(self):
+        lines = super().render()
+        lines[1] = f'# TYPE {self.name} gauge'
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {} #label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+    
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            state = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+    
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, state in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, state):
+                    cumulative += count
+                    lines.append(f'{self.name}_bucket{_label_string(self.labelnames + ("le",), key + (bound,))} {cumulative}')
+                lines.append(f'{self.name}_bucket{_label_string(self.labelnames + ("le",), key + ("+Inf",))} {state[-1]}')
+                lines.append(f'{self.name}_sum{_label_string(self.labelnames, key)} {state[-2]}')
+                lines.append(f'{self.name}_count{_label_string(self.labelnames, key)} {state[-1]}')
+        return lines
+
+
+REGISTRY = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+def render_all():
+    return '\n'.join(line for metric in REGISTRY for line in metric.render()) + '\n'
+
+
+#HTTP
+http_requests = register(Counter('http_requests_total', 'HTTP requests handled', ('method', 'route', 'status')))
+http_request_duration = register(Histogram('http_request_duration_seconds', 'Time to handle an HTTP request', ('method', 'route')))
+
+#database, per request
+db_queries_per_request = register(Histogram('db_queries_per_request', 'SQL statements run while handling one request', ('route',), COUNT_BUCKETS))
+db_time_per_request = register(Histogram('db_time_per_request_seconds', 'Time spent in SQL while handling one request', ('route',)))
+db_queries = register(Counter('db_queries_total', 'SQL statements run', ('route',)))
+db_read_sessions = register(Counter('db_read_sessions_total', 'Sessions opened for read-only requests, by the database that served them', ('database',)))
+db_replica_healthy = register(Gauge('db_replica_healthy', 'Whether a read replica passed its last health check (1) or is skipped (0)', ('replica',)))
+
+#OpenAI
+openai_requests = register(Counter('openai_requests_total', 'Calls to the OpenAI API', ('kind', 'model')))
+openai_request_duration = register(Histogram('openai_request_duration_seconds', 'Time per OpenAI API call', ('kind', 'model')))
+openai_tokens = register(Counter('openai_tokens_total', 'Tokens used by OpenAI API calls', ('kind', 'model', 'type')))
+openai_errors = register(Counter('openai_errors_total', 'OpenAI API calls that raised', ('kind', 'model', 'error')))
+
+#cache
+cache_requests = register(Counter('cache_requests_total', 'Cache lookups, stampede waits and store errors', ('namespace', 'outcome')))
+
+#admission control of OpenAI calls
+admission_queue_depth = register(Gauge('admission_queue_depth', 'OpenAI calls waiting to be admitted', ('kind',)))
+admission_wait = register(Histogram('admission_wait_seconds', 'Time an admitted OpenAI call waited to start', ('kind',)))
+admission_rejected = register(Counter('admission_rejected_total', 'OpenAI calls turned away with a 429', ('kind', 'reason')))
+admission_limit = register(Gauge('admission_concurrency_limit', 'OpenAI calls allowed at once, lowered after upstream rate limits', ('kind',)))
+
+#near-duplicate cache of generated tasks
+task_cache_lookups = register(Counter('task_cache_lookups_total', 'Generated task lookups by profile similarity', ('outcome',)))
+task_cache_similarity = register(Histogram('task_cache_similarity', 'Similarity of the closest cached profile at each lookup', (), (0.5, 0.7, 0.8, 0.85, 0.9, 0.925, 0.95, 0.975, 0.99, 1.0)))
+
+#recommendations
+recommendations_served = register(Counter('recommendations_served_total', 'Recommendation lists served, by strategy and the reason a fallback was used', ('strategy', 'reason')))
+
+#background jobs
+jobs_run = register(Counter('jobs_run_total', 'Background jobs run by the workers', ('kind', 'outcome')))
+job_duration = register(Histogram('job_duration_seconds', 'Time to run one background job', ('kind',)))
+
+
+@dataclass
+class RequestStats:
+    route: Optional[str] = None #route template, set once the request reaches its endpoint
+    db_queries: int = 0
+    db_time: float = 0.0
+    started: float = field(default_factory=time.perf_counter)
+
+
+current_request = contextvars.ContextVar('current_request', default=None)
+
+
+def record_query(duration):
+    stats = current_request.get()
+    if stats is None: #not inside a request, e.g. startup or a background thread
+        db_queries.inc(route='background')
+        return
+    stats.db_queries += 1
+    stats.db_time += duration
+
+
+def record_request(method, route, status_code, stats):
+    duration = time.perf_counter() - stats.started
+    http_requests.inc(method=method, route=route, status=status_code)
+    http_request_duration.observe(duration, method=method, route=route)
+    db_queries.inc(stats.db_queries, route=route)
+    db_queries_per_request.observe(stats.db_queries, route=route)
+    db_time_per_request.observe(stats.db_time, route=route)
+
+
+def record_openai_call(kind, model, duration, prompt_tokens=0, completion_tokens=0, error=None):
+    openai_requests.inc(kind=kind, model=model)
+    openai_request_duration.observe(duration, kind=kind, model=model)
+    if prompt_tokens:
+        openai_tokens.inc(prompt_tokens, kind=kind, model=model, type='prompt')
+    if completion_tokens:
+        openai_tokens.inc(completion_tokens, kind=kind, model=model, type='completion')
+    if error is not None:
+        openai_errors.inc(kind=kind, model=model, error=type(error).__name__)
+
+
+def record_job(kind, duration, outcome):
+    jobs_run.inc(kind=kind, outcome=outcome)
+    job_duration.observe(duration, kind=kind)
+
+
+def record_cache(namespace, hits=0, misses=0, waits=0, errors=0):
+    for outcome, count in (('hit', hits), ('miss', misses), ('wait', waits), ('error', errors)):
+        if count:
+            cache_requests.inc(count, namespace=namespace, outcome=outcome)
+
+
+def record_admission_queue(kind, depth):
+    admission_queue_depth.set(depth, kind=kind)
+
+
+def record_admission_wait(kind, seconds):
+    admission_wait.observe(seconds, kind=kind)
+
+
+def record_admission_rejected(kind, reason):
+    admission_rejected.inc(kind=kind, reason=reason)
+
+
+def record_admission_limit(kind, limit):
+    admission_limit.set(limit, kind=kind)
+
+
+def record_task_cache(hit):
+    task_cache_lookups.inc(outcome='hit' if hit else 'miss')
+
+
+def record_task_cache_similarity(similarity):
+    task_cache_similarity.observe(similarity)
+
+
+def record_recommendation(strategy, reason='none'):
+    recommendations_served.inc(strategy=strategy, reason=reason)
+
+
+def record_read_session(database):
+    db_read_sessions.inc(database=database)
+
+
+def record_replica_health(replica, healthy):
+    db_replica_healthy.set(int(healthy), replica=replica)
@@ -1,6 +1,12 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ARRAY
+from sqlalchemy import Column, Integer, BigInteger, String, Boolean, DateTime, Float, LargeBinary, Sequence, ForeignKey, Index, func
+from sqlalchemy.dialects.postgresql import ARRAY #the postgres ARRAY type supports @> (contains), which the GIN indexes below speed up
 from database import Base
 
+#every insert or update of an event takes the next value -> lets clients ask for all event changes since a version they have seen
+event_version_seq = Sequence('event_version_seq', metadata=Base.metadata)
+#same for users -> used to tell clients whether their cached copy of a user is still current
+user_version_seq = Sequence('user_version_seq', metadata=Base.metadata)
+
 class User(Base): #table to store users - all fields required
     __tablename__ = 'users'
     id = Column(String, primary_key=True, index=True) #index=True is used to make the column searchable
@@ -17,6 +23,10 @@ class User(Base): #table to store users - all fields required
     interests = Column(String, nullable=False)
     past_volunteer_experience = Column(String, nullable=False)
     events_registered = Column(ARRAY(String), default=[]) #stores the ids of the events the user has registered for -> default is empty
+    version = Column(BigInteger, user_version_seq, onupdate=user_version_seq.next_value(), nullable=False) #bumped on every write to the user
+    
+    #GIN index -> finding every user registered for an event (events_registered @> ARRAY[id]) doesn't scan the table
+    __table_args__ = (Index('ix_users_events_registered', 'events_registered', postgresql_using='gin'),)
     
 
 class Event(Base): #table to store volunteer events - all fields required
@@ -32,4 +42,65 @@ class Event(Base): #table to store volunteer events - all fields required
     description = Column(String, nullable=False)
     tasks = Column(String, nullable=False)
     users_registered = Column(ARRAY(String), default=[]) #stores the ids of the users who have registered for the event -> default is empty
-    
\ No newline at end of file
+    version = Column(BigInteger, event_version_seq, onupdate=event_version_seq.next_value(), nullable=False, index=True) #bumped on every write to the event
+    
+    #GIN index -> finding every event a user registered for (users_registered @> ARRAY[id]) doesn't scan the table
+    __table_args__ = (Index('ix_events_users_registered', 'users_registered', postgresql_using='gin'),)
+    
+
+class DeletedEvent(Base): #table to remember deleted events so the change feed can report them
+    __tablename__ = 'deleted_events'
+    id = Column(String, primary_key=True, index=True) #id of the deleted event
+    title = Column(String, nullable=False)
+    version = Column(BigInteger, event_version_seq, nullable=False, index=True) #version of the delete, from the same sequence as event writes
+    
+
+class EventVector(Base): #table to store the embedding of each event's description - kept apart from events so event reads don't load it
+    __tablename__ = 'event_embeddings' #compact successor of the event_vectors table, which stored float lists -> see vectors.py for the format
+    event_id = Column(String, ForeignKey('events.id', ondelete='CASCADE'), primary_key=True)
+    format = Column(String, nullable=False) #float32, float16 or int8
+    dimensions = Column(Integer, nullable=False)
+    scale = Column(Float, nullable=False) #multiplies the stored values back into a unit vector
+    data = Column(LargeBinary, nullable=False) #the vector as raw bytes of the format's type
+    updated_at = Column(DateTime, nullable=False, server_default=func.now(), onupdate=func.now())
+    
+
+class UserVector(Base): #table to store the embedding of each user's skills, interests and experience
+    __tablename__ = 'user_embeddings' #same format as event_embeddings
+    user_id = Column(String, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    format = Column(String, nullable=False)
+    dimensions = Column(Integer, nullable=False)
+    scale = Column(Float, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    updated_at = Column(DateTime, nullable=False, server_default=func.now(), onupdate=func.now(), index=True) #index to read only the vectors written lately -> see volunteers.py
+    
+
+class Job(Base): #table to store background jobs run by the workers in jobs.py
+    __tablename__ = 'jobs'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kind = Column(String, nullable=False) #which handler runs the job, e.g. 'embed_event'
+    entity_id = Column(String, nullable=False) #id of the event or user the job is about
+    status = Column(String, nullable=False, default='pending') #pending, running, done, failed or superseded
+    attempts = Column(Integer, nullable=False, default=0)
+    run_after = Column(DateTime, nullable=False, server_default=func.now()) #when a pending job may start, or when a running job's lease runs out
+    last_error = Column(String)
+    created_at = Column(DateTime, nullable=False, server_default=func.now())
+    updated_at = Column(DateTime, nullable=False, server_default=func.now(), onupdate=func.now())
+    
+    #at most one pending job per kind and entity -> enqueueing the same work again while it waits is a no-op
+    __table_args__ = (Index('ix_jobs_pending_unique', 'kind', 'entity_id', unique=True, postgresql_where=(status == 'pending')),
+                      Index('ix_jobs_status_run_after', 'status', 'run_after'))
+    
+
+class RelatedEvent(Base): #table to store the most similar events of each event, kept up to date by related.py
+    __tablename__ = 'related_events'
+    event_id = Column(String, ForeignKey('events.id', ondelete='CASCADE'), primary_key=True)
+    related_id = Column(String, ForeignKey('events.id', ondelete='CASCADE'), primary_key=True, index=True) #index to find the events that list a given event
+    score = Column(Float, nullable=False) #cosine similarity of the two event vectors
+    
+
+class UserRecommendation(Base): #table to store the latest personalized recommendations of each user, counted in analytics.py
+    __tablename__ = 'user_recommendations'
+    user_id = Column(String, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    event_ids = Column(ARRAY(String), nullable=False) #best first
+    updated_at = Column(DateTime, nullable=False, server_default=func.now(), onupdate=func.now(), index=True) #index -> the latest change is read without a scan
@@ -1,24 +1,88 @@
+import hashlib
 import os
-from openai import OpenAI
-from langchain_openai import ChatOpenAI 
+import time
+from functools import lru_cache
 from numpy import dot
 from numpy.linalg import norm
+from cache import get_cache
+import admission, metrics
 
-openai_api_key = os.environ.get("OPENAI_API_KEY")
+EMBEDDING_MODEL = "text-embedding-3-small"
+CHAT_MODEL = 'gpt-3.5-turbo-0125'
+EMBEDDING_CACHE_TTL = int(os.environ.get("EMBEDDING_CACHE_TTL", 30 * 24 * 3600)) #seconds an embedding stays cached
+TASKS_CACHE_TTL = int(os.environ.get("TASKS_CACHE_TTL", 24 * 3600)) #seconds a generated task reply stays cached
 
-embeddings = OpenAI(api_key=openai_api_key)
+#the OpenAI and LangChain clients are slow to import and fail without an API key -> build them on first use instead of at import
+def is_configured():
+    return bool(os.environ.get("OPENAI_API_KEY"))
 
-llm = ChatOpenAI(openai_api_key=openai_api_key, model='gpt-3.5-turbo-0125', temperature=0.5)
+@lru_cache(maxsize=None)
+def get_embeddings_client():
+    from openai import OpenAI
+    return OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
 
-def generate_tasks(event_description: str, user_description: str):
-    context = 'Here is a description and list of tasks of the volunteering event: \n' + event_description + '\n\n' + "Here is the user's list of skills, description of his interests and past volunteer experiences : " + user_description + '\n\n'
-    query = 'Can you generate 3 to 5 personalized tasks for the user that are tailored to the event? Try not to repeat tasks that are already in the event description. Do not use any lists, keep the response in a single paragraph.'
+@lru_cache(maxsize=None)
+def get_llm():
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(openai_api_key=os.environ.get("OPENAI_API_KEY"), model=CHAT_MODEL, temperature=0.5)
 
-    prompt = context + '\n\n' + query
-    return llm.invoke(prompt).content
+def task_key(prompt: str):
+    return hashlib.sha256(f'{CHAT_MODEL}:{prompt}'.encode()).hexdigest()
 
-def get_embeddings(text: str):
-    return embeddings.embeddings.create(input=text, model="text-embedding-3-small").data[0].embedding
+def generate_tasks(prompt: str): #prompt comes from prompts.build_task_prompt -> returns the reply and the token usage of the call
+    usage = {}
+    def call():
+        content, call_usage = chat(prompt)
+        usage.update(call_usage)
+        return content
+    #the same prompt (same event and user text) within TASKS_CACHE_TTL gets the same reply -> no tokens spent
+    content = get_cache('tasks').get_or_set(task_key(prompt), call, TASKS_CACHE_TTL)
+    return content, usage or {'prompt_tokens': 0, 'completion_tokens': 0, 'cached': True}
+
+def chat(prompt: str):
+    from langchain_community.callbacks import get_openai_callback
+    
+    llm = get_llm()
+    with admission.chat.admit(): #waits for a free slot, or raises admission.Rejected
+        start = time.perf_counter()
+        try:
+            with get_openai_callback() as callback: #collects token usage of the call
+                content = llm.invoke(prompt).content
+        except Exception as error:
+            metrics.record_openai_call('chat', CHAT_MODEL, time.perf_counter() - start, error=error)
+            raise
+    metrics.record_openai_call('chat', CHAT_MODEL, time.perf_counter() - start, callback.prompt_tokens, callback.completion_tokens)
+    return content, {'prompt_tokens': callback.prompt_tokens, 'completion_tokens': callback.completion_tokens, 'cached': False}
+
+def embedding_key(text: str, dimensions: int = None):
+    return f'{EMBEDDING_MODEL}:{dimensions or "full"}:' + hashlib.sha256(text.encode()).hexdigest()
+
+def embed(texts, dimensions: int = None): #one API call for a list of texts
+    with admission.embedding.admit(): #waits for a free slot, or raises admission.Rejected
+        start = time.perf_counter()
+        try:
+            options = {'dimensions': dimensions} if dimensions else {}
+            response = get_embeddings_client().embeddings.create(input=texts, model=EMBEDDING_MODEL, **options)
+        except Exception as error:
+            metrics.record_openai_call('embedding', EMBEDDING_MODEL, time.perf_counter() - start, error=error)
+            raise
+    metrics.record_openai_call('embedding', EMBEDDING_MODEL, time.perf_counter() - start, response.usage.prompt_tokens)
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+def get_embeddings(text: str, dimensions: int = None): #dimensions asks the model for a shorter vector, None for the full length
+    #the same text always has the same embedding -> cached, and concurrent misses of one text make a single call
+    return get_cache('embeddings').get_or_set(embedding_key(text, dimensions), lambda: embed([text], dimensions)[0], EMBEDDING_CACHE_TTL)
+
+def get_embeddings_many(texts, dimensions: int = None): #embeddings of several texts, in order -> the ones not cached are fetched in one call
+    cache = get_cache('embeddings')
+    keys = [embedding_key(text, dimensions) for text in texts]
+    found = cache.get_many(keys)
+    missing = list(dict.fromkeys(text for text, key in zip(texts, keys) if key not in found))
+    if missing:
+        fetched = dict(zip([embedding_key(text, dimensions) for text in missing], embed(missing, dimensions)))
+        cache.set_many(fetched, EMBEDDING_CACHE_TTL)
+        found.update(fetched)
+    return [found[key] for key in keys]
 
 def get_cosine_similarity(embedding1, embedding2):
     return dot(embedding1, embedding2)/(norm(embedding1)*norm(embedding2))
\ No newline at end of file
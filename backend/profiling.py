@@ -0,0 +1,112 @@
+"""
+Opt-in profiling of single requests.
+
+Send a request with the header `X-Profile: <your email>` (or the query parameter `profile=<your email>`) and the
+endpoint runs under cProfile. The profile is saved in PROFILE_DIR and its file name comes back in the
+`X-Profile-File` header - read it with /admin/get_profile (admins only). Only admins may profile unless PROFILING_ENABLED=1.
+
+Endpoints are wrapped through ProfiledRoute because FastAPI runs sync endpoints in a thread pool,
+where a profiler started by the middleware would not see them. Async endpoints keep an async wrapper so FastAPI
+still awaits them - their profile also counts whatever else the event loop runs while they wait.
+"""
+import asyncio
+import contextvars
+import cProfile
+import functools
+import io
+import os
+import pstats
+import re
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Optional
+
+from fastapi.concurrency import run_in_threadpool
+from fastapi.routing import APIRoute
+
+import metrics
+
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '0') == '1' #let anyone profile, not only admins
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+
+
+@dataclass
+class ProfileRequest:
+    email: str
+    profile: Optional[cProfile.Profile] = None
+
+
+current_profile = contextvars.ContextVar('current_profile', default=None)
+
+
+def is_allowed(email):
+    if PROFILING_ENABLED:
+        return True
+    import models
+    from database import SessionLocal
+    session = SessionLocal()
+    try:
+        user = session.query(models.User).filter(models.User.email == email).first()
+        return bool(user and user.is_admin)
+    finally:
+        session.close()
+
+
+class ProfiledRoute(APIRoute):
+    """
+    Route that tags the request with its route template and, when asked for, runs the endpoint under cProfile
+    """
+    def __init__(self, path, endpoint, **kwargs):
+        route_path = path
+        
+        def tag_route():
+            stats = metrics.current_request.get()
+            if stats is not None:
+                stats.route = route_path
+        
+        @functools.wraps(endpoint)
+        def profiled_endpoint(*args, **endpoint_kwargs):
+            tag_route()
+            profile_request = current_profile.get()
+            if profile_request is None or not is_allowed(profile_request.email):
+                return endpoint(*args, **endpoint_kwargs)
+            
+            profile_request.profile = cProfile.Profile()
+            return profile_request.profile.runcall(endpoint, *args, **endpoint_kwargs)
+        
+        @functools.wraps(endpoint)
+        async def profiled_async_endpoint(*args, **endpoint_kwargs): #runcall would only time creating the coroutine
+            tag_route()
+            profile_request = current_profile.get()
+            if profile_request is None or not await run_in_threadpool(is_allowed, profile_request.email):
+                return await endpoint(*args, **endpoint_kwargs)
+            
+            profile_request.profile = cProfile.Profile()
+            profile_request.profile.enable()
+            try:
+                return await endpoint(*args, **endpoint_kwargs)
+            finally:
+                profile_request.profile.disable()
+        
+        wrapped = profiled_async_endpoint if asyncio.iscoroutinefunction(endpoint) else profiled_endpoint
+        super().__init__(path, wrapped, **kwargs)
+
+def save_profile(route, profile):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    #several requests to a route can finish within the same second -> a random suffix keeps them apart
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_')}-{uuid.uuid4().hex[:8]}.prof"
+    profile.dump_stats(os.path.join(PROFILE_DIR, name))
+    return name
+
+
+def read_profile(name, limit=40):
+    """
+    Text summary of a saved profile, sorted by cumulative time
+    """
+    path = os.path.join(PROFILE_DIR, os.path.basename(name))
+    if not os.path.exists(path):
+        return None
+    output = io.StringIO()
+    pstats.Stats(path, stream=output).sort_stats('cumulative').print_stats(limit)
+    return output.getvalue()
@@ -0,0 +1,123 @@
+import os
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+#builds the generate_tasks prompt within a token budget per section -> long events no longer make slow and expensive prompts
+#the event part only depends on the event, so it is the same for every user and stays the first part of the prompt,
+#which lets prompt-prefix caching on the OpenAI side reuse it -> only the user part is trimmed with the event in mind
+
+TOKENIZER_MODEL = 'gpt-3.5-turbo-0125' #same model as CHAT_MODEL in openai_llm.py
+
+#maximum tokens per section, set PROMPT_BUDGET_<SECTION> to change one, e.g. PROMPT_BUDGET_EVENT_DESCRIPTION=800
+SECTION_BUDGETS = {name: int(os.environ.get('PROMPT_BUDGET_' + name.upper(), default)) for name, default in [
+    ('event_description', 600),
+    ('event_tasks', 300),
+    ('user_skills', 150),
+    ('user_interests', 150),
+    ('user_experience', 250),
+]}
+
+TASK_QUESTION = 'Can you generate 3 to 5 personalized tasks for the user that are tailored to the event? Try not to repeat tasks that are already in the event description. Do not use any lists, keep the response in a single paragraph.'
+
+WORD = re.compile(r"[a-z0-9']+")
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+|\n+')
+STOP_WORDS = {'the', 'and', 'for', 'with', 'that', 'this', 'are', 'was', 'were', 'will', 'have', 'has', 'you', 'your', 'from', 'they', 'them', 'our', 'all', 'but', 'not', 'can', 'who', 'their', 'also', 'into', 'about', 'been', 'more', 'any'}
+
+
+@lru_cache(maxsize=None)
+def get_encoding(): #tiktoken downloads its vocabulary on first use -> returns None if that is not possible (or tiktoken is not installed) and tokens are estimated instead
+    try:
+        import tiktoken
+        return tiktoken.encoding_for_model(TOKENIZER_MODEL)
+    except Exception as error:
+        print(f'Could not load the tiktoken encoding, estimating token counts instead: {error!r}')
+        return None
+
+def count_tokens(text: str):
+    encoding = get_encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4 #about 4 characters per token for English text
+    return len(encoding.encode(text))
+
+def truncate_tokens(text: str, budget: int): #cuts a single piece of text down to the budget
+    encoding = get_encoding()
+    if encoding is None:
+        return text[:budget * 4]
+    return encoding.decode(encoding.encode(text)[:budget])
+
+def words(text: str):
+    return {word for word in WORD.findall(text.lower()) if len(word) > 2 and word not in STOP_WORDS}
+
+def split_sentences(text: str):
+    return [sentence.strip() for sentence in SENTENCE_END.split(text) if sentence.strip()]
+
+
+def fit_to_budget(text: str, budget: int, relevant_words=None):
+    """Keeps the most relevant sentences of text that fit in budget tokens, in their original order.
+
+    A sentence is relevant by how many of relevant_words it contains, or, without them, by how many words it shares with
+    the rest of the text. Returns the trimmed text and its token count.
+    """
+    tokens = count_tokens(text)
+    if tokens <= budget:
+        return text, tokens
+
+    sentences = split_sentences(text)
+    sentence_words = [words(sentence) for sentence in sentences]
+    if relevant_words is None: #no outside query -> prefer sentences that are central to the text itself
+        counts = {}
+        for found in sentence_words:
+            for word in found:
+                counts[word] = counts.get(word, 0) + 1
+        scores = [sum(counts[word] - 1 for word in found) / (len(found) or 1) for found in sentence_words]
+    else:
+        scores = [len(found & relevant_words) / (len(found) or 1) ** 0.5 for found in sentence_words]
+
+    kept, seen, used = [], set(), 0
+    for index in sorted(range(len(sentences)), key=lambda i: (-scores[i], i)): #ties go to the earlier sentence
+        if sentences[index] in seen: #a repeated sentence adds no information
+            continue
+        sentence_tokens = count_tokens(sentences[index]) + 1 #+1 for the joining space
+        if used + sentence_tokens <= budget:
+            kept.append(index)
+            seen.add(sentences[index])
+            used += sentence_tokens
+
+    if not kept: #even the best sentence is too long -> keep its start
+        trimmed = truncate_tokens(sentences[sorted(range(len(sentences)), key=lambda i: (-scores[i], i))[0]], budget)
+    else:
+        trimmed = ' '.join(sentences[index] for index in sorted(kept))
+    return trimmed, count_tokens(trimmed)
+
+
+@dataclass
+class Prompt:
+    text: str
+    tokens: int
+    sections: dict = field(default_factory=dict) #section name -> {'tokens': kept tokens, 'original_tokens': tokens before trimming}
+
+    def metadata(self):
+        return {'prompt_tokens': self.tokens, 'sections': self.sections}
+
+
+def build_task_prompt(event, user):
+    sections = {}
+
+    def section(name, text, relevant_words=None):
+        trimmed, tokens = fit_to_budget(text, SECTION_BUDGETS[name], relevant_words)
+        sections[name] = {'tokens': tokens, 'original_tokens': count_tokens(text)}
+        return trimmed
+
+    event_part = ('Here is a description and list of tasks of the volunteering event: \n'
+                  + 'Event Description: \n' + section('event_description', event.description) + '\n\n'
+                  + 'Event Tasks: \n' + section('event_tasks', event.tasks) + '\n\n')
+
+    event_words = words(event.title + ' ' + event.description + ' ' + event.tasks)
+    user_part = ("Here is the user's list of skills, description of his interests and past volunteer experiences : "
+                 + 'User Skills: \n' + section('user_skills', user.skills, event_words) + '\n\n'
+                 + 'User Interests: \n' + section('user_interests', user.interests, event_words) + '\n\n'
+                 + 'User Past Volunteer Experience: \n' + section('user_experience', user.past_volunteer_experience, event_words) + '\n\n')
+
+    text = event_part + user_part + '\n\n' + TASK_QUESTION
+    return Prompt(text=text, tokens=count_tokens(text), sections=sections)
@@ -0,0 +1,126 @@
+import concurrent.futures
+import os
+import threading
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from cache import get_cache
+from database import SessionLocal
+import admission, coregistration, metrics, models, vectors
+
+#the top events of a user for /user/get_similar_events, answered within a latency budget
+#the personalized ranking may have to call the embedding provider -> it runs on a worker thread, and when it doesn't finish within
+#the budget or the provider fails, the user's last personalized list is served instead, or the most popular events if there is none
+#the ranking blends profile similarity with co-registrations (coregistration.py) -> a user with registrations but no stored vector
+#yet is ranked on co-registrations alone, without waiting for an embedding call
+
+RECOMMENDATIONS_CACHE_TTL = int(os.environ.get('RECOMMENDATIONS_CACHE_TTL', 3600)) #seconds a user's top 5 events stay cached
+RECOMMENDATIONS_BUDGET_SECONDS = float(os.environ.get('RECOMMENDATIONS_BUDGET_SECONDS', 3)) #longest a request waits for the personalized ranking
+RECOMMENDATIONS_WORKERS = int(os.environ.get('RECOMMENDATIONS_WORKERS', 4)) #threads computing personalized rankings, per process
+RECOMMENDATIONS_COREGISTRATION_WEIGHT = float(os.environ.get('RECOMMENDATIONS_COREGISTRATION_WEIGHT', 0.3)) #share of the score from co-registrations, the rest from profile similarity
+RECOMMENDATIONS_COUNT = 5
+
+executor = concurrent.futures.ThreadPoolExecutor(max_workers=RECOMMENDATIONS_WORKERS, thread_name_prefix='recommendations')
+in_flight = {} #cache key -> future of a ranking still running -> a repeated request waits on it rather than queueing another
+in_flight_lock = threading.Lock()
+
+def state_key(db: Session, user): #the answer only changes when the user, any event or a stored vector changes -> all of that is in the key
+    state = db.query(func.max(models.Event.version), func.count(models.Event.id),
+                     select(func.max(models.EventVector.updated_at)).scalar_subquery(),
+                     select(models.UserVector.updated_at).where(models.UserVector.user_id == user.id).scalar_subquery()).one()
+    return f'{user.id}:{user.version}:' + ':'.join(str(value) for value in state)
+
+def top_events(db: Session, user, count: int = RECOMMENDATIONS_COUNT): #titles of the events closest to the user's profile, best first
+    joined = set(user.events_registered or [])
+    events = [event for event in db.query(models.Event.id, models.Event.title, models.Event.description).all() if event.id not in joined] #recommend only events the user has not joined
+    co_scores = coregistration.event_scores(db, user.events_registered, user.id) if user.events_registered else {}
+    stored = db.query(models.UserVector.user_id).filter(models.UserVector.user_id == user.id, *vectors.is_current(models.UserVector)).first()
+    if co_scores and not stored: #the embedding job has not reached the user yet -> rank on co-registrations alone rather than call the provider
+        ranked = sorted(events, key=lambda event: (-co_scores.get(event.id, 0.0), event.title))
+        return [event.title for event in ranked[:count]]
+
+    #use the vectors stored by the embedding jobs -> only events and users the jobs have not reached yet are embedded here
+    matrix = vectors.load_event_matrix(db)
+    missing = [event for event in events if event.id not in matrix.positions]
+    if missing:
+        vectors.embed_events(db, missing)
+        matrix = vectors.load_event_matrix(db)
+    user_vector, user_scale = vectors.get_user_vector(db, user)
+    db.commit()
+
+    titles = {event.id: event.title for event in events}
+    similarities = matrix.scores(user_vector, user_scale)
+    if co_scores:
+        weight = RECOMMENDATIONS_COREGISTRATION_WEIGHT
+        similarities = (1 - weight) * similarities + weight * np.array([co_scores.get(event_id, 0.0) for event_id in matrix.ids], dtype=similarities.dtype)
+    top_indices = [i for i in np.argsort(-similarities, kind='stable') if matrix.ids[i] in titles][:count]
+    return [titles[matrix.ids[i]] for i in top_indices]
+
+def popular_events(db: Session, count: int = RECOMMENDATIONS_COUNT): #titles of the fullest events that still have room -> needs no embeddings
+    registrations = func.coalesce(func.cardinality(models.Event.users_registered), 0)
+    fill_rate = registrations / func.nullif(models.Event.capacity, 0) #true division in SQLAlchemy 2
+    rows = (db.query(models.Event.title)
+            .filter(registrations < models.Event.capacity)
+            .order_by(fill_rate.desc().nulls_last(), registrations.desc(), models.Event.title)
+            .limit(count)
+            .all())
+    return [title for (title,) in rows]
+
+def save_recommended(db: Session, user_id: str, titles): #keeps the user's latest list for the counts of /admin/analytics
+    ids = dict(db.query(models.Event.title, models.Event.id).filter(models.Event.title.in_(titles)).all()) if titles else {}
+    statement = insert(models.UserRecommendation).values(user_id=user_id, event_ids=[ids[title] for title in titles if title in ids])
+    db.execute(statement.on_conflict_do_update(index_elements=['user_id'], set_={'event_ids': statement.excluded.event_ids, 'updated_at': func.now()}))
+    db.commit()
+
+def compute(key: str, user_id: str): #runs on a worker thread with its own session, as the request may stop waiting for it
+    def rank():
+        admission.current_caller.set(user_id) #embedding calls count towards this user's limit
+        db = SessionLocal()
+        try:
+            titles = top_events(db, db.get(models.User, user_id))
+            save_recommended(db, user_id, titles)
+        finally:
+            db.close()
+        get_cache('recommendations').set(f'last:{user_id}', titles) #kept without a ttl for when the provider is down later
+        return titles
+    return get_cache('recommendations').get_or_set(key, rank, RECOMMENDATIONS_CACHE_TTL)
+
+def recommend(db: Session, user):
+    """Returns the titles of the user's top events and the strategy that chose them.
+
+    'personalized' ranks events by similarity to the user's profile and by how often they are registered for together
+    with the user's events. If that takes longer than RECOMMENDATIONS_BUDGET_SECONDS or fails, 'last_cached' serves the
+    user's last personalized list and 'popular' the events with the highest fill rate.
+    A ranking that runs out of time carries on in the background and is cached for the next request.
+    """
+    key = state_key(db, user)
+    cache = get_cache('recommendations')
+    titles = cache.get(key)
+    if titles is not None:
+        metrics.record_recommendation('personalized')
+        return titles, 'personalized'
+
+    with in_flight_lock:
+        future = in_flight.get(key)
+        if future is None:
+            future = in_flight[key] = executor.submit(compute, key, user.id)
+            future.add_done_callback(lambda done: in_flight.pop(key, None))
+    try:
+        titles = future.result(timeout=RECOMMENDATIONS_BUDGET_SECONDS)
+        metrics.record_recommendation('personalized')
+        return titles, 'personalized'
+    except concurrent.futures.TimeoutError:
+        reason = 'timeout'
+    except admission.Rejected:
+        reason = 'rejected'
+    except Exception as error:
+        print(f'Personalized recommendations failed: {error!r}')
+        reason = 'error'
+
+    titles = cache.get(f'last:{user.id}')
+    strategy = 'last_cached' if titles is not None else 'popular'
+    if titles is None:
+        titles = popular_events(db)
+    metrics.record_recommendation(strategy, reason)
+    return titles, strategy
@@ -0,0 +1,105 @@
+import os
+import numpy as np
+from sqlalchemy import func, text, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+import models, vectors
+
+#stores the top k most similar events of every event in the related_events table -> /event/related reads it without any embedding calls
+#the full graph is built once with blocked matrix products, then a created, updated or deleted event only touches the rows it affects
+
+RELATED_K = int(os.environ.get('RELATED_K', 10)) #related events stored per event
+RELATED_BLOCK_SIZE = int(os.environ.get('RELATED_BLOCK_SIZE', 512)) #rows per matrix product when building -> bounds memory to block size x number of events
+LOCK_KEY = 40390001 #postgres advisory lock held while changing the graph, so workers don't overwrite each other's rows
+
+def lock(db: Session): #held until the transaction ends
+    db.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': LOCK_KEY})
+
+def load_vectors(db: Session): #returns the event ids and the matrix of their stored vectors, one row per event
+    matrix = vectors.load_event_matrix(db)
+    return matrix.ids, matrix
+
+def nearest(matrix: vectors.VectorMatrix, indices, k: int = RELATED_K, block_size: int = RELATED_BLOCK_SIZE):
+    """Yields (row, [(column, score)]) with the k most similar other rows of matrix for each row in indices, best first.
+
+    Rows are scored in blocks, so only a block of the full similarity matrix is held at once.
+    """
+    count = min(k, len(matrix) - 1)
+    for start in range(0, len(indices), block_size):
+        block = np.asarray(indices[start:start + block_size])
+        scores = matrix.block_scores(block)
+        scores[np.arange(len(block)), block] = -np.inf #an event is not related to itself
+        if count <= 0:
+            for row in block:
+                yield int(row), []
+            continue
+        top = np.argpartition(-scores, count - 1, axis=1)[:, :count]
+        for position, row in enumerate(block):
+            columns = top[position][np.argsort(-scores[position, top[position]])]
+            yield int(row), [(int(column), float(scores[position, column])) for column in columns]
+
+def write_rows(db: Session, ids, results): #replaces the stored related events of the events in results
+    results = list(results)
+    if not results:
+        return
+    db.query(models.RelatedEvent).filter(models.RelatedEvent.event_id.in_([ids[row] for row, found in results])).delete(synchronize_session=False)
+    values = [{'event_id': ids[row], 'related_id': ids[column], 'score': score} for row, found in results for column, score in found]
+    if values:
+        db.execute(insert(models.RelatedEvent), values)
+
+def rebuild(db: Session): #recomputes the whole graph -> returns the number of events in it
+    lock(db)
+    ids, matrix = load_vectors(db)
+    db.query(models.RelatedEvent).delete(synchronize_session=False)
+    write_rows(db, ids, nearest(matrix, list(range(len(ids)))))
+    return len(ids)
+
+def refresh(db: Session, event_ids): #recomputes the related events of a few events
+    lock(db)
+    ids, matrix = load_vectors(db)
+    write_rows(db, ids, nearest(matrix, [matrix.positions[event_id] for event_id in event_ids if event_id in matrix.positions]))
+
+def fill_incomplete(db: Session): #recomputes events with fewer related events than they should have, e.g. after one of them was deleted
+    lock(db)
+    total = db.query(func.count(models.EventVector.event_id)).filter(*vectors.is_current(models.EventVector)).scalar()
+    wanted = min(RELATED_K, total - 1)
+    counts = dict(db.query(models.RelatedEvent.event_id, func.count()).group_by(models.RelatedEvent.event_id).all())
+    incomplete = [event_id for (event_id,) in db.query(models.EventVector.event_id).filter(*vectors.is_current(models.EventVector)) if counts.get(event_id, 0) < wanted]
+    if incomplete:
+        refresh(db, incomplete)
+    return len(incomplete)
+
+def update_event(db: Session, event_id: str):
+    """Brings the graph up to date after the vector of one event was stored.
+
+    Events that listed this event are recomputed, as its new score may have dropped it from their top k. Every other
+    event only has to check whether the new score beats its current lowest one -> the database compares them and returns
+    just the lists that change. Finally the event's own row is computed.
+    """
+    lock(db)
+    ids, matrix = load_vectors(db)
+    if event_id not in matrix.positions:
+        return
+    row = matrix.positions[event_id]
+    scores = matrix.scores(*matrix.row(row))
+
+    listed_by = {listing_id for (listing_id,) in db.query(models.RelatedEvent.event_id).filter(models.RelatedEvent.related_id == event_id)}
+    candidates = [(other_id, float(scores[other])) for other, other_id in enumerate(ids) if other != row and other_id not in listed_by]
+    #only the events the new score gets into -> lists that are not full yet or whose lowest score is below it, each with the
+    #related event that has to make room (None while the list is not full)
+    changes = db.execute(text(
+        'SELECT candidate.event_id, candidate.score, CASE WHEN lowest.count >= :k THEN lowest.related_id END '
+        'FROM unnest(CAST(:ids AS varchar[]), CAST(:scores AS float8[])) AS candidate(event_id, score) '
+        'CROSS JOIN LATERAL (SELECT count(*) AS count, min(score) AS score, (array_agg(related_id ORDER BY score, related_id))[1] AS related_id '
+        '                    FROM related_events WHERE related_events.event_id = candidate.event_id) AS lowest '
+        'WHERE lowest.count < :k OR lowest.score < candidate.score'),
+        {'k': RELATED_K, 'ids': [other_id for other_id, score in candidates], 'scores': [score for other_id, score in candidates]}).all() if candidates else []
+
+    added = [{'event_id': other_id, 'related_id': event_id, 'score': score} for other_id, score, lowest_id in changes]
+    dropped = [(other_id, lowest_id) for other_id, score, lowest_id in changes if lowest_id is not None]
+
+    if dropped:
+        db.query(models.RelatedEvent).filter(tuple_(models.RelatedEvent.event_id, models.RelatedEvent.related_id).in_(dropped)).delete(synchronize_session=False)
+    if added:
+        db.execute(insert(models.RelatedEvent), added)
+    write_rows(db, ids, nearest(matrix, [row] + [matrix.positions[listing_id] for listing_id in listed_by if listing_id in matrix.positions]))
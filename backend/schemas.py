@@ -42,6 +42,11 @@ class KickUser(BaseModel): #what data format I expect when we kick a user from a
     new_user_email: str
     title: str
     
+class BulkEventUsers(BaseModel): #what data format I expect when an admin registers or kicks many users for an event at once
+    email: str #email of the admin
+    title: str
+    user_emails: list[str]
+    
 class GenerateTasks(BaseModel): #what data format I expect when I generate tasks for a user
     user_email: str
     event_title: str
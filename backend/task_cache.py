@@ -0,0 +1,68 @@
+import hashlib
+import os
+import time
+import numpy as np
+from cache import get_cache
+import metrics, vectors
+
+#near-duplicate cache of generated tasks -> volunteers with nearly the same profile (e.g. students with the same skills) get the tasks
+#already generated for one of them instead of a new LLM call
+#every event keeps the profile vectors of the last users it generated tasks for, with the reply each got, in the shared cache
+
+TASK_CACHE_THRESHOLD = float(os.environ.get('TASK_CACHE_THRESHOLD', 0.95)) #cosine similarity of two profiles above which they share tasks -> above 1 turns the cache off
+TASK_CACHE_PER_EVENT = int(os.environ.get('TASK_CACHE_PER_EVENT', 50)) #profiles kept per event, the least recently used is dropped first
+TASK_CACHE_TTL = int(os.environ.get('TASK_CACHE_TTL', 7 * 24 * 3600)) #seconds an event's entries stay after their last change
+
+def event_key(event): #the event's text is part of the prompt (see prompts.build_task_prompt) -> an edited event starts from an empty list
+    #hashed rather than keyed on event.version, which every registration bumps without changing the prompt
+    text = hashlib.sha256('\0'.join([event.title, event.description, event.tasks]).encode()).hexdigest()[:16]
+    return f'{event.id}:{text}:{vectors.VECTOR_FORMAT}'
+
+def new_entries():
+    return {'user_ids': [], 'data': None, 'scales': np.zeros(0, dtype=np.float32), 'responses': [], 'used': []}
+
+def best_match(entries, vector, scale):
+    """Returns the position and similarity of the stored profile closest to the given vector, or (None, None) if there is none."""
+    if not entries['user_ids'] or entries['data'].shape[1] != len(vector):
+        return None, None
+    matrix = vectors.VectorMatrix(entries['user_ids'], entries['data'], entries['scales'])
+    scores = matrix.scores(vector, scale)
+    best = int(np.argmax(scores))
+    return best, min(float(scores[best]), 1.0) #int8 rounding can put a vector's similarity with itself a little over 1
+
+def add_entry(entries, user_id: str, vector, scale, response: str, cap: int = TASK_CACHE_PER_EVENT): #replaces the user's earlier entry
+    if entries['data'] is not None and entries['data'].shape[1] != len(vector): #vectors of another length -> start over
+        entries = new_entries()
+    keep = [position for position, kept_id in enumerate(entries['user_ids']) if kept_id != user_id]
+    keep = sorted(keep, key=lambda position: entries['used'][position])[max(len(keep) - cap + 1, 0):] #drop the least recently used
+    keep.sort()
+    data = entries['data'][keep] if entries['data'] is not None else np.zeros((0, len(vector)), dtype=vector.dtype)
+    return {'user_ids': [entries['user_ids'][position] for position in keep] + [user_id],
+            'data': np.vstack([data, vector[np.newaxis]]),
+            'scales': np.append(entries['scales'][keep], np.float32(scale)),
+            'responses': [entries['responses'][position] for position in keep] + [response],
+            'used': [entries['used'][position] for position in keep] + [time.time()]}
+
+def lookup(event, vector, scale, threshold: float = TASK_CACHE_THRESHOLD):
+    """Returns the tasks generated for the closest profile of this event and its similarity, or None if none is close enough."""
+    cache = get_cache('task_neighbours')
+    entries = cache.get(event_key(event))
+    position, similarity = best_match(entries, vector, scale) if entries else (None, None)
+    if similarity is not None:
+        metrics.record_task_cache_similarity(similarity)
+    if position is None or similarity < threshold:
+        metrics.record_task_cache(hit=False)
+        return None
+    metrics.record_task_cache(hit=True)
+    cache.update(event_key(event), lambda current: mark_used(current, entries['user_ids'][position]), TASK_CACHE_TTL)
+    return entries['responses'][position], similarity
+
+def mark_used(entries, user_id: str): #keeps the user's entry from being the next one evicted -> positions may have moved since the lookup
+    if entries and user_id in entries['user_ids']:
+        entries['used'][entries['user_ids'].index(user_id)] = time.time()
+        return entries
+    return None
+
+def store(event, user_id: str, vector, scale, response: str):
+    #under the event's lock -> two users getting tasks for the same event at once both keep their entry
+    get_cache('task_neighbours').update(event_key(event), lambda entries: add_entry(entries or new_entries(), user_id, vector, scale, response), TASK_CACHE_TTL)
@@ -0,0 +1,104 @@
+import threading
+import time
+
+import pytest
+
+import admission
+
+
+def make_controller(max_concurrent=2, max_per_caller=1, queue_size=4, wait_seconds=0.05):
+    return admission.AdmissionController('test', max_concurrent, max_per_caller, queue_size, wait_seconds)
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after):
+        super().__init__('rate limited')
+        self.response = type('Response', (), {'headers': {'retry-after': retry_after}})()
+
+
+def test_overall_limit():
+    controller = make_controller(max_concurrent=2, max_per_caller=5)
+    controller.acquire(None)
+    controller.acquire(None)
+
+    with pytest.raises(admission.Rejected) as rejected:
+        controller.acquire(None)
+    assert rejected.value.reason == 'timeout' and rejected.value.retry_after >= 1
+    controller.release(None, 0.1)
+    controller.acquire(None)
+    assert controller.active == 2 and controller.waiting == 0
+
+
+def test_per_caller_limit():
+    controller = make_controller(max_concurrent=3, max_per_caller=1)
+    controller.acquire('ann')
+
+    with pytest.raises(admission.Rejected):
+        controller.acquire('ann')
+    controller.acquire('bob') #other users and background jobs still get the free slots
+    controller.acquire(None)
+    controller.release('ann', 0.1)
+    assert controller.active_by_caller == {'bob': 1}
+
+
+def test_queue_full_rejects_at_once():
+    controller = make_controller(max_concurrent=1, queue_size=0, wait_seconds=5)
+    controller.acquire(None)
+
+    start = time.monotonic()
+    with pytest.raises(admission.Rejected) as rejected:
+        controller.acquire(None)
+    assert rejected.value.reason == 'queue_full'
+    assert time.monotonic() - start < 1
+
+
+def test_waiting_call_starts_when_a_slot_is_released():
+    controller = make_controller(max_concurrent=1, wait_seconds=5)
+    controller.acquire(None)
+    started = threading.Event()
+
+    def waiter():
+        controller.acquire(None)
+        started.set()
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    time.sleep(0.05)
+    assert not started.is_set() and controller.waiting == 1
+    controller.release(None, 0.1)
+    assert started.wait(1)
+    thread.join()
+
+
+def test_upstream_rate_limit_halves_the_limit_and_pauses():
+    controller = make_controller(max_concurrent=8, max_per_caller=8)
+
+    with pytest.raises(admission.Rejected) as rejected:
+        with controller.admit():
+            raise RateLimited('2')
+    assert rejected.value.reason == 'upstream_rate_limit' and rejected.value.retry_after >= 2
+    assert controller.limit == 4 and controller.active == 0
+    with pytest.raises(admission.Rejected) as rejected: #nothing starts during the pause
+        controller.acquire(None)
+    assert rejected.value.reason == 'timeout'
+
+    controller.paused_until = 0
+    for _ in range(4):
+        with controller.admit():
+            pass
+    assert 4 < controller.limit < 8 #climbs back gradually
+
+
+def test_other_errors_are_raised_and_free_the_slot():
+    controller = make_controller()
+    token = admission.current_caller.set('ann')
+    try:
+        with pytest.raises(ValueError):
+            with controller.admit():
+                assert controller.active_by_caller == {'ann': 1}
+                raise ValueError('bad request')
+    finally:
+        admission.current_caller.reset(token)
+    assert controller.active == 0 and controller.active_by_caller == {} and controller.limit == 2
@@ -0,0 +1,43 @@
+import analytics
+from conftest import add_event, add_user
+
+
+def test_age_band_labels():
+    assert analytics.age_band_labels([18, 25, 35]) == ['<18', '18-24', '25-34', '35+']
+    assert analytics.age_band_labels([65]) == ['<65', '65+']
+
+
+def test_demographics_groups_users_and_registrations(db):
+    add_user(db, 'ann@example.com', age=17, work_status='Student', immigration_status='citizen', events_registered=['a', 'b'])
+    add_user(db, 'bob@example.com', age=24, work_status='student', immigration_status='refugee', events_registered=['a'])
+    add_user(db, 'cat@example.com', age=70, work_status='retired', immigration_status='citizen')
+
+    result = analytics.demographics(db)
+    assert result['total'] == {'users': 3, 'volunteers': 2, 'registrations': 3}
+    assert result['work_status'] == {'student': {'users': 2, 'volunteers': 2, 'registrations': 3}, #profiles typed in any case count together
+                                     'retired': {'users': 1, 'volunteers': 0, 'registrations': 0}}
+    assert result['immigration_status']['refugee'] == {'users': 1, 'volunteers': 1, 'registrations': 1}
+    bands = result['age_band']
+    assert list(bands) == analytics.age_band_labels()
+    assert bands['<18'] == {'users': 1, 'volunteers': 1, 'registrations': 2}
+    assert bands['18-24'] == {'users': 1, 'volunteers': 1, 'registrations': 1}
+    assert bands['65+'] == {'users': 1, 'volunteers': 0, 'registrations': 0}
+    assert bands['25-34'] == {'users': 0, 'volunteers': 0, 'registrations': 0}
+
+
+def test_demographics_without_users(db):
+    result = analytics.demographics(db)
+
+    assert result['total'] == {'users': 0, 'volunteers': 0, 'registrations': 0}
+    assert result['work_status'] == {} and all(counts['users'] == 0 for counts in result['age_band'].values())
+
+
+def test_event_stats_orders_by_fill_rate(db):
+    add_event(db, 'Half full', capacity=4, users_registered=['ann', 'bob'])
+    add_event(db, 'Full', capacity=2, users_registered=['ann', 'bob'])
+    add_event(db, 'Empty', capacity=5)
+
+    result = analytics.event_stats(db)
+    assert {key: result[key] for key in ['events', 'registrations', 'capacity', 'fill_rate', 'full_events']} == \
+        {'events': 3, 'registrations': 4, 'capacity': 11, 'fill_rate': round(4 / 11, 4), 'full_events': 1}
+    assert [(event['title'], event['fill_rate']) for event in result['per_event']] == [('Full', 1.0), ('Half full', 0.5), ('Empty', 0.0)]
@@ -0,0 +1,130 @@
+import threading
+import time
+
+import pytest
+
+import cache
+
+
+@pytest.fixture(params=['memory', 'redis'])
+def store(request):
+    if request.param == 'memory':
+        return cache.MemoryCache()
+    fakeredis = pytest.importorskip('fakeredis')
+    return cache.RedisCache(client=fakeredis.FakeRedis())
+
+
+def test_get_set_and_delete(store):
+    store.set('a', {'value': 1})
+    store.set_many({'b': [2], 'c': 'three'})
+
+    assert store.get('a') == {'value': 1}
+    assert store.get_many(['a', 'b', 'missing']) == {'a': {'value': 1}, 'b': [2]}
+    assert store.get('missing', 'default') == 'default'
+    store.delete('a', 'b')
+    assert store.get_many(['a', 'b', 'c']) == {'c': 'three'}
+
+
+def test_namespaces_are_separate(store):
+    embeddings, tasks = store.namespace('embeddings'), store.namespace('tasks')
+    embeddings.set('key', 'embedding')
+    tasks.set('key', 'task')
+
+    assert embeddings.get('key') == 'embedding' and tasks.get('key') == 'task'
+    embeddings.clear()
+    assert embeddings.get('key') is None and tasks.get('key') == 'task'
+
+
+def test_values_expire_after_their_ttl(store):
+    store.set('short', 1, ttl=0.05)
+    store.set('long', 2)
+    time.sleep(0.1)
+
+    assert store.get_many(['short', 'long']) == {'long': 2}
+
+
+def test_get_or_set_computes_once_for_concurrent_callers(store):
+    calls, results = [], []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return 'value'
+
+    threads = [threading.Thread(target=lambda: results.append(store.get_or_set('key', compute, ttl=60))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == ['value'] * 8
+    assert store.get_or_set('key', compute) == 'value' and len(calls) == 1
+
+
+def test_get_or_set_stops_waiting_when_the_computation_fails(store):
+    started, errors = threading.Event(), []
+
+    def failing():
+        started.set()
+        time.sleep(0.1)
+        raise RuntimeError('backend down')
+
+    def first_caller():
+        try:
+            store.get_or_set('key', failing)
+        except RuntimeError as error:
+            errors.append(error)
+
+    thread = threading.Thread(target=first_caller)
+    thread.start()
+    started.wait()
+    begin = time.monotonic()
+    assert store.get_or_set('key', lambda: 'fallback') == 'fallback'
+    assert time.monotonic() - begin < cache.CACHE_LOCK_SECONDS
+    thread.join()
+    assert len(errors) == 1
+
+
+def test_only_one_caller_takes_a_key(store):
+    barrier, taken = threading.Barrier(16), []
+
+    def add(token):
+        barrier.wait()
+        if store._add(store.full_key('lock'), token, 60):
+            taken.append(token)
+
+    threads = [threading.Thread(target=add, args=(token,)) for token in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(taken) == 1
+    store._release(store.full_key('lock'), 'someone else')
+    assert store._exists(store.full_key('lock'))
+    store._release(store.full_key('lock'), taken[0])
+    assert not store._exists(store.full_key('lock'))
+
+
+def test_memory_cache_evicts_the_least_recently_used():
+    store = cache.MemoryCache(max_entries=2)
+    store.set('a', 1)
+    store.set('b', 2)
+    store.get('a')
+    store.set('c', 3)
+
+    assert store.get_many(['a', 'b', 'c']) == {'a': 1, 'c': 3}
+
+
+def test_redis_errors_make_the_cache_miss():
+    class DownRedis:
+        def __getattr__(self, name):
+            def fail(*args, **kwargs):
+                raise ConnectionError('redis is down')
+            return fail
+
+    store = cache.RedisCache(client=DownRedis())
+    store.set('key', 'value')
+    assert store.get('key', 'default') == 'default'
+    assert store.get_or_set('key', lambda: 'computed') == 'computed'
@@ -0,0 +1,106 @@
+import random
+
+import numpy as np
+import pytest
+
+import coregistration
+from conftest import add_event, add_user
+
+
+def random_rows(seed, events=12, users=30):
+    generator = random.Random(seed)
+    return [(f'event{number}', generator.sample([f'user{user}' for user in range(users)], generator.randint(0, 10))) for number in range(events)]
+
+
+def dense(co_registrations): #C with its diagonal, rows and columns in event id order
+    order = [co_registrations.positions[event_id] for event_id in sorted(co_registrations.event_ids)]
+    counts = co_registrations.counts.toarray() + np.diag(co_registrations.sizes)
+    return counts[np.ix_(order, order)]
+
+
+def built(rows):
+    co_registrations = coregistration.CoRegistrations()
+    co_registrations.build(rows)
+    return co_registrations
+
+
+def test_build_counts_shared_registrations():
+    co_registrations = built([('a', ['ann', 'bob']), ('b', ['bob', 'cat']), ('c', ['dan'])])
+
+    assert dense(co_registrations).tolist() == [[2, 1, 0], [1, 2, 0], [0, 0, 1]]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_apply_matches_a_fresh_build(seed):
+    before, after = random_rows(seed), random_rows(seed + 100, events=15)
+    co_registrations = built(before)
+
+    changed = co_registrations.apply(after)
+    assert np.array_equal(dense(co_registrations), dense(built(after)))
+    assert changed == sum(len(set(dict(before).get(event_id, [])) ^ set(registered)) for event_id, registered in after)
+    assert co_registrations.apply(after) == 0 #applying the same rows again changes nothing
+    assert np.array_equal(dense(co_registrations), dense(built(after)))
+
+
+def test_scores_favour_events_joined_by_the_same_volunteers():
+    co_registrations = built([('a', ['ann', 'bob', 'cat']), ('b', ['ann', 'bob']), ('c', ['cat'] + [f'user{n}' for n in range(20)]), ('d', ['dan'])])
+
+    scores = co_registrations.scores(['a'])
+    assert set(scores) == {'b', 'c'}
+    assert scores['b'] > scores['c'] and all(0 < score <= 1 for score in scores.values())
+    assert co_registrations.scores(['missing']) == {}
+
+
+def test_refresh_rebuilds_after_a_delete_and_a_create(client, db):
+    add_user(db, 'admin@example.com', is_admin=True)
+    add_event(db, 'a', users_registered=['ann', 'bob'])
+    add_event(db, 'b', users_registered=['ann', 'bob'])
+    co_registrations = coregistration.CoRegistrations()
+    co_registrations.refresh(db)
+    assert co_registrations.scores(['a']) == {'b': pytest.approx(1.0)}
+
+    assert client.post('/event/delete_event', json={'email': 'admin@example.com', 'title': 'b'}).status_code == 200
+    add_event(db, 'c') #same number of events as before
+    co_registrations.refresh(db)
+    assert sorted(co_registrations.event_ids) == ['a', 'c']
+    assert co_registrations.scores(['a']) == {}
+
+
+def test_scores_leave_out_the_users_own_registrations():
+    co_registrations = built([('a', ['ann', 'bob', 'dan']), ('b', ['ann', 'dan']), ('c', ['bob']), ('d', ['eve'])])
+
+    scores = co_registrations.scores(['a', 'b'], 'ann')
+    assert set(scores) == {'a', 'b', 'c'} #dan still links a and b, ann's own row no longer does
+    assert scores['a'] == pytest.approx(1 / (1 * 2 ** 0.5) / 2) #b to a: 1 shared volunteer, sizes 1 and 2 without ann
+    assert co_registrations.scores(['b'], 'ann') == {'a': pytest.approx(1 / 2 ** 0.5)}
+    assert built([('a', ['ann']), ('b', ['ann'])]).scores(['a'], 'ann') == {}
+
+
+def test_cold_start_recommends_events_the_user_has_not_joined(db):
+    import recommendations
+
+    user = add_user(db, 'ann@example.com', events_registered=['A', 'B'])
+    add_event(db, 'A', users_registered=['ann@example.com', 'bob@example.com', 'cat@example.com'])
+    add_event(db, 'B', users_registered=['ann@example.com', 'bob@example.com'])
+    add_event(db, 'C', users_registered=['bob@example.com'])
+    add_event(db, 'D', users_registered=['cat@example.com'])
+    add_event(db, 'E')
+
+    titles = recommendations.top_events(db, user, count=3) #no stored profile vector -> ranked on co-registrations alone
+    assert titles == ['C', 'D', 'E']
+
+
+def test_kicks_reach_the_counts_without_a_refresh(client, db):
+    add_user(db, 'admin@example.com', is_admin=True)
+    add_user(db, 'ann@example.com', events_registered=['a', 'b'])
+    add_event(db, 'a', users_registered=['ann@example.com'])
+    add_event(db, 'b', users_registered=['ann@example.com'])
+    coregistration.refresh(db)
+    assert coregistration.co_registrations.scores(['a']) == {'b': pytest.approx(1.0)}
+
+    response = client.post('/admin/kick_user', json={'curr_user_email': 'admin@example.com', 'new_user_email': 'ann@example.com', 'title': 'b'})
+    assert response.status_code == 200
+    assert coregistration.co_registrations.scores(['a']) == {}
+    response = client.post('/admin/bulk_register', json={'email': 'admin@example.com', 'title': 'b', 'user_emails': ['ann@example.com']})
+    assert response.json()['registered'] == 1
+    assert coregistration.co_registrations.scores(['a']) == {'b': pytest.approx(1.0)}
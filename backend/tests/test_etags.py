@@ -0,0 +1,46 @@
+from sqlalchemy import text
+
+from conftest import add_event, add_user
+
+
+def test_event_etag_changes_with_writes(client, db):
+    add_event(db, 'Beach cleanup')
+    response = client.get('/event/get_event', params={'title': 'Beach cleanup'})
+    etag = response.headers['ETag']
+
+    assert client.get('/event/get_event', params={'title': 'Beach cleanup'}, headers={'If-None-Match': etag}).status_code == 304
+    add_user(db, 'ann@example.com')
+    assert client.post('/event/register_event', params={'title': 'Beach cleanup', 'email': 'ann@example.com'}).status_code == 200
+    response = client.get('/event/get_event', params={'title': 'Beach cleanup'}, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_only_list_responses_are_compressed(client, db):
+    for number in range(100):
+        add_event(db, f'Event number {number}')
+
+    events = client.get('/event/get_events', headers={'Accept-Encoding': 'gzip'})
+    assert events.headers.get('Content-Encoding') == 'gzip'
+    assert len(events.json()['event_titles']) == 100
+
+    add_event(db, 'Long event', users_registered=[f'user{number}@example.com' for number in range(200)])
+    event = client.get('/event/get_event', params={'title': 'Long event'}, headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in event.headers
+
+
+def test_missing_version_columns_are_backfilled(db):
+    import database, models
+
+    add_user(db, 'ann@example.com')
+    add_user(db, 'bob@example.com')
+    db.close()
+    with database.engine.begin() as connection: #a users table from before users had versions
+        connection.execute(text('ALTER TABLE users DROP COLUMN version'))
+
+    database.add_missing_columns()
+    db = database.SessionLocal()
+    versions = [version for version, in db.query(models.User.version).all()]
+    assert len(versions) == 2 and None not in versions and len(set(versions)) == 2
+    assert not [column for column in database.inspect(database.engine).get_columns('users') if column['name'] == 'version'][0]['nullable']
+    db.close()
@@ -0,0 +1,57 @@
+import models
+from conftest import add_event
+
+
+def read_feed(client, since=0, limit=500):
+    """Follows /event/changes the way the frontend mirror does -> returns every page in order."""
+    pages = []
+    while True:
+        page = client.get('/event/changes', params={'since': since, 'limit': limit}).json()
+        pages.append(page)
+        since = page['version']
+        if not page['has_more']:
+            return pages
+
+
+def test_paging_delivers_every_change_once_in_version_order(db, client):
+    for index in range(7):
+        add_event(db, f'event {index}')
+
+    pages = read_feed(client, limit=3)
+
+    titles = [event['title'] for page in pages for event in page['events']]
+    versions = [event['version'] for page in pages for event in page['events']]
+    assert sorted(titles) == sorted(f'event {index}' for index in range(7))
+    assert len(titles) == len(set(titles))
+    assert versions == sorted(versions)
+    assert [len(page['events']) for page in pages] == [3, 3, 1]
+    assert [page['has_more'] for page in pages] == [True, True, False]
+
+
+def test_pages_stop_where_either_list_was_cut_off(db, client):
+    #deletes and writes interleave in one sequence -> a page may not skip past the changes of the list that hit the limit
+    for index in range(3):
+        add_event(db, f'kept {index}')
+        db.add(models.DeletedEvent(id=f'gone {index}', title=f'gone {index}'))
+        db.commit()
+
+    pages = read_feed(client, limit=2)
+
+    assert sorted(event['title'] for page in pages for event in page['events']) == ['kept 0', 'kept 1', 'kept 2']
+    assert sorted(event_id for page in pages for event_id in page['deleted']) == ['gone 0', 'gone 1', 'gone 2']
+
+
+def test_updated_event_is_delivered_again_after_the_cursor(db, client):
+    event = add_event(db, 'edited')
+    cursor = read_feed(client)[-1]['version']
+
+    event.description = 'new description'
+    db.commit()
+
+    [page] = read_feed(client, since=cursor)
+    assert [(change['title'], change['description']) for change in page['events']] == [('edited', 'new description')]
+    assert page['version'] > cursor
+
+
+def test_invalid_limit_is_rejected(db, client):
+    assert client.get('/event/changes', params={'limit': 0}).status_code == 400
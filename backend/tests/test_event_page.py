@@ -0,0 +1,43 @@
+from conftest import add_event, add_user
+
+
+def page(client, title, email='None'):
+    return client.get('/event/page', params={'title': title, 'email': email})
+
+
+def test_admins_see_participants_in_registration_order(client, db):
+    add_user(db, 'admin@example.com', is_admin=True)
+    for email in ['cat@example.com', 'ann@example.com', 'bob@example.com']:
+        add_user(db, email)
+    add_event(db, 'Beach cleanup', capacity=5, users_registered=['cat@example.com', 'gone@example.com', 'ann@example.com', 'bob@example.com'])
+
+    body = page(client, 'Beach cleanup', 'admin@example.com').json()
+    assert body['is_admin'] is True and body['is_registered'] is False
+    assert body['users_registered'] == ['cat@example.com', 'ann@example.com', 'bob@example.com'] #ids without a user are skipped
+    assert body['remaining_capacity'] == 1
+    assert body['event']['title'] == 'Beach cleanup' and body['event']['capacity'] == 5
+
+
+def test_visitors_without_an_account_still_get_the_event(client, db):
+    add_event(db, 'Beach cleanup', users_registered=['ann@example.com'])
+
+    for email in ['None', 'nobody@example.com']: #the outer join keeps the event when the email matches no user
+        response = page(client, 'Beach cleanup', email)
+        assert response.status_code == 200
+        assert {key: response.json()[key] for key in ['is_admin', 'is_registered', 'users_registered', 'remaining_capacity']} == \
+            {'is_admin': False, 'is_registered': False, 'users_registered': [], 'remaining_capacity': 9}
+
+
+def test_registered_users_see_their_registration_but_not_the_others(client, db):
+    add_user(db, 'ann@example.com')
+    add_user(db, 'bob@example.com')
+    add_event(db, 'Beach cleanup', capacity=1, users_registered=['ann@example.com', 'bob@example.com']) #over capacity, e.g. after it was lowered
+
+    body = page(client, 'Beach cleanup', 'ann@example.com').json()
+    assert body['is_registered'] is True and body['users_registered'] == []
+    assert body['remaining_capacity'] == 0 #never negative
+
+
+def test_unknown_event(client, db):
+    response = page(client, 'Nothing')
+    assert response.status_code == 400 and response.json()['detail'] == 'Event not found'
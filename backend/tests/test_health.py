@@ -0,0 +1,49 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(main, 'db_initialised', True)
+    monkeypatch.setattr(main, 'check_db_connection', lambda: True)
+    monkeypatch.setattr(main, 'is_configured', lambda: True)
+    return TestClient(main.app) #not entered -> the lifespan doesn't try to reach the database
+
+
+def test_healthz_needs_no_database(client, monkeypatch):
+    monkeypatch.setattr(main, 'check_db_connection', lambda: False)
+    monkeypatch.setattr(main, 'db_initialised', False)
+
+    response = client.get('/healthz')
+    assert response.status_code == 200 and response.json() == {'status': 'ok'}
+
+
+def test_readyz_when_everything_is_ready(client):
+    response = client.get('/readyz')
+    assert response.status_code == 200 and response.json() == {'database': True, 'openai': True}
+
+
+def test_readyz_without_the_database(client, monkeypatch):
+    monkeypatch.setattr(main, 'check_db_connection', lambda: False)
+
+    response = client.get('/readyz')
+    assert response.status_code == 503 and response.json() == {'database': False, 'openai': True}
+
+
+def test_readyz_without_openai(client, monkeypatch):
+    monkeypatch.setattr(main, 'is_configured', lambda: False)
+
+    response = client.get('/readyz')
+    assert response.status_code == 503 and response.json() == {'database': True, 'openai': False}
+
+
+def test_readyz_creates_the_tables_once_the_database_is_up(client, monkeypatch):
+    monkeypatch.setattr(main, 'db_initialised', False)
+    results = iter([False, True]) #the first attempt fails, e.g. the database is still starting
+    monkeypatch.setattr(main, 'init_db', lambda: next(results))
+
+    assert client.get('/readyz').status_code == 503
+    assert client.get('/readyz').status_code == 200
+    assert main.db_initialised is True
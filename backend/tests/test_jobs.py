@@ -0,0 +1,103 @@
+from datetime import timedelta
+
+from sqlalchemy import func
+
+import admission
+import jobs
+import models
+
+
+def all_jobs(db):
+    db.expire_all()
+    return db.query(models.Job).order_by(models.Job.id).all()
+
+
+def seconds_until(db, moment):
+    return (moment - db.query(func.now()).scalar().replace(tzinfo=None)).total_seconds()
+
+
+def make_due(db, job):
+    db.query(models.Job).filter(models.Job.id == job.id).update({'run_after': func.now() - timedelta(seconds=1)})
+    db.commit()
+
+
+def test_enqueue_keeps_one_pending_job_per_kind_and_entity(db):
+    jobs.enqueue(db, 'embed_event', 'a')
+    jobs.enqueue(db, 'embed_event', 'a')
+    jobs.enqueue(db, 'embed_user', 'a')
+    db.commit()
+    jobs.enqueue(db, 'embed_event', 'b')
+    db.rollback() #the write the job belonged to failed -> no job
+
+    assert [(job.kind, job.entity_id, job.status) for job in all_jobs(db)] == [('embed_event', 'a', 'pending'), ('embed_user', 'a', 'pending')]
+
+
+def test_claim_takes_a_lease_and_reclaims_it_once_expired(db, monkeypatch):
+    monkeypatch.setattr(jobs, 'JOB_LEASE_SECONDS', 60)
+    jobs.enqueue(db, 'embed_event', 'a')
+    db.commit()
+
+    job = jobs.claim_job()
+    assert (job.status, job.attempts) == ('running', 1)
+    assert 55 < seconds_until(db, all_jobs(db)[0].run_after) <= 60
+    assert jobs.claim_job() is None #leased
+
+    make_due(db, job) #the worker died without finishing
+    again = jobs.claim_job()
+    assert (again.id, again.status, again.attempts) == (job.id, 'running', 2)
+
+
+def test_failed_jobs_are_retried_with_backoff_until_the_last_attempt(db, monkeypatch):
+    monkeypatch.setattr(jobs, 'JOB_RETRY_BASE_SECONDS', 100)
+    monkeypatch.setattr(jobs, 'JOB_MAX_ATTEMPTS', 3)
+    jobs.enqueue(db, 'embed_event', 'a')
+    db.commit()
+
+    delays = []
+    for attempt in range(1, 4):
+        job = jobs.claim_job()
+        assert job.attempts == attempt
+        jobs.finish_job(job, RuntimeError('provider down'))
+        current = all_jobs(db)[0]
+        if attempt < 3:
+            assert current.status == 'pending' and 'provider down' in current.last_error
+            delays.append(seconds_until(db, current.run_after))
+            make_due(db, current)
+    assert (current.status, current.attempts) == ('failed', 3)
+    assert 95 < delays[0] <= 110 and 195 < delays[1] <= 220 #doubled, with up to 10 % jitter
+
+
+def test_rejected_calls_do_not_use_up_an_attempt(db):
+    jobs.enqueue(db, 'embed_event', 'a')
+    db.commit()
+
+    job = jobs.claim_job()
+    jobs.finish_job(job, admission.Rejected('embedding', 'timeout', 30))
+    current = all_jobs(db)[0]
+    assert (current.status, current.attempts) == ('pending', 0)
+    assert 25 < seconds_until(db, current.run_after) <= 33
+
+
+def test_a_job_enqueued_again_while_running_supersedes_the_retry(db):
+    jobs.enqueue(db, 'embed_event', 'a')
+    db.commit()
+    job = jobs.claim_job()
+    jobs.enqueue(db, 'embed_event', 'a') #the event changed again while the job ran
+    db.commit()
+
+    jobs.finish_job(job, RuntimeError('provider down')) #going back to pending would break the unique pending index
+    assert [(current.id == job.id, current.status) for current in all_jobs(db)] == [(True, 'superseded'), (False, 'pending')]
+
+
+def test_run_job_calls_the_handler_and_records_the_outcome(db, monkeypatch):
+    calls = []
+    monkeypatch.setitem(jobs.HANDLERS, 'test_kind', lambda session, entity_id: calls.append(entity_id))
+    jobs.enqueue(db, 'test_kind', 'a')
+    jobs.enqueue(db, 'unknown_kind', 'b')
+    db.commit()
+
+    for _ in range(2):
+        jobs.run_job(jobs.claim_job())
+    assert calls == ['a']
+    assert [(job.kind, job.status) for job in all_jobs(db)] == [('test_kind', 'done'), ('unknown_kind', 'pending')]
+    assert 'No handler' in all_jobs(db)[1].last_error
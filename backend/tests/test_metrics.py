@@ -0,0 +1,38 @@
+import re
+
+from fastapi.testclient import TestClient
+
+import main
+import metrics
+
+
+def sample(text, name, **labels): #value of one sample in the Prometheus text format, 0 if it is not there
+    label_text = ','.join(f'{key}="{value}"' for key, value in labels.items())
+    found = re.search(rf'^{re.escape(name)}\{{{re.escape(label_text)}\}} (\S+)$', text, re.MULTILINE)
+    return float(found.group(1)) if found else 0.0
+
+
+def test_metrics_count_requests_by_route_template():
+    client = TestClient(main.app)
+    before = client.get('/metrics').text
+
+    for _ in range(3):
+        assert client.get('/healthz').status_code == 200
+    response = client.get('/metrics')
+
+    assert response.status_code == 200 and response.headers['content-type'].startswith('text/plain')
+    text = response.text
+    assert '# TYPE http_requests_total counter' in text and '# TYPE http_request_duration_seconds histogram' in text
+    labels = {'method': 'GET', 'route': '/healthz', 'status': '200'}
+    assert sample(text, 'http_requests_total', **labels) == sample(before, 'http_requests_total', **labels) + 3
+    assert sample(text, 'http_request_duration_seconds_count', method='GET', route='/healthz') >= 3
+
+
+def test_custom_counters_are_served():
+    metrics.record_recommendation('popular', 'timeout')
+    text = TestClient(main.app).get('/metrics').text
+
+    assert '# HELP recommendations_served_total' in text
+    assert sample(text, 'recommendations_served_total', strategy='popular', reason='timeout') >= 1
+    for metric in metrics.REGISTRY: #every registered metric is rendered
+        assert f'# TYPE {metric.name} ' in text
@@ -0,0 +1,65 @@
+import pstats
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+import profiling
+
+
+def busy_work():
+    return sum(range(1000))
+
+
+def build_app():
+    app = FastAPI()
+    app.router.route_class = profiling.ProfiledRoute
+    profiles = []
+
+    @app.middleware('http')
+    async def profile_requests(request: Request, call_next):
+        profile_request = profiling.ProfileRequest(email='admin@example.com')
+        token = profiling.current_profile.set(profile_request)
+        try:
+            response = await call_next(request)
+        finally:
+            profiling.current_profile.reset(token)
+        profiles.append(profile_request.profile)
+        return response
+
+    @app.get('/sync')
+    def sync_endpoint(value: int):
+        return {'value': value, 'total': busy_work()}
+
+    @app.get('/async')
+    async def async_endpoint(value: int):
+        return {'value': value, 'total': busy_work()}
+
+    return app, profiles
+
+
+def profiled_functions(profile):
+    return {function for _, _, function in pstats.Stats(profile).stats}
+
+
+def test_sync_and_async_endpoints_are_profiled(monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILING_ENABLED', True)
+    app, profiles = build_app()
+    client = TestClient(app)
+
+    for path in ['/sync', '/async']:
+        response = client.get(path, params={'value': 3})
+        assert response.status_code == 200
+        assert response.json() == {'value': 3, 'total': 499500} #not a coroutine the async endpoint forgot to await
+        assert 'busy_work' in profiled_functions(profiles[-1])
+
+
+def test_profile_names_are_unique(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path))
+    app, profiles = build_app()
+    monkeypatch.setattr(profiling, 'PROFILING_ENABLED', True)
+    TestClient(app).get('/sync', params={'value': 1})
+
+    names = {profiling.save_profile('/event/get_event', profiles[-1]) for _ in range(5)} #all within the same second
+    assert len(names) == 5
+    assert all(name.endswith('.prof') and '-event_get_event-' in name for name in names)
+    assert 'busy_work' in profiling.read_profile(names.pop())
@@ -0,0 +1,78 @@
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+import prompts
+
+
+@pytest.fixture(params=['estimate', 'tiktoken'])
+def tokenizer(request, monkeypatch):
+    prompts.get_encoding.cache_clear()
+    if request.param == 'estimate':
+        monkeypatch.setitem(sys.modules, 'tiktoken', None) #as if tiktoken was not installed -> import fails
+    elif prompts.get_encoding() is None:
+        pytest.skip('the tiktoken vocabulary could not be loaded')
+    yield request.param
+    prompts.get_encoding.cache_clear()
+
+
+def paragraph(topic, sentences):
+    return ' '.join(f'Sentence {number} is about {topic} and volunteering on the weekend.' for number in range(sentences))
+
+
+def test_estimate_without_tiktoken(monkeypatch):
+    prompts.get_encoding.cache_clear()
+    monkeypatch.setitem(sys.modules, 'tiktoken', None)
+
+    assert prompts.get_encoding() is None
+    assert prompts.count_tokens('x' * 40) == 10
+    assert prompts.truncate_tokens('x' * 100, 5) == 'x' * 20
+    prompts.get_encoding.cache_clear()
+
+
+def test_short_text_is_kept_as_it_is(tokenizer):
+    text = 'Help us clean the beach.'
+    assert prompts.fit_to_budget(text, 50) == (text, prompts.count_tokens(text))
+
+
+def test_long_text_is_cut_to_the_budget_in_sentence_order(tokenizer):
+    text = paragraph('litter', 60)
+    trimmed, tokens = prompts.fit_to_budget(text, 100)
+
+    assert tokens == prompts.count_tokens(trimmed) and tokens <= 100 < prompts.count_tokens(text)
+    kept = prompts.split_sentences(trimmed)
+    assert kept and all(sentence in text for sentence in kept)
+    assert kept == sorted(kept, key=text.index) #original order
+
+
+def test_relevant_sentences_are_kept_first(tokenizer):
+    text = paragraph('gardening', 30) + ' I have years of experience cleaning beaches and sorting litter. ' + paragraph('cooking', 30)
+    trimmed, tokens = prompts.fit_to_budget(text, 40, prompts.words('beach litter cleaning beaches'))
+
+    assert 'cleaning beaches and sorting litter' in trimmed
+
+
+def test_one_long_sentence_keeps_its_start(tokenizer):
+    text = 'word ' * 500
+    trimmed, tokens = prompts.fit_to_budget(text, 20)
+    assert tokens <= 20 and text.startswith(trimmed)
+
+
+def test_task_prompt_sections_stay_within_their_budgets(tokenizer):
+    event = SimpleNamespace(title='Beach cleanup', description=paragraph('the beach', 200), tasks=paragraph('sorting litter', 100))
+    user = SimpleNamespace(skills=paragraph('first aid', 80), interests=paragraph('the ocean', 80), past_volunteer_experience=paragraph('food banks', 120))
+
+    prompt = prompts.build_task_prompt(event, user)
+    for name, budget in prompts.SECTION_BUDGETS.items():
+        section = prompt.sections[name]
+        assert section['tokens'] <= budget < section['original_tokens']
+    assert prompt.tokens == prompts.count_tokens(prompt.text)
+    assert prompt.tokens < sum(section['original_tokens'] for section in prompt.sections.values())
+    #the event part comes first and doesn't depend on the user -> the same prefix for every volunteer of the event
+    assert prompt.text.startswith('Here is a description and list of tasks of the volunteering event')
+    assert prompt.text.index('Event Tasks') < prompt.text.index('User Skills') < prompt.text.index('User Interests') < prompt.text.index('User Past Volunteer Experience')
+    other = SimpleNamespace(skills='Cooking.', interests='Music.', past_volunteer_experience='None.')
+    event_part = prompt.text[:prompt.text.index("Here is the user's")]
+    assert prompts.build_task_prompt(event, other).text.startswith(event_part)
+    assert prompt.text.endswith(prompts.TASK_QUESTION)
@@ -0,0 +1,99 @@
+import threading
+import time
+
+import pytest
+
+import admission
+import database
+import metrics
+import recommendations
+from cache import get_cache
+from conftest import add_event, add_user
+
+
+@pytest.fixture
+def setup(db, monkeypatch):
+    get_cache('recommendations').clear()
+    monkeypatch.setattr(recommendations, 'RECOMMENDATIONS_BUDGET_SECONDS', 0.2)
+    add_event(db, 'Full', capacity=2, users_registered=['x', 'y'])
+    add_event(db, 'Half full', capacity=4, users_registered=['x', 'y'])
+    add_event(db, 'Empty', capacity=5)
+    user = add_user(db, 'ann@example.com')
+    calls = []
+    yield user, calls
+    for future in list(recommendations.in_flight.values()): #let rankings left running in the background finish before the next test
+        future.exception()
+
+
+def ranking(calls, titles=('Empty',), seconds=0.0, error=None):
+    def top_events(db, user):
+        calls.append(user.id)
+        time.sleep(seconds)
+        if error is not None:
+            raise error
+        return list(titles)
+    return top_events
+
+
+def served(strategy, reason='none'):
+    return metrics.recommendations_served._values.get((strategy, reason), 0)
+
+
+def test_personalized_list_is_cached(db, setup, monkeypatch):
+    user, calls = setup
+    monkeypatch.setattr(recommendations, 'top_events', ranking(calls, ['Empty', 'Full']))
+
+    assert recommendations.recommend(db, user) == (['Empty', 'Full'], 'personalized')
+    assert recommendations.recommend(db, user) == (['Empty', 'Full'], 'personalized')
+    assert calls == ['ann@example.com']
+
+
+def test_timeout_serves_popular_events_then_the_finished_ranking(db, setup, monkeypatch):
+    user, calls = setup
+    monkeypatch.setattr(recommendations, 'top_events', ranking(calls, seconds=0.5))
+    before = served('popular', 'timeout')
+
+    start = time.monotonic()
+    assert recommendations.recommend(db, user) == (['Half full', 'Empty'], 'popular') #full events have no room left
+    assert time.monotonic() - start < 0.45
+    assert served('popular', 'timeout') == before + 1
+
+    recommendations.in_flight[recommendations.state_key(db, user)].result() #the ranking carries on in the background
+    assert recommendations.recommend(db, user) == (['Empty'], 'personalized')
+    assert calls == ['ann@example.com']
+
+
+@pytest.mark.parametrize('error, reason', [(RuntimeError('provider down'), 'error'), (admission.Rejected('embedding', 'timeout', 5), 'rejected')])
+def test_failures_serve_the_last_personalized_list(db, setup, monkeypatch, error, reason):
+    user, calls = setup
+    get_cache('recommendations').set(f'last:{user.id}', ['Full'])
+    monkeypatch.setattr(recommendations, 'top_events', ranking(calls, error=error))
+    before = served('last_cached', reason)
+
+    assert recommendations.recommend(db, user) == (['Full'], 'last_cached')
+    assert served('last_cached', reason) == before + 1
+
+
+def test_concurrent_requests_share_one_ranking(db, setup, monkeypatch):
+    user, calls = setup
+    monkeypatch.setattr(recommendations, 'top_events', ranking(calls, seconds=0.1))
+    monkeypatch.setattr(recommendations, 'RECOMMENDATIONS_BUDGET_SECONDS', 5)
+    submitted, submit = [], recommendations.executor.submit
+    monkeypatch.setattr(recommendations.executor, 'submit', lambda *args: submitted.append(args) or submit(*args))
+    results = []
+
+    def request():
+        session = database.SessionLocal()
+        try:
+            results.append(recommendations.recommend(session, session.get(type(user), user.id)))
+        finally:
+            session.close()
+
+    threads = [threading.Thread(target=request) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [(['Empty'], 'personalized')] * 6
+    assert len(submitted) == 1 and calls == ['ann@example.com'] #the others waited on the same future instead of queueing
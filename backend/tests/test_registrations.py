@@ -0,0 +1,84 @@
+import concurrent.futures
+
+from fastapi.testclient import TestClient
+
+from conftest import add_event, add_user
+
+
+def registrations(db, title):
+    import models
+
+    db.expire_all()
+    event = db.query(models.Event).filter(models.Event.title == title).one()
+    users = {user.id: user.events_registered for user in db.query(models.User).all()}
+    return event.users_registered, users
+
+
+def test_register_unregister_and_kick_keep_both_sides_in_step(client, db):
+    add_user(db, 'admin@example.com', is_admin=True)
+    add_user(db, 'ann@example.com', events_registered=['Other event'])
+    add_user(db, 'bob@example.com')
+    add_event(db, 'Beach cleanup')
+
+    for email in ['ann@example.com', 'bob@example.com']:
+        assert client.post('/event/register_event', params={'email': email, 'title': 'Beach cleanup'}).status_code == 200
+    assert client.post('/event/register_event', params={'email': 'ann@example.com', 'title': 'Beach cleanup'}).status_code == 400
+    registered, users = registrations(db, 'Beach cleanup')
+    assert registered == ['ann@example.com', 'bob@example.com']
+    assert users['ann@example.com'] == ['Other event', 'Beach cleanup']
+
+    assert client.post('/event/unregister_event', params={'email': 'ann@example.com', 'title': 'Beach cleanup'}).status_code == 200
+    response = client.post('/admin/kick_user', json={'curr_user_email': 'admin@example.com', 'new_user_email': 'bob@example.com', 'title': 'Beach cleanup'})
+    assert response.status_code == 200
+    registered, users = registrations(db, 'Beach cleanup')
+    assert registered == []
+    assert users['ann@example.com'] == ['Other event'] and users['bob@example.com'] == []
+
+
+def test_bulk_register_does_not_repeat_the_event_for_users_listing_it_already(client, db):
+    add_user(db, 'admin@example.com', is_admin=True)
+    add_user(db, 'ann@example.com', events_registered=['Beach cleanup']) #left behind on the user side only
+    add_user(db, 'bob@example.com')
+    add_event(db, 'Beach cleanup')
+
+    response = client.post('/admin/bulk_register', json={'email': 'admin@example.com', 'title': 'Beach cleanup',
+                                                          'user_emails': ['ann@example.com', 'bob@example.com']})
+    assert response.json()['registered'] == 2
+    registered, users = registrations(db, 'Beach cleanup')
+    assert registered == ['ann@example.com', 'bob@example.com']
+    assert users['ann@example.com'] == ['Beach cleanup'] and users['bob@example.com'] == ['Beach cleanup']
+
+
+def test_concurrent_registrations_respect_capacity(db):
+    import main
+
+    add_user(db, 'admin@example.com', is_admin=True)
+    emails = [f'user{number}@example.com' for number in range(12)]
+    for email in emails:
+        add_user(db, email)
+    add_event(db, 'Beach cleanup', capacity=5)
+
+    def register(email):
+        return TestClient(main.app).post('/event/register_event', params={'email': email, 'title': 'Beach cleanup'}).status_code
+
+    def bulk_register(emails):
+        return TestClient(main.app).post('/admin/bulk_register', json={'email': 'admin@example.com', 'title': 'Beach cleanup', 'user_emails': emails}).status_code
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        futures = [executor.submit(register, email) for email in emails[:8]] + [executor.submit(bulk_register, emails[8:])]
+        assert all(future.result() in (200, 400) for future in futures)
+
+    registered, users = registrations(db, 'Beach cleanup')
+    assert len(registered) == 5 and len(set(registered)) == 5
+    assert sorted(registered) == sorted(user_id for user_id, events in users.items() if 'Beach cleanup' in events)
+
+
+def test_users_registered_in_registration_order_without_deleted_users(client, db):
+    add_user(db, 'admin@example.com', is_admin=True)
+    add_user(db, 'bob@example.com')
+    add_user(db, 'ann@example.com')
+    add_event(db, 'Beach cleanup', users_registered=['bob@example.com', 'gone@example.com', 'ann@example.com'])
+
+    response = client.post('/event/get_users_registered', json={'email': 'admin@example.com', 'title': 'Beach cleanup'})
+    assert response.status_code == 200
+    assert response.json() == {'users_registered': ['bob@example.com', 'ann@example.com']}
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+import models
+import related
+import vectors
+from conftest import add_event
+
+
+def graph(db):
+    rows = db.query(models.RelatedEvent.event_id, models.RelatedEvent.related_id, models.RelatedEvent.score).all()
+    lists = {}
+    for event_id, related_id, score in sorted(rows, key=lambda row: (row[0], -row[2], row[1])):
+        lists.setdefault(event_id, []).append((related_id, round(score, 5)))
+    return lists
+
+
+def store(db, event_id, embedding):
+    if db.get(models.Event, event_id) is None:
+        add_event(db, event_id)
+    vectors.save_vector(db, models.EventVector, 'event_id', event_id, embedding)
+    db.commit()
+
+
+def rebuilt(db): #the graph a full rebuild gives for the stored vectors, leaving the table as it was
+    incremental = graph(db)
+    related.rebuild(db)
+    full = graph(db)
+    db.rollback()
+    return incremental, full
+
+
+@pytest.mark.parametrize('events', [6, 40]) #lists that are not full yet, and full lists where events have to make room
+def test_update_event_matches_a_full_rebuild(db, events):
+    generator = np.random.default_rng(events)
+    centres = generator.normal(size=(4, 32))
+    embedding = lambda: centres[generator.integers(4)] + generator.normal(scale=0.6, size=32)
+    for number in range(events):
+        store(db, f'event{number:02}', embedding())
+    related.rebuild(db)
+    db.commit()
+
+    for event_id in ['event03', 'new event', 'event01']: #changed vectors and a new event
+        store(db, event_id, embedding())
+        related.update_event(db, event_id)
+        db.commit()
+        incremental, full = rebuilt(db)
+        assert incremental == full
+        assert all(len(found) == min(related.RELATED_K, len(full) - 1) for found in full.values())
@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+import database
+from cache import get_cache
+from conftest import add_user
+
+TEST_REPLICA_URL = os.environ.get('TEST_REPLICA_URL') #a second database to read from -> a real replica of TEST_DB_URL or just another empty database
+DEAD_URL = 'postgresql://postgres@127.0.0.1:1/nothing' #nothing listens on port 1
+
+
+@pytest.fixture
+def use_replicas(db, monkeypatch):
+    if not TEST_REPLICA_URL:
+        pytest.skip('set TEST_REPLICA_URL to a second database to run the replica tests')
+    get_cache('recent_writes').clear()
+    created = []
+
+    def use(*urls):
+        replicas = [database.Replica(f'replica{index}', url) for index, url in enumerate(urls)]
+        created.extend(replicas)
+        monkeypatch.setattr(database, 'replicas', replicas)
+        return replicas
+
+    yield use
+    for replica in created:
+        replica.engine.dispose()
+
+
+def read_from(replicas):
+    session = database.read_session()
+    try:
+        engine = session.get_bind()
+        return next((replica.name for replica in replicas if replica.engine is engine), 'primary' if engine is database.engine else None)
+    finally:
+        session.close()
+
+
+def test_reads_go_round_the_replicas(use_replicas):
+    replicas = use_replicas(TEST_REPLICA_URL, TEST_REPLICA_URL)
+
+    names = [read_from(replicas) for _ in range(6)]
+    assert set(names) == {'replica0', 'replica1'}
+    assert all(first != second for first, second in zip(names, names[1:]))
+
+
+def test_a_dead_replica_is_skipped(use_replicas):
+    replicas = use_replicas(DEAD_URL, TEST_REPLICA_URL)
+
+    assert [read_from(replicas) for _ in range(4)] == ['replica1'] * 4
+    assert not replicas[0].healthy and replicas[1].healthy
+
+
+def test_reads_fall_back_to_the_primary_without_a_healthy_replica(use_replicas):
+    replicas = use_replicas(DEAD_URL)
+
+    assert [read_from(replicas) for _ in range(2)] == ['primary'] * 2
+
+
+def test_reads_of_fresh_writes_stay_on_the_primary(use_replicas, db):
+    replicas = use_replicas(TEST_REPLICA_URL)
+    add_user(db, 'ann@example.com') #committed on the primary -> remembered for REPLICA_STICKY_SECONDS
+
+    def reads(keys):
+        session = database.read_session(keys)
+        try:
+            return 'primary' if session.get_bind() is database.engine else 'replica'
+        finally:
+            session.close()
+
+    assert reads(['email:ann@example.com']) == 'primary'
+    assert reads(['email:bob@example.com']) == 'replica'
+    assert reads([]) == 'replica'
+    get_cache('recent_writes').clear() #as if REPLICA_STICKY_SECONDS had passed
+    assert reads(['email:ann@example.com']) == 'replica'
+    assert read_from(replicas) == 'replica0'
@@ -0,0 +1,75 @@
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import cache
+import task_cache
+import vectors
+
+
+@pytest.fixture(autouse=True)
+def memory_cache(monkeypatch):
+    store = cache.MemoryCache()
+    monkeypatch.setattr(task_cache, 'get_cache', store.namespace)
+    return store
+
+
+def make_event(**changes):
+    return SimpleNamespace(**{'id': 'beach', 'title': 'Beach cleanup', 'description': 'Clean the beach', 'tasks': 'Pick up litter',
+                              'version': 1, **changes})
+
+
+def profile(seed):
+    blob, scale = vectors.quantize(np.random.default_rng(seed).normal(size=64))
+    return np.frombuffer(blob, dtype=vectors.DTYPES[vectors.VECTOR_FORMAT]), scale
+
+
+def test_event_key_follows_the_prompt_text_only():
+    event = make_event()
+
+    assert task_cache.event_key(make_event(version=2)) == task_cache.event_key(event) #a registration bumps the version
+    for field in ['title', 'description', 'tasks']:
+        assert task_cache.event_key(make_event(**{field: 'Edited'})) != task_cache.event_key(event)
+
+
+def test_similar_profiles_share_tasks_across_registrations():
+    vector, scale = profile(1)
+    task_cache.store(make_event(), 'ann', vector, scale, 'tasks for ann')
+
+    assert task_cache.lookup(make_event(version=5), vector, scale)[0] == 'tasks for ann'
+    other, other_scale = profile(2)
+    assert task_cache.lookup(make_event(), other, other_scale) is None
+    assert task_cache.lookup(make_event(description='Clean the park'), vector, scale) is None
+
+
+def test_concurrent_stores_keep_every_entry(monkeypatch):
+    add_entry = task_cache.add_entry
+
+    def slow_add_entry(*args, **kwargs): #widens the window between reading and writing the event's entries
+        threading.Event().wait(0.02)
+        return add_entry(*args, **kwargs)
+
+    monkeypatch.setattr(task_cache, 'add_entry', slow_add_entry)
+    threads = [threading.Thread(target=task_cache.store, args=(make_event(), f'user{seed}', *profile(seed), f'tasks {seed}')) for seed in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    entries = task_cache.get_cache('task_neighbours').get(task_cache.event_key(make_event()))
+    assert sorted(entries['user_ids']) == sorted(f'user{seed}' for seed in range(8))
+    for seed in range(8):
+        assert task_cache.lookup(make_event(), *profile(seed))[0] == f'tasks {seed}'
+
+
+def test_least_recently_used_profile_is_dropped_first(monkeypatch):
+    monkeypatch.setattr(task_cache, 'TASK_CACHE_PER_EVENT', 2)
+    event = make_event()
+    for seed in range(2):
+        task_cache.store(event, f'user{seed}', *profile(seed), f'tasks {seed}')
+    task_cache.lookup(event, *profile(0)) #user0 used again -> user1 goes first
+
+    entries = task_cache.add_entry(task_cache.get_cache('task_neighbours').get(task_cache.event_key(event)), 'user2', *profile(2), 'tasks 2', cap=2)
+    assert entries['user_ids'] == ['user0', 'user2']
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+import vectors
+
+TOLERANCES = {'float32': 1e-5, 'float16': 2e-3, 'int8': 2e-2} #largest difference from the float32 cosine allowed per format
+
+
+def embeddings(count, dimensions=256, seed=0):
+    return np.random.default_rng(seed).normal(size=(count, dimensions)) * np.random.default_rng(seed + 1).uniform(0.1, 10, size=(count, 1))
+
+
+def cosines(vectors_a, vectors_b):
+    unit_a = vectors_a / np.linalg.norm(vectors_a, axis=1, keepdims=True)
+    unit_b = vectors_b / np.linalg.norm(vectors_b, axis=1, keepdims=True)
+    return unit_a @ unit_b.T
+
+
+def matrix_of(rows, vector_format):
+    return vectors.VectorMatrix.from_rows([(f'id{number}', *vectors.quantize(row, vector_format)) for number, row in enumerate(rows)], vector_format)
+
+
+@pytest.mark.parametrize('vector_format', ['float32', 'float16', 'int8'])
+def test_quantize_round_trip(vector_format):
+    embedding = embeddings(1)[0]
+    blob, scale = vectors.quantize(embedding, vector_format)
+
+    stored = np.frombuffer(blob, dtype=vectors.DTYPES[vector_format])
+    assert len(blob) == len(embedding) * np.dtype(vectors.DTYPES[vector_format]).itemsize
+    restored = stored.astype(np.float64) * scale
+    assert np.linalg.norm(restored) == pytest.approx(1, abs=TOLERANCES[vector_format])
+    assert np.abs(restored - embedding / np.linalg.norm(embedding)).max() < TOLERANCES[vector_format]
+    if vector_format == 'int8':
+        assert np.abs(stored).max() == 127 #the largest value uses the full range
+    else:
+        assert scale == 1.0
+
+
+@pytest.mark.parametrize('vector_format', ['float32', 'float16', 'int8'])
+def test_scores_stay_close_to_float32_cosines(vector_format):
+    rows, queries = embeddings(50), embeddings(5, seed=7)
+    matrix = matrix_of(rows, vector_format)
+    expected = cosines(queries, rows)
+
+    for number, query in enumerate(queries):
+        blob, scale = vectors.quantize(query, vector_format)
+        scores = matrix.scores(np.frombuffer(blob, dtype=vectors.DTYPES[vector_format]), scale)
+        assert scores.dtype == np.float32
+        assert np.abs(scores - expected[number]).max() < TOLERANCES[vector_format]
+    block = matrix.block_scores(np.arange(10))
+    assert np.abs(block - cosines(rows[:10], rows)).max() < TOLERANCES[vector_format]
+    assert np.abs(np.diag(block[:, :10]) - 1).max() < TOLERANCES[vector_format] #each vector with itself
+
+
+def test_int8_products_do_not_overflow():
+    row = np.full(1536, 5.0) #every value quantizes to 127 -> 1536 * 127 * 127 is far beyond int16
+    matrix = matrix_of([row], 'int8')
+    assert matrix.scores(*matrix.row(0))[0] == pytest.approx(1, abs=1e-3)
+
+
+def test_updated_replaces_and_adds_rows():
+    rows = embeddings(3)
+    matrix = matrix_of(rows, 'int8')
+    replacement, extra = embeddings(2, seed=3)
+
+    matrix = matrix.updated([('id1', *vectors.quantize(replacement, 'int8')), ('new', *vectors.quantize(extra, 'int8'))])
+    assert matrix.ids == ['id0', 'id1', 'id2', 'new'] and matrix.positions['new'] == 3
+    scores = matrix.scores(*matrix.row(1))
+    assert np.abs(scores - cosines(replacement[np.newaxis], np.vstack([rows[0], replacement, rows[2], extra]))[0]).max() < TOLERANCES['int8']
@@ -0,0 +1,105 @@
+from datetime import timedelta
+
+import numpy as np
+import pytest
+from sqlalchemy import func
+
+import models
+import vectors
+import volunteers
+from conftest import add_event, add_user
+
+DIMENSIONS = 32
+
+
+def direction(angle): #unit vector at the given angle from the event's -> its cosine with the event is cos(angle)
+    embedding = np.zeros(DIMENSIONS)
+    embedding[0], embedding[1] = np.cos(angle), np.sin(angle)
+    return embedding
+
+
+def store_user(db, user_id, angle):
+    vectors.save_vector(db, models.UserVector, 'user_id', user_id, direction(angle))
+    db.commit()
+
+
+@pytest.fixture
+def event(db, monkeypatch):
+    monkeypatch.setattr(volunteers, 'user_matrix', volunteers.UserMatrix())
+    event = add_event(db, 'Beach cleanup', users_registered=['u1@example.com'])
+    vectors.save_vector(db, models.EventVector, 'event_id', event.id, direction(0))
+    profiles = [('student', 17), ('Student', 22), ('worker', 30), ('student', 40), ('retired', 70), ('worker', 25), ('student', 19), ('worker', 55)]
+    for number, (work_status, age) in enumerate(profiles): #u0 is the best match, u7 the worst
+        add_user(db, f'u{number}@example.com', work_status=work_status, age=age)
+        store_user(db, f'u{number}@example.com', 0.2 * number)
+    add_user(db, 'new@example.com') #embedding job has not run yet -> no vector, left out
+    return event
+
+
+def ids(results):
+    return [user_id.split('@')[0] for user_id, score in results]
+
+
+def test_ranks_every_user_with_a_vector(db, event):
+    total, results = volunteers.rank_users(db, event)
+
+    assert total == 8
+    assert ids(results) == [f'u{number}' for number in range(8)]
+    assert [score for user_id, score in results] == pytest.approx([np.cos(0.2 * number) for number in range(8)], abs=0.02)
+
+
+def test_filters_are_applied_before_paging(db, event):
+    total, results = volunteers.rank_users(db, event, work_status='STUDENT', max_age=30, limit=2)
+    assert total == 3 and ids(results) == ['u0', 'u1'] #u3 is too old, u6 didn't fit on the page
+
+    total, results = volunteers.rank_users(db, event, work_status='student', min_age=18, unregistered_only=True)
+    assert total == 2 and ids(results) == ['u3', 'u6'] #u1 is registered already
+
+    total, results = volunteers.rank_users(db, event, unregistered_only=True, limit=3)
+    assert total == 7 and ids(results) == ['u0', 'u2', 'u3']
+    assert volunteers.rank_users(db, event, work_status='pilot') == (0, [])
+
+
+def test_pages_add_up_to_the_full_ranking(db, event):
+    full = ids(volunteers.rank_users(db, event, limit=100)[1])
+
+    pages = [volunteers.rank_users(db, event, limit=3, offset=offset) for offset in range(0, 12, 3)]
+    assert [total for total, results in pages] == [8] * 4
+    assert sum((ids(results) for total, results in pages), []) == full
+    assert pages[-1][1] == []
+
+
+def test_refresh_reads_only_recent_rows_and_late_commits(db, event, monkeypatch):
+    matrix = volunteers.user_matrix
+    matrix.refresh(db)
+    assert len(matrix.matrix) == 8
+
+    store_user(db, 'u7@example.com', 0.05) #updated -> now the second best match
+    add_user(db, 'late@example.com')
+    store_user(db, 'late@example.com', 0.01)
+    #committed late, with a time before the newest one read -> still within the lease-length overlap
+    db.query(models.UserVector).filter(models.UserVector.user_id == 'late@example.com').update({'updated_at': matrix.latest - timedelta(seconds=60)})
+    db.commit()
+
+    built, from_rows = [], vectors.VectorMatrix.from_rows
+    monkeypatch.setattr(vectors.VectorMatrix, 'from_rows', lambda rows, *args: built.append(len(rows)) or from_rows(rows, *args))
+    assert ids(volunteers.rank_users(db, event, limit=3)[1]) == ['u0', 'late', 'u7']
+    assert built == [1] and len(matrix.matrix) == 9 #only the new row was read into a matrix, u7 changed in place
+
+    db.query(models.UserVector).filter(models.UserVector.user_id == 'u0@example.com').delete()
+    db.commit()
+    assert volunteers.rank_users(db, event, limit=2)[0] == 8 #a delete changes the count -> everything is read again
+    assert ids(volunteers.rank_users(db, event, limit=2)[1]) == ['late', 'u7']
+
+
+def test_rows_older_than_the_overlap_trigger_a_full_read(db, event):
+    matrix = volunteers.user_matrix
+    matrix.refresh(db)
+    add_user(db, 'old@example.com')
+    store_user(db, 'old@example.com', 0.0)
+    db.query(models.UserVector).filter(models.UserVector.user_id == 'old@example.com').update(
+        {'updated_at': db.query(func.now()).scalar() - volunteers.REFRESH_OVERLAP - timedelta(hours=1)})
+    db.commit()
+
+    matrix.refresh(db) #missed by the incremental read -> the count doesn't match
+    assert 'old@example.com' in matrix.matrix.positions and len(matrix.matrix) == 9
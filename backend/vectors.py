@@ -0,0 +1,132 @@
+import os
+import numpy as np
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from openai_llm import get_embeddings, get_embeddings_many
+import models
+
+#stored embeddings of events and users -> written by the background jobs in jobs.py, read when matching users to events
+#vectors are stored as compact blobs: scaled to unit length, then kept as float32, float16 or int8 with a per-vector scale
+#scores are computed on the stored values directly -> a matrix of int8 vectors is never expanded back to floats
+
+VECTOR_FORMAT = os.environ.get('VECTOR_FORMAT', 'int8') #float32, float16 or int8 -> 4, 2 or 1 bytes per dimension
+VECTOR_DIMENSIONS = int(os.environ.get('VECTOR_DIMENSIONS', 0)) or None #ask the embedding model for shorter vectors, e.g. 512 -> None keeps the full 1536
+
+DTYPES = {'float32': np.float32, 'float16': np.float16, 'int8': np.int8}
+ACCUMULATORS = {'float32': np.float32, 'float16': np.float32, 'int8': np.int32} #type dot products are summed in, wide enough not to overflow or lose precision
+
+def quantize(embedding, vector_format: str = VECTOR_FORMAT):
+    """Returns the blob and scale of an embedding in the given format.
+
+    The vector is scaled to unit length first, so a dot product of two stored vectors times their scales is their cosine similarity.
+    int8 maps the largest absolute value to 127, and the scale turns the integers back into the unit vector.
+    """
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector = vector / norm
+    if vector_format == 'int8':
+        scale = float(np.abs(vector).max()) / 127 or 1.0
+        return np.round(vector / scale).astype(np.int8).tobytes(), scale
+    return vector.astype(DTYPES[vector_format]).tobytes(), 1.0
+
+
+class VectorMatrix:
+    """Stored vectors of the same format stacked into one matrix, with their ids and scales."""
+
+    def __init__(self, ids, data, scales, vector_format: str = VECTOR_FORMAT):
+        self.ids = ids
+        self.positions = {row_id: row for row, row_id in enumerate(ids)}
+        self.data = data #one row per vector, in the stored type
+        self.scales = scales #float32, one per row
+        self.format = vector_format
+
+    @classmethod
+    def from_rows(cls, rows, vector_format: str = VECTOR_FORMAT): #rows of (id, blob, scale)
+        dtype = DTYPES[vector_format]
+        if not rows:
+            return cls([], np.zeros((0, 0), dtype=dtype), np.zeros(0, dtype=np.float32), vector_format)
+        data = np.vstack([np.frombuffer(blob, dtype=dtype) for row_id, blob, scale in rows])
+        return cls([row_id for row_id, blob, scale in rows], data, np.asarray([scale for row_id, blob, scale in rows], dtype=np.float32), vector_format)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.scales.nbytes
+
+    def updated(self, rows): #returns the matrix with the given (id, blob, scale) rows written over existing ones or added -> existing rows change in place
+        added = []
+        for row_id, blob, scale in rows:
+            position = self.positions.get(row_id)
+            if position is None:
+                added.append((row_id, blob, scale))
+            else:
+                self.data[position] = np.frombuffer(blob, dtype=DTYPES[self.format])
+                self.scales[position] = scale
+        if not added:
+            return self
+        if not len(self):
+            return VectorMatrix.from_rows(added, self.format)
+        extra = VectorMatrix.from_rows(added, self.format)
+        return VectorMatrix(self.ids + extra.ids, np.vstack([self.data, extra.data]), np.concatenate([self.scales, extra.scales]), self.format)
+
+    def row(self, index: int): #returns the stored vector and scale of a row
+        return self.data[index], self.scales[index]
+
+    def scores(self, vector, scale, rows=None): #cosine similarity of every row (or only the given rows) with one stored vector
+        data, scales = (self.data, self.scales) if rows is None else (self.data[rows], self.scales[rows])
+        products = np.einsum('ij,j->i', data, vector, dtype=ACCUMULATORS[self.format])
+        return products.astype(np.float32) * scales * np.float32(scale)
+
+    def block_scores(self, rows): #cosine similarity of the given rows with every row, one row of results per given row
+        products = np.einsum('ik,jk->ij', self.data[rows], self.data, dtype=ACCUMULATORS[self.format])
+        return products.astype(np.float32) * np.outer(self.scales[rows], self.scales)
+
+
+def event_text(event): #the text of an event that gets embedded
+    return event.description
+
+def user_text(user): #the text of a user's profile that gets embedded
+    return user.skills + ' ' + user.interests + ' ' + user.past_volunteer_experience
+
+def is_current(model): #filter for stored vectors in the configured format -> others are treated as missing and embedded again
+    conditions = [model.format == VECTOR_FORMAT]
+    if VECTOR_DIMENSIONS:
+        conditions.append(model.dimensions == VECTOR_DIMENSIONS)
+    return conditions
+
+def save_vector(db: Session, model, key: str, row_id: str, embedding):
+    data, scale = quantize(embedding)
+    values = {key: row_id, 'format': VECTOR_FORMAT, 'dimensions': len(embedding), 'scale': scale, 'data': data}
+    statement = insert(model).values(**values)
+    db.execute(statement.on_conflict_do_update(index_elements=[key], set_={**{name: statement.excluded[name] for name in values if name != key}, 'updated_at': statement.excluded.updated_at}))
+    return np.frombuffer(data, dtype=DTYPES[VECTOR_FORMAT]), scale
+
+def embed_event(db: Session, event): #returns the stored vector and scale
+    return save_vector(db, models.EventVector, 'event_id', event.id, get_embeddings(event_text(event), VECTOR_DIMENSIONS))
+
+def embed_events(db: Session, events): #embeds and stores several events with one embedding call
+    embeddings = get_embeddings_many([event_text(event) for event in events], VECTOR_DIMENSIONS) if events else []
+    for event, embedding in zip(events, embeddings):
+        save_vector(db, models.EventVector, 'event_id', event.id, embedding)
+
+def embed_user(db: Session, user):
+    return save_vector(db, models.UserVector, 'user_id', user.id, get_embeddings(user_text(user), VECTOR_DIMENSIONS))
+
+def load_event_matrix(db: Session):
+    rows = db.query(models.EventVector.event_id, models.EventVector.data, models.EventVector.scale).filter(*is_current(models.EventVector)).order_by(models.EventVector.event_id).all()
+    return VectorMatrix.from_rows(rows)
+
+def get_event_vector(db: Session, event): #the stored vector and scale of an event, embedding it now if the job has not run yet
+    row = db.query(models.EventVector.data, models.EventVector.scale).filter(models.EventVector.event_id == event.id, *is_current(models.EventVector)).first()
+    if row:
+        return np.frombuffer(row.data, dtype=DTYPES[VECTOR_FORMAT]), row.scale
+    return embed_event(db, event)
+
+def get_user_vector(db: Session, user): #the stored vector and scale of a user, embedding the profile now if the job has not run yet
+    row = db.query(models.UserVector.data, models.UserVector.scale).filter(models.UserVector.user_id == user.id, *is_current(models.UserVector)).first()
+    if row:
+        return np.frombuffer(row.data, dtype=DTYPES[VECTOR_FORMAT]), row.scale
+    return embed_user(db, user)
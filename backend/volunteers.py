@@ -0,0 +1,88 @@
+import threading
+from datetime import timedelta
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+import jobs, models, vectors
+
+#ranks users for an event by how close their profile vector is to the event's vector -> used by /admin/match_volunteers
+#every process keeps the stored user vectors in one matrix and only reads the rows written since it last looked,
+#so ranking even 100k users is one matrix-vector product rather than reading every vector from the database
+
+#updated_at is when the writing transaction started, so a row can commit after rows with a newer time -> look back this far on every refresh
+#vectors are written by embedding jobs, and a job running longer than its lease is given to another worker
+REFRESH_OVERLAP = timedelta(seconds=jobs.JOB_LEASE_SECONDS)
+
+
+class UserMatrix:
+    """The stored vectors of all users, kept in step with the user_embeddings table."""
+
+    def __init__(self):
+        self.matrix = vectors.VectorMatrix.from_rows([])
+        self.latest = None #newest updated_at read so far
+        self.lock = threading.Lock() #held while refreshing and scoring, as refreshing writes rows in place
+
+    def refresh(self, db: Session):
+        current = vectors.is_current(models.UserVector)
+        count = db.query(func.count(models.UserVector.user_id)).filter(*current).scalar()
+        query = db.query(models.UserVector.user_id, models.UserVector.data, models.UserVector.scale, models.UserVector.updated_at).filter(*current)
+        if self.latest is not None:
+            rows = query.filter(models.UserVector.updated_at >= self.latest - REFRESH_OVERLAP).all()
+            matrix = self.matrix.updated([(row.user_id, row.data, row.scale) for row in rows])
+            if len(matrix) == count: #otherwise users were deleted (or rows were missed) -> read everything again
+                self.matrix = matrix
+                self.latest = max([self.latest] + [row.updated_at for row in rows])
+                return
+        rows = query.all()
+        self.matrix = vectors.VectorMatrix.from_rows([(row.user_id, row.data, row.scale) for row in rows])
+        self.latest = max((row.updated_at for row in rows), default=None)
+
+
+user_matrix = UserMatrix()
+
+
+def rank_users(db: Session, event, work_status: str = None, min_age: int = None, max_age: int = None,
+               unregistered_only: bool = False, limit: int = 20, offset: int = 0):
+    """Returns the number of matching users and the ids and scores of one page of them, best match first.
+
+    The filters are applied before scoring, so only the matching users' rows are multiplied. Users whose embedding
+    job has not run yet have no vector and are left out.
+    """
+    event_vector, event_scale = vectors.get_event_vector(db, event)
+    excluded = set(event.users_registered or []) if unregistered_only else set()
+
+    candidates = None #None means every user
+    if work_status is not None or min_age is not None or max_age is not None:
+        query = db.query(models.User.id)
+        if work_status is not None:
+            query = query.filter(func.lower(models.User.work_status) == work_status.lower())
+        if min_age is not None:
+            query = query.filter(models.User.age >= min_age)
+        if max_age is not None:
+            query = query.filter(models.User.age <= max_age)
+        candidates = [user_id for (user_id,) in query]
+
+    with user_matrix.lock:
+        user_matrix.refresh(db)
+        matrix = user_matrix.matrix
+        if candidates is not None:
+            rows = np.fromiter((matrix.positions[user_id] for user_id in candidates if user_id in matrix.positions and user_id not in excluded), dtype=np.intp)
+        elif excluded:
+            keep = np.ones(len(matrix), dtype=bool)
+            keep[[matrix.positions[user_id] for user_id in excluded if user_id in matrix.positions]] = False
+            rows = np.flatnonzero(keep)
+        else:
+            rows = None
+        if not len(matrix) or (rows is not None and not len(rows)):
+            scores = np.zeros(0, dtype=np.float32)
+        else:
+            scores = matrix.scores(event_vector, event_scale, rows) #no rows scores the whole matrix without copying it
+        rows = np.arange(len(matrix)) if rows is None else rows
+        ids = matrix.ids
+
+    wanted = min(offset + limit, len(rows))
+    if wanted <= 0:
+        return len(rows), []
+    top = np.argpartition(-scores, wanted - 1)[:wanted] if wanted < len(rows) else np.arange(len(rows))
+    top = top[np.argsort(-scores[top], kind='stable')][offset:]
+    return len(rows), [(ids[rows[i]], float(scores[i])) for i in top]
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -48,6 +49,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'reco_app.middleware.backend_timing_middleware',
+    'reco_app.middleware.profiling_middleware',
 ]
 
 ROOT_URLCONF = 'hack4good.urls'
@@ -83,6 +86,26 @@ DATABASES = {
 
 AUTH_USER_MODEL = 'reco_app.User'
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+# Holds cached backend reads. LocMemCache is per process, so backend_client.invalidate() only clears the worker that made
+# the change -> with FRONTEND_WORKERS > 1, set FRONTEND_CACHE_URL (e.g. redis://localhost:6379/1) so all workers share one cache
+
+FRONTEND_CACHE_URL = os.environ.get('FRONTEND_CACHE_URL')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': FRONTEND_CACHE_URL,
+    } if FRONTEND_CACHE_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -123,3 +146,43 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# FastAPI backend
+# All views talk to the backend through reco_app.backend_client, which keeps a pooled keep-alive session
+
+FASTAPI_BASE_URL = os.environ.get('FASTAPI_BASE_URL', 'http://localhost:8000')
+
+BACKEND_POOL_SIZE = int(os.environ.get('BACKEND_POOL_SIZE', 20))
+
+BACKEND_CONNECT_TIMEOUT = float(os.environ.get('BACKEND_CONNECT_TIMEOUT', 3.05))
+
+BACKEND_READ_TIMEOUT = float(os.environ.get('BACKEND_READ_TIMEOUT', 30))
+
+# Seconds the deferred recommendation panel waits for the backend before showing a placeholder
+RECOMMENDATIONS_TIMEOUT = float(os.environ.get('RECOMMENDATIONS_TIMEOUT', 10))
+
+# Oldest local copy (see reco_app.mirror and the sync_mirror command) pages may read before falling back to the backend, in seconds
+EVENT_MIRROR_MAX_STALENESS = int(os.environ.get('EVENT_MIRROR_MAX_STALENESS', 120))
+
+RECO_MIRROR_MAX_STALENESS = int(os.environ.get('RECO_MIRROR_MAX_STALENESS', 3600))
+
+# Event versions are taken when a write happens, not when it commits -> each sync re-reads this many versions behind its cursor
+# to pick up writes that committed late, and sync_mirror --full-every reloads everything now and then for anything older
+EVENT_MIRROR_OVERLAP_VERSIONS = int(os.environ.get('EVENT_MIRROR_OVERLAP_VERSIONS', 1000))
+
+# Seconds a cached backend read stays fresh, by backend path -> writes from this frontend invalidate them sooner
+BACKEND_CACHE_TTLS = {
+    '/event/get_event': 300,
+    '/event/get_events': 60,
+    '/event/related': 300,
+    '/user/get_user': 300,
+}
+
+# Seconds expired entries are kept so they can be revalidated with their ETag (a 304 costs no body from the backend)
+BACKEND_CACHE_KEEP = int(os.environ.get('BACKEND_CACHE_KEEP', 3600))
+
+# Per-request profiling (see reco_app.middleware.profiling_middleware) - admins only unless PROFILING_ENABLED=1
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '0') == '1'
+
+PROFILE_DIR = os.environ.get('PROFILE_DIR', BASE_DIR / 'profiles')
@@ -0,0 +1,271 @@
+"""
+Shared client for calls from the Django views to the FastAPI backend.
+
+A single requests.Session is kept per process so connections to the backend
+are pooled and kept alive instead of being opened again for every call.
+Async views use the a* functions, backed by one httpx.AsyncClient per event loop.
+
+Reads listed in settings.BACKEND_CACHE_TTLS can go through cached_get/acached_get,
+which keep the decoded JSON in Django's cache. Once an entry is older than its TTL
+it is revalidated with its ETag, and a 304 from the backend reuses the cached body. Views that change data call
+invalidate() for the affected reads so users see their own writes straight away.
+"""
+
+import asyncio
+import contextvars
+import threading
+import time
+import weakref
+from urllib.parse import urlencode
+
+import httpx
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+
+_session = None
+_session_lock = threading.Lock()
+
+#an AsyncClient can only be used from the loop it was created on -> keep one per running loop
+_async_clients = weakref.WeakKeyDictionary()
+
+#backend calls made while handling the current Django request as (method, path, seconds), set by reco_app.middleware
+backend_calls = contextvars.ContextVar("backend_calls", default=None)
+
+
+def _record_call(method, path, start):
+    calls = backend_calls.get()
+    if calls is not None:
+        calls.append((method, path, time.perf_counter() - start))
+
+
+def build_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=settings.BACKEND_POOL_SIZE,
+        pool_maxsize=settings.BACKEND_POOL_SIZE,
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session():
+    global _session
+
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = build_session()
+    return _session
+
+
+def request(method, path, **kwargs):
+    kwargs.setdefault("timeout", (settings.BACKEND_CONNECT_TIMEOUT, settings.BACKEND_READ_TIMEOUT))
+    start = time.perf_counter()
+    try:
+        return get_session().request(method, f"{settings.FASTAPI_BASE_URL}{path}", **kwargs)
+    finally:
+        _record_call(method, path, start)
+
+
+def get(path, **kwargs):
+    return request("GET", path, **kwargs)
+
+
+def post(path, **kwargs):
+    return request("POST", path, **kwargs)
+
+
+def get_async_client():
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            base_url=settings.FASTAPI_BASE_URL,
+            limits=httpx.Limits(
+                max_connections=settings.BACKEND_POOL_SIZE,
+                max_keepalive_connections=settings.BACKEND_POOL_SIZE,
+            ),
+            timeout=httpx.Timeout(settings.BACKEND_READ_TIMEOUT, connect=settings.BACKEND_CONNECT_TIMEOUT),
+        )
+        _async_clients[loop] = client
+    return client
+
+
+async def arequest(method, path, **kwargs):
+    start = time.perf_counter()
+    try:
+        return await get_async_client().request(method, path, **kwargs)
+    finally:
+        _record_call(method, path, start)
+
+
+def close():
+    """
+    Close the pooled session, e.g. at the end of a management command (the next call opens a new one)
+    """
+    global _session
+
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+async def aclose():
+    """
+    Close the AsyncClient of the running event loop
+    """
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
+async def aget(path, **kwargs):
+    return await arequest("GET", path, **kwargs)
+
+
+async def apost(path, **kwargs):
+    return await arequest("POST", path, **kwargs)
+
+
+#################################################################################################
+# Response cache
+
+#bumping the generation of a path drops every cached entry for it at once (e.g. all users after an event is deleted)
+#generations start from the clock so one evicted and recreated never matches entries that are still cached
+def _generation_key(path):
+    return f"backend:gen:{path}"
+
+
+def _generation(path):
+    return cache.get_or_set(_generation_key(path), time.time_ns, None)
+
+
+async def _ageneration(path):
+    return await cache.aget_or_set(_generation_key(path), time.time_ns, None)
+
+
+def _entry_key(path, generation, params):
+    return f"backend:{path}:{generation}:{urlencode(sorted((params or {}).items()))}"
+
+
+def _stats_key(path, outcome):
+    return f"backend:stats:{path}:{outcome}"
+
+
+def _count(path, outcome):
+    key = _stats_key(path, outcome)
+    cache.add(key, 0, None)
+    cache.incr(key)
+
+
+async def _acount(path, outcome):
+    key = _stats_key(path, outcome)
+    await cache.aadd(key, 0, None)
+    await cache.aincr(key)
+
+
+def _fresh_body(entry):
+    if entry is not None and time.time() < entry["fresh_until"]:
+        return entry["body"]
+    return None
+
+
+def _conditional_headers(entry):
+    #expired entries are kept so they can be revalidated with If-None-Match instead of downloaded again
+    if entry is not None and entry["etag"]:
+        return {"If-None-Match": entry["etag"]}
+    return {}
+
+
+def _new_entry(path, body, etag):
+    return {
+        "body": body,
+        "etag": etag,
+        "fresh_until": time.time() + settings.BACKEND_CACHE_TTLS[path],
+    }
+
+
+def cached_get(path, params=None):
+    """
+    GET a backend read through the cache and return the decoded JSON body
+    """
+    key = _entry_key(path, _generation(path), params)
+    entry = cache.get(key)
+    body = _fresh_body(entry)
+    if body is not None:
+        _count(path, "hits")
+        return body
+
+    response = get(path, params=params, headers=_conditional_headers(entry))
+    if response.status_code == 304:
+        _count(path, "revalidated")
+        cache.set(key, _new_entry(path, entry["body"], entry["etag"]), settings.BACKEND_CACHE_KEEP)
+        return entry["body"]
+
+    _count(path, "misses")
+    body = response.json()
+    if response.ok:
+        cache.set(key, _new_entry(path, body, response.headers.get("ETag")), settings.BACKEND_CACHE_KEEP)
+    return body
+
+
+async def acached_get(path, params=None):
+    key = _entry_key(path, await _ageneration(path), params)
+    entry = await cache.aget(key)
+    body = _fresh_body(entry)
+    if body is not None:
+        await _acount(path, "hits")
+        return body
+
+    response = await aget(path, params=params, headers=_conditional_headers(entry))
+    if response.status_code == 304:
+        await _acount(path, "revalidated")
+        await cache.aset(key, _new_entry(path, entry["body"], entry["etag"]), settings.BACKEND_CACHE_KEEP)
+        return entry["body"]
+
+    await _acount(path, "misses")
+    body = response.json()
+    if response.is_success:
+        await cache.aset(key, _new_entry(path, body, response.headers.get("ETag")), settings.BACKEND_CACHE_KEEP)
+    return body
+
+
+def invalidate(path, params=None):
+    """
+    Drop the cached entry for path with the given params, or every entry for path if params is None
+    """
+    if params is None:
+        _generation(path)
+        cache.incr(_generation_key(path))
+    else:
+        cache.delete(_entry_key(path, _generation(path), params))
+
+
+async def ainvalidate(path, params=None):
+    if params is None:
+        await _ageneration(path)
+        await cache.aincr(_generation_key(path))
+    else:
+        await cache.adelete(_entry_key(path, await _ageneration(path), params))
+
+
+def cache_stats():
+    stats = {}
+    for path in settings.BACKEND_CACHE_TTLS:
+        hits = cache.get(_stats_key(path, "hits"), 0)
+        revalidated = cache.get(_stats_key(path, "revalidated"), 0)
+        misses = cache.get(_stats_key(path, "misses"), 0)
+        total = hits + revalidated + misses
+        stats[path] = {
+            "hits": hits,
+            "revalidated": revalidated,
+            "misses": misses,
+            "hit_ratio": hits / total if total else None,
+            # cached body reused, with or without asking the backend
+            "reuse_ratio": (hits + revalidated) / total if total else None,
+        }
+    return stats
@@ -0,0 +1,89 @@
+"""
+Measures page latency of the Django views against a running FastAPI backend.
+
+Each page is rendered with the pooled backend client and then again with a fresh
+connection per backend call (how the views behaved before the client was shared).
+All requests run on one event loop, so the async views reuse the same AsyncClient.
+
+    python manage.py bench_pages --email user@example.com --title "Beach Cleanup" -n 50
+"""
+
+import asyncio
+import statistics
+import time
+from unittest import mock
+
+import httpx
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, override_settings
+
+from reco_app import backend_client
+
+
+def unpooled_request(method, path, **kwargs):
+    """
+    Fresh session per call -> new TCP connection every time, like module-level requests.get/post
+    """
+    kwargs.setdefault("timeout", (settings.BACKEND_CONNECT_TIMEOUT, settings.BACKEND_READ_TIMEOUT))
+    with requests.Session() as session:
+        return session.request(method, f"{settings.FASTAPI_BASE_URL}{path}", **kwargs)
+
+
+async def unpooled_arequest(method, path, **kwargs):
+    async with httpx.AsyncClient(base_url=settings.FASTAPI_BASE_URL) as client:
+        return await client.request(method, path, **kwargs)
+
+
+class Command(BaseCommand):
+    help = "Benchmark page latency with and without the pooled backend client"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--email", required=True, help="email of an existing user, sent as the user_email cookie")
+        parser.add_argument("--title", required=True, help="title of an existing event")
+        parser.add_argument("-n", "--iterations", type=int, default=20)
+        parser.add_argument("--pages", nargs="+", choices=["index", "event", "user"], default=["index", "event", "user"])
+
+    def handle(self, *args, **options):
+        pages = {
+            "index": "/",
+            "event": f"/event/{options['title']}",
+            "user": f"/user/{options['email']}",
+        }
+        pages = {name: url for name, url in pages.items() if name in options["pages"]}
+        before, after = asyncio.run(self.run_modes(options["email"], pages, options["iterations"]))
+
+        self.stdout.write(f"{'page':<8}{'mode':<10}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+        for name in pages:
+            for mode, results in (("unpooled", before), ("pooled", after)):
+                timings = results[name]
+                p95 = statistics.quantiles(timings, n=20)[-1] if len(timings) > 1 else timings[0]
+                self.stdout.write(f"{name:<8}{mode:<10}{statistics.mean(timings):>10.1f}{statistics.median(timings):>10.1f}{p95:>10.1f}")
+
+    async def run_modes(self, email, pages, iterations):
+        client = AsyncClient()
+        client.cookies["user_email"] = email
+
+        #the async test client always sends Host: testserver
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, "testserver"]):
+            with mock.patch.object(backend_client, "request", unpooled_request), \
+                 mock.patch.object(backend_client, "arequest", unpooled_arequest):
+                before = await self.run_pages(client, pages, iterations)
+            try:
+                after = await self.run_pages(client, pages, iterations)
+            finally:
+                #the sync views used the shared session from worker threads -> close it as well as this loop's AsyncClient
+                await backend_client.aclose()
+                backend_client.close()
+        return before, after
+
+    async def run_pages(self, client, pages, iterations):
+        results = {name: [] for name in pages}
+        for name, url in pages.items():
+            await client.get(url) #warm up so the pooled run starts with an open connection
+            for _ in range(iterations):
+                start = time.perf_counter()
+                await client.get(url)
+                results[name].append((time.perf_counter() - start) * 1000)
+        return results
@@ -0,0 +1,43 @@
+"""
+Keeps the local Event/Reco tables in sync with the FastAPI backend.
+
+    python manage.py sync_mirror --interval 30 --full-every 20 --recommendations
+"""
+
+import time
+
+from django.core.management.base import BaseCommand
+
+from reco_app import mirror
+
+
+class Command(BaseCommand):
+    help = "Mirror backend events (and optionally recommendations) into the local database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--interval", type=float, default=0, help="seconds between syncs, 0 to sync once and exit")
+        parser.add_argument("--full", action="store_true", help="reload every event before following the change feed")
+        parser.add_argument("--full-every", type=int, default=20,
+                            help="reload every event on every Nth sync, for writes that committed far behind the feed cursor (0 never)")
+        parser.add_argument("--recommendations", action="store_true", help="also refresh stored recommendations")
+
+    def handle(self, *args, **options):
+        full_every = options["full_every"]
+        syncs = 0
+
+        while True:
+            full = (options["full"] and syncs == 0) or (full_every > 0 and syncs > 0 and syncs % full_every == 0)
+            syncs += 1
+            try:
+                version = mirror.sync_events(full=full)
+                self.stdout.write(f"Events {'reloaded' if full else 'synced'} up to version {version}")
+
+                if options["recommendations"]:
+                    mirror.sync_recommendations()
+                    self.stdout.write("Recommendations synced")
+            except Exception as error:
+                self.stderr.write(f"Sync failed: {error}")
+
+            if not options["interval"]:
+                break
+            time.sleep(options["interval"])
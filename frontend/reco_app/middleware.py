@@ -0,0 +1,112 @@
+import cProfile
+import os
+import re
+import time
+import uuid
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.utils.decorators import sync_and_async_middleware
+
+from . import backend_client
+
+
+def add_server_timing(response, calls):
+    """
+    Reports the backend calls of a view in the Server-Timing header, visible in the browser's network tools
+    """
+    total = sum(seconds for _, _, seconds in calls) * 1000
+    entries = [f'backend;dur={total:.1f};desc="{len(calls)} calls"']
+    entries += [f'backend-{i};dur={seconds * 1000:.1f};desc="{method} {path}"' for i, (method, path, seconds) in enumerate(calls)]
+    response["Server-Timing"] = ", ".join(entries)
+    return response
+
+
+@sync_and_async_middleware
+def backend_timing_middleware(get_response):
+    """
+    Times every backend call made while handling a request
+    """
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            calls = []
+            token = backend_client.backend_calls.set(calls)
+            try:
+                response = await get_response(request)
+            finally:
+                backend_client.backend_calls.reset(token)
+            return add_server_timing(response, calls)
+
+    else:
+        def middleware(request):
+            calls = []
+            token = backend_client.backend_calls.set(calls)
+            try:
+                response = get_response(request)
+            finally:
+                backend_client.backend_calls.reset(token)
+            return add_server_timing(response, calls)
+
+    return middleware
+
+
+def wants_profile(request):
+    return bool(request.headers.get("X-Profile") or request.GET.get("profile"))
+
+
+def save_profile(request, profile):
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    # several requests to a page can finish within the same second -> a random suffix keeps them apart
+    path = re.sub(r'[^A-Za-z0-9]+', '_', request.path).strip('_') or 'index'
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{path}-{uuid.uuid4().hex[:8]}.prof"
+    profile.dump_stats(os.path.join(settings.PROFILE_DIR, name))
+    return name
+
+
+@sync_and_async_middleware
+def profiling_middleware(get_response):
+    """
+    Runs a request under cProfile when it carries an X-Profile header or profile query parameter
+    and the logged in user is an admin (or PROFILING_ENABLED is set). The profile is saved in
+    PROFILE_DIR and named in the X-Profile-File response header - read it with `python -m pstats`.
+    Under ASGI this profiles the event loop thread, so work of other requests running at the same time shows up too.
+    """
+
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            if not wants_profile(request):
+                return await get_response(request)
+
+            user_email = request.COOKIES.get("user_email", "None")
+            if not settings.PROFILING_ENABLED and not (await backend_client.aget("/user/is_admin", params={"email": user_email})).json().get("is_admin", False):
+                return await get_response(request)
+
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                response = await get_response(request)
+            finally:
+                profile.disable()
+            response["X-Profile-File"] = save_profile(request, profile)
+            return response
+
+    else:
+        def middleware(request):
+            if not wants_profile(request):
+                return get_response(request)
+
+            user_email = request.COOKIES.get("user_email", "None")
+            if not settings.PROFILING_ENABLED and not backend_client.get("/user/is_admin", params={"email": user_email}).json().get("is_admin", False):
+                return get_response(request)
+
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                response = get_response(request)
+            finally:
+                profile.disable()
+            response["X-Profile-File"] = save_profile(request, profile)
+            return response
+
+    return middleware
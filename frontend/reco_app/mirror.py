@@ -0,0 +1,144 @@
+"""
+Local read mirror of backend events and recommendations.
+
+sync_events() follows the backend /event/changes feed into the local Event table
+(run it through the sync_mirror command). Reads go to the mirror only while the
+last sync is within EVENT_MIRROR_MAX_STALENESS, otherwise they fall back to the
+backend, so a stopped sync never serves data older than that bound.
+
+Feed versions are drawn when a write happens, not when it commits, so a write can
+commit with a version below the cursor. Each sync therefore re-reads the last
+EVENT_MIRROR_OVERLAP_VERSIONS versions, and sync_mirror reloads every event now and
+then (--full-every) for writes that were even later than that.
+"""
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import backend_client
+from .models import Event, MirrorState, Reco
+
+EVENTS = "events"
+
+
+def sync_events(full=False):
+    """
+    Apply event changes from the backend feed, or reload every event if full is True
+    """
+    state, _ = MirrorState.objects.get_or_create(name=EVENTS)
+    since = 0 if full else max(state.version - settings.EVENT_MIRROR_OVERLAP_VERSIONS, 0)
+    seen_ids = set()
+
+    while True:
+        changes = backend_client.get("/event/changes", params={"since": since}).json()
+
+        with transaction.atomic():
+            for event in changes["events"]:
+                Event.objects.update_or_create(backend_id=event["id"], defaults={
+                    "name": event["title"],
+                    "description": event["description"],
+                    "location": event["location"],
+                    "date": event["date"],
+                    "time": event["time"],
+                    "requirements": event["requirements"],
+                    "capacity": event["capacity"],
+                    "deadline": event["deadline"],
+                    "tasks": event["tasks"],
+                    "registered": event["registered"],
+                    "version": event["version"],
+                })
+                seen_ids.add(event["id"])
+            Event.objects.filter(backend_id__in=changes["deleted"]).delete()
+
+        since = changes["version"]
+        if not changes["has_more"]:
+            break
+
+    # A full reload sees every live event -> anything else was deleted while we were not looking
+    if full:
+        Event.objects.exclude(backend_id__in=seen_ids).delete()
+
+    state.version = max(state.version, since) #the re-read overlap must not move the cursor back
+    state.synced_datetime = timezone.now()
+    state.save()
+    return since
+
+
+def sync_recommendations():
+    """
+    Refresh the stored recommendations of every user that has some
+    """
+    for user_email in Reco.objects.values_list("user_email", flat=True).distinct():
+        response = backend_client.get("/user/get_similar_events", params={"email": user_email})
+        if response.ok and response.json().get("strategy", "personalized") == "personalized":
+            store_recommendations(user_email, response.json()["top_5_events"])
+
+
+def store_recommendations(user_email, titles):
+    events = {event.name: event for event in Event.objects.filter(name__in=titles)}
+
+    with transaction.atomic():
+        Reco.objects.filter(user_email=user_email).delete()
+        Reco.objects.bulk_create([
+            Reco(user_email=user_email, event=events[title], rank=rank)
+            for rank, title in enumerate(titles) if title in events
+        ])
+
+
+def _is_fresh(synced_datetime, max_staleness):
+    return synced_datetime is not None and timezone.now() - synced_datetime <= timedelta(seconds=max_staleness)
+
+
+async def _amirror_is_fresh():
+    state = await MirrorState.objects.filter(name=EVENTS).afirst()
+    return state is not None and _is_fresh(state.synced_datetime, settings.EVENT_MIRROR_MAX_STALENESS)
+
+
+def _mirror_is_fresh():
+    state = MirrorState.objects.filter(name=EVENTS).first()
+    return state is not None and _is_fresh(state.synced_datetime, settings.EVENT_MIRROR_MAX_STALENESS)
+
+
+async def aevent_titles():
+    """
+    Titles of all events, from the mirror when it is fresh enough, otherwise from the backend
+    """
+    if await _amirror_is_fresh():
+        return [name async for name in Event.objects.order_by("id").values_list("name", flat=True)]
+
+    return (await backend_client.acached_get("/event/get_events"))["event_titles"]
+
+
+def event_details(title):
+    """
+    Details of one event in the same format as /event/get_event, from the mirror when it is fresh enough
+    """
+    if _mirror_is_fresh():
+        event = Event.objects.filter(name=title).first()
+        if event is not None:
+            return {
+                "title": event.name,
+                "date": event.date,
+                "time": event.time,
+                "requirements": event.requirements,
+                "capacity": event.capacity,
+                "deadline": event.deadline,
+                "location": event.location,
+                "description": event.description,
+                "tasks": event.tasks,
+            }
+
+    return backend_client.cached_get("/event/get_event", params={"title": title})
+
+
+async def arecommendations(user_email):
+    """
+    Stored recommendation titles for a user, or None if there are none recent enough
+    """
+    recos = [reco async for reco in Reco.objects.filter(user_email=user_email).select_related("event").order_by("rank")]
+    if not recos or not _is_fresh(recos[0].created_datetime, settings.RECO_MIRROR_MAX_STALENESS):
+        return None
+    return [reco.event.name for reco in recos]
@@ -1,30 +1,51 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
-from datetime import datetime
+from django.utils import timezone
 
 # Create your models here.
 class User(AbstractUser):
     pass
 
 class Event(models.Model):
+    """
+    Local copy of a backend event, kept up to date by the sync_mirror command
+    """
+    backend_id = models.CharField(max_length=64, unique=True)
     name = models.CharField(max_length=600)
     description = models.CharField(max_length=6000)
     location = models.CharField(max_length=6000)
-    start_datetime = models.DateTimeField()
-    start_date = models.DateField()
-    start_time = models.TimeField()
-    end_datetime = models.DateTimeField()
-    end_date = models.DateField()
-    end_time = models.TimeField()
-    created_datetime = models.DateTimeField(default=datetime.now)
-    link = models.URLField(max_length = 6000) 
+    date = models.CharField(max_length=600)
+    time = models.CharField(max_length=600)
+    requirements = models.CharField(max_length=6000)
+    capacity = models.IntegerField()
+    deadline = models.CharField(max_length=600)
+    tasks = models.CharField(max_length=6000)
+    registered = models.IntegerField(default=0)
+    version = models.BigIntegerField(default=0)
+    created_datetime = models.DateTimeField(default=timezone.now)
 
     def __str__(self):
-        return f"{self.name}, {self.start_datetime}, {self.end_datetime}"
+        return f"{self.name}, {self.date}, {self.time}"
 
 class Reco(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    """
+    Last recommendations fetched from the backend for a user
+    """
+    user_email = models.CharField(max_length=600, db_index=True)
     event = models.ForeignKey(Event, on_delete=models.CASCADE)
+    rank = models.IntegerField()
+    created_datetime = models.DateTimeField(default=timezone.now)
 
     def __str__(self):
-        return f"{self.user.username} - {self.event.name}"
+        return f"{self.user_email} - {self.event.name}"
+
+class MirrorState(models.Model):
+    """
+    How far the local event copy has been synced from the backend change feed
+    """
+    name = models.CharField(max_length=100, unique=True)
+    version = models.BigIntegerField(default=0)
+    synced_datetime = models.DateTimeField(null=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.version} at {self.synced_datetime}"
@@ -1,3 +1,143 @@
-from django.test import TestCase
+import os
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from . import backend_client, middleware, mirror, views
+from .models import Event, MirrorState
+
+
+class FakeFeed:
+    """
+    Stands in for the backend /event/changes endpoint: events are (id, version) pairs that can commit in any order
+    """
+
+    def __init__(self):
+        self.events = {}
+
+    def commit(self, event_id, version, title=None):
+        self.events[event_id] = {
+            "id": event_id, "title": title or event_id, "date": "", "time": "", "requirements": "", "capacity": 10,
+            "deadline": "", "location": "", "description": "", "tasks": "", "registered": 0, "version": version,
+        }
+
+    def get(self, path, params=None):
+        since = params["since"]
+        changes = sorted((event for event in self.events.values() if event["version"] > since), key=lambda event: event["version"])
+        body = {"version": max([event["version"] for event in changes], default=since), "has_more": False, "events": changes, "deleted": []}
+        return mock.Mock(json=mock.Mock(return_value=body))
+
+
+@override_settings(EVENT_MIRROR_OVERLAP_VERSIONS=100)
+class SyncEventsTests(TestCase):
+    def setUp(self):
+        self.feed = FakeFeed()
+        patcher = mock.patch.object(mirror.backend_client, "get", side_effect=self.feed.get)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_late_commit_below_the_cursor_is_picked_up(self):
+        self.feed.commit("b", version=10)
+        self.assertEqual(mirror.sync_events(), 10)
+
+        #version 5 was drawn before b's but its transaction committed after the last sync
+        self.feed.commit("a", version=5)
+        mirror.sync_events()
+
+        self.assertEqual(set(Event.objects.values_list("backend_id", flat=True)), {"a", "b"})
+        self.assertEqual(MirrorState.objects.get(name=mirror.EVENTS).version, 10) #the overlap doesn't move the cursor back
+
+    def test_full_sync_drops_events_the_backend_no_longer_has(self):
+        self.feed.commit("a", version=1)
+        self.feed.commit("b", version=2)
+        mirror.sync_events()
+
+        del self.feed.events["b"] #deleted, but the delete was missed by the feed
+        mirror.sync_events(full=True)
+
+        self.assertEqual(list(Event.objects.values_list("backend_id", flat=True)), ["a"])
+
+    def test_resync_updates_changed_events(self):
+        self.feed.commit("a", version=1, title="Old")
+        mirror.sync_events()
+        self.feed.commit("a", version=2, title="New")
+        mirror.sync_events()
+
+        self.assertEqual(Event.objects.get(backend_id="a").name, "New")
+
+
+class Stop(Exception):
+    pass
+
+
+class SyncMirrorCommandTests(TestCase):
+    def run_command(self, syncs, **options):
+        with mock.patch.object(mirror, "sync_events", return_value=0) as sync_events, \
+             mock.patch("reco_app.management.commands.sync_mirror.time.sleep", side_effect=[None] * (syncs - 1) + [Stop()]):
+            with self.assertRaises(Stop):
+                call_command("sync_mirror", interval=1, stdout=mock.Mock(), **options)
+        return [call.kwargs["full"] for call in sync_events.call_args_list]
+
+    def test_full_reload_every_nth_sync(self):
+        self.assertEqual(self.run_command(7, full_every=3), [False, False, False, True, False, False, True])
+
+    def test_full_flag_reloads_first(self):
+        self.assertEqual(self.run_command(3, full=True, full_every=0), [True, False, False])
+
+
+class ProfilingMiddlewareTests(SimpleTestCase):
+    def setUp(self):
+        profile_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(profile_dir.cleanup)
+        self.profile_dir = profile_dir.name
+        self.middleware = middleware.profiling_middleware(lambda request: HttpResponse("ok"))
+
+    def request(self, **headers):
+        return self.middleware(RequestFactory().get("/event/Beach cleanup", headers=headers))
+
+    def test_profiles_of_the_same_page_in_one_second_are_kept_apart(self):
+        with override_settings(PROFILING_ENABLED=True, PROFILE_DIR=self.profile_dir):
+            names = [self.request(x_profile="ann@example.com")["X-Profile-File"] for _ in range(5)]
+
+        self.assertEqual(len(set(names)), 5)
+        self.assertTrue(all("-event_Beach_cleanup-" in name and name.endswith(".prof") for name in names))
+        self.assertEqual(sorted(os.listdir(self.profile_dir)), sorted(names))
+
+    def test_only_admins_profile_unless_enabled(self):
+        is_admin = mock.Mock(json=mock.Mock(return_value={"is_admin": False}))
+        with override_settings(PROFILING_ENABLED=False, PROFILE_DIR=self.profile_dir), \
+             mock.patch.object(middleware.backend_client, "get", return_value=is_admin):
+            self.assertNotIn("X-Profile-File", self.request(x_profile="ann@example.com"))
+        with override_settings(PROFILING_ENABLED=True, PROFILE_DIR=self.profile_dir):
+            self.assertNotIn("X-Profile-File", self.request())
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+
+class EventEditCacheTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        related = mock.Mock(status_code=200, ok=True, headers={}, json=mock.Mock(return_value={"related_events": ["Beach cleanup"]}))
+        patcher = mock.patch.object(backend_client, "get", return_value=related)
+        self.backend_get = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_edit_drops_cached_related_events(self):
+        for _ in range(2):
+            backend_client.cached_get("/event/related", {"title": "Park cleanup"})
+        self.assertEqual(self.backend_get.call_count, 1)
+
+        updated = mock.Mock(json=mock.Mock(return_value={"message": "Event updated successfully"}))
+        form = {"date": "2025-01-01", "time": "10:00", "requirements": "", "capacity": "10", "deadline": "2024-12-31",
+                "location": "", "description": "Now on the beach", "tasks": ""}
+        with mock.patch.object(backend_client, "post", return_value=updated), mock.patch.object(views, "sync_mirror"), \
+             mock.patch.object(views, "print", create=True):
+            response = self.client.post("/event_edit/Beach cleanup", form)
+        self.assertEqual(response.status_code, 302)
+
+        backend_client.cached_get("/event/related", {"title": "Park cleanup"}) # another event's list, cached before the edit
+        self.assertEqual(self.backend_get.call_count, 2)
@@ -3,6 +3,7 @@ from . import views
 
 urlpatterns = [
     path("", views.index, name="index"),
+    path("recommendations", views.recommendations, name="recommendations"),
     
     path('login', views.login_view, name='login'),
     path("logout", views.logout_view, name="logout"),
@@ -21,4 +22,6 @@ urlpatterns = [
 
     path('admin_promote/<str:user_email>/', views.admin_promote, name='admin_promote'),
     path('admin_demote/<str:user_email>/', views.admin_demote, name='admin_demote'),
+
+    path("cache_stats", views.cache_stats, name="cache_stats"),
 ]
\ No newline at end of file
@@ -1,60 +1,95 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
 from django.db import IntegrityError
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseForbidden, HttpResponseRedirect, JsonResponse
 from django.shortcuts import render
 from django.urls import reverse
-import requests
+
+from . import backend_client, mirror
 
 from datetime import datetime
 
-FASTAPI_BASE_URL = "http://localhost:8000"
+#################################################################################################
+
+def sync_mirror():
+    """
+    Pull event changes into the local mirror so the writer sees their own change on the next page
+    """
+    try:
+        mirror.sync_events()
+    except Exception as error:
+        print(error)
 
 #################################################################################################
 
-def index(request):
+async def index(request):
     user_email = request.COOKIES.get("user_email", "None")
 
     if user_email == "None":
         admin_status = False
-        recomms = []
         registered = []
         username = "None"
-    else:
-        admin_status = requests.get(
-            f"{FASTAPI_BASE_URL}/user/is_admin", 
-            params={"email": user_email}
-        ).json()["is_admin"]
 
-        recomms = requests.get(
-            f"{FASTAPI_BASE_URL}/user/get_similar_events", 
-            params={"email": user_email}
-        ).json()["top_5_events"]
-
-        registered = requests.get(
-            f"{FASTAPI_BASE_URL}/user/get_user_events", 
-            params={"email": user_email}
-        ).json()["events_registered"]
-
-        username = requests.get(
-            f"{FASTAPI_BASE_URL}/user/get_user", 
-            params={"email": user_email}
-        ).json()["full_name"]
+        events = await mirror.aevent_titles()
+    else:
+        # Independent backend calls -> issue them concurrently
+        # Recommendations are slow (embedding calls) -> index.html fetches them afterwards from the recommendations view
+        admin_response, registered_response, user_details, events = await asyncio.gather(
+            backend_client.aget("/user/is_admin", params={"email": user_email}),
+            backend_client.aget("/user/get_user_events", params={"email": user_email}),
+            backend_client.acached_get("/user/get_user", params={"email": user_email}),
+            mirror.aevent_titles(),
+        )
+
+        admin_status = admin_response.json()["is_admin"]
+        registered = registered_response.json()["events_registered"]
+        username = user_details["full_name"]
 
     response = render(request, "index.html",{
         "username": username,
         "user_email": user_email,
         "admin_status": admin_status,
-        "events": requests.get(
-                        f"{FASTAPI_BASE_URL}/event/get_events", 
-                    ).json()["event_titles"],
+        "events": events,
         "registered": registered,
-        "recomms": recomms,
+        # a little longer than the server-side timeout so the view can answer with its own placeholder first
+        "recommendations_timeout_ms": int(settings.RECOMMENDATIONS_TIMEOUT * 1000) + 2000,
     })
 
     response.set_cookie("username", username, max_age=3600)
 
     return response
 
+async def recommendations(request):
+    """
+    Recommendation panel for the home page, loaded by index.html after the page has rendered
+    """
+
+    user_email = request.COOKIES.get("user_email", "None")
+
+    recomms = await mirror.arecommendations(user_email)
+
+    if recomms is None:
+        try:
+            response = (await backend_client.aget(
+                "/user/get_similar_events", 
+                params={"email": user_email},
+                timeout=settings.RECOMMENDATIONS_TIMEOUT
+            )).json()
+            recomms = response["top_5_events"]
+            # fallback lists (backend busy or embeddings down) are not the user's own -> show them but don't keep them
+            if response.get("strategy", "personalized") == "personalized":
+                await sync_to_async(mirror.store_recommendations)(user_email, recomms)
+        except Exception as error:
+            print(error)
+            recomms = None
+
+    return render(request, "recommendations.html", {
+        "recomms": recomms,
+    })
+
 #################################################################################################
 
 def login_view(request):
@@ -68,8 +103,8 @@ def login_view(request):
         
         try:
             # Check if authentication successful
-            fastapi_response = requests.post(
-                f"{FASTAPI_BASE_URL}/login", 
+            fastapi_response = backend_client.post(
+                "/login", 
                 json=login_data
             ).json()
 
@@ -119,8 +154,8 @@ def register(request):
 
         # Attempt to create new user
         try:
-            fastapi_response = requests.post(
-                f"{FASTAPI_BASE_URL}/register", 
+            fastapi_response = backend_client.post(
+                "/register", 
                 json=register_data
             ).json()
 
@@ -166,10 +201,12 @@ def create_event(request):
         }
 
         try:
-            fastapi_response = requests.post(
-                f"{FASTAPI_BASE_URL}/event/create_event", 
+            fastapi_response = backend_client.post(
+                "/event/create_event", 
                 json=new_event_data
             ).json()
+            backend_client.invalidate("/event/get_events")
+            sync_mirror()
             
             print(f"\n{fastapi_response['message']}\n")
 
@@ -184,7 +221,7 @@ def create_event(request):
     else:
         return render(request, 'createEvent.html')
   
-def event(request, event_title):
+async def event(request, event_title):
     """
     Navigates to Event Page
     """
@@ -192,44 +229,22 @@ def event(request, event_title):
     user_email = request.COOKIES.get("user_email", "None")
     username = request.COOKIES.get("username", "None")
 
-    registered_events = requests.get(
-        f"{FASTAPI_BASE_URL}/user/get_user_events", 
-        params={"email": user_email}
-    ).json()["events_registered"]
-
-    print(registered_events)
-
-    if event_title not in registered_events:
-        register_status = False
-    else:
-        register_status = True
-
-    user_admin = requests.get(
-                    f"{FASTAPI_BASE_URL}/user/is_admin", 
-                    params={"email": user_email}
-                ).json()["is_admin"]
-    
-    if user_admin:
-        participants = requests.post(
-                            f"{FASTAPI_BASE_URL}/event/get_users_registered", 
-                            json={
-                                "email": user_email,
-                                "title": event_title
-                            }
-                        ).json()["users_registered"]
-    else:
-        participants = []
+    # Related events come from the backend's precomputed list -> cheap, but cached as they only change when events do
+    event_response, related = await asyncio.gather(
+        backend_client.aget("/event/page", params={"title": event_title, "email": user_email}),
+        backend_client.acached_get("/event/related", params={"title": event_title}),
+    )
+    event_page = event_response.json()
 
     return render(request, 'event.html', {
         "username": username,
         "user_email": user_email,
-        "user_admin": user_admin,
-        "event": requests.get(
-                    f"{FASTAPI_BASE_URL}/event/get_event", 
-                    params={"title":event_title}
-                ).json(),
-        "participants": participants,
-        "registered_status": register_status,
+        "user_admin": event_page["is_admin"],
+        "event": event_page["event"],
+        "remaining_capacity": event_page["remaining_capacity"],
+        "participants": event_page["users_registered"],
+        "registered_status": event_page["is_registered"],
+        "related_events": related.get("related_events", []),
     })
 
 def event_edit(request, event_title):
@@ -252,10 +267,14 @@ def event_edit(request, event_title):
 
         print(updated_event)
 
-        fastapi_response = requests.post(
-                                f"{FASTAPI_BASE_URL}/event/update_event", 
+        fastapi_response = backend_client.post(
+                                "/event/update_event", 
                                 json=updated_event
                             ).json()
+        backend_client.invalidate("/event/get_event", {"title": event_title})
+        # a new description moves the event in other events' related lists too -> drop every cached list
+        backend_client.invalidate("/event/related")
+        sync_mirror()
         
         print(fastapi_response["message"])
         
@@ -266,23 +285,26 @@ def event_edit(request, event_title):
         return render(request, 'event_edit.html', {
             "username": username,
             "user_email": user_email,
-            "event_details": requests.get(
-                                f"{FASTAPI_BASE_URL}/event/get_event", 
-                                params={"title":event_title}
-                            ).json(),
+            "event_details": mirror.event_details(event_title),
         })
 
 def event_delete(request, event_title):
     
     admin_email = request.COOKIES.get("user_email", "None")
 
-    fastapi_response = requests.post(
-                            f"{FASTAPI_BASE_URL}/event/delete_event", 
+    fastapi_response = backend_client.post(
+                            "/event/delete_event", 
                             json={
                                 "email": admin_email,
                                 "title": event_title
                             }
                         ).json()
+    # Deleted event disappears from the list and from every user's registered events
+    backend_client.invalidate("/event/get_event", {"title": event_title})
+    backend_client.invalidate("/event/get_events")
+    backend_client.invalidate("/event/related")
+    backend_client.invalidate("/user/get_user")
+    sync_mirror()
     
     print(fastapi_response["message"])
 
@@ -299,53 +321,43 @@ def event_reg(request, event_title):
 
     print(user_email, event_title)
 
-    register_event_status  = requests.post(
-                                f"{FASTAPI_BASE_URL}/event/register_event", 
+    register_event_status  = backend_client.post(
+                                "/event/register_event", 
                                 params={
                                     "email": str(user_email),
                                     "title": str(event_title),
                                 }
                             ).json()
+    backend_client.invalidate("/user/get_user", {"email": user_email})
     
     print(register_event_status["message"])
 
-    user_admin = requests.get(
-                    f"{FASTAPI_BASE_URL}/user/is_admin", 
-                    params={"email": user_email}
-                ).json()["is_admin"]
-    
-    if user_admin:
-        participants = requests.post(
-                            f"{FASTAPI_BASE_URL}/event/get_users_registered", 
-                            json={
-                                "email": user_email,
-                                "title": event_title
-                            }
-                        ).json()["users_registered"]
-    else:
-        participants = []
-
+    event_page = backend_client.get(
+        "/event/page", 
+        params={"title": event_title, "email": user_email}
+    ).json()
 
     return render(request, 'event.html', {
         "username": username,
         "user_email": user_email,
-        "user_admin": user_admin,
-        "event": requests.get(
-                    f"{FASTAPI_BASE_URL}/event/get_event", 
-                    params={"title":event_title}
-                ).json(),
-        "participants": participants,
-        "registered_status": register_event_status,
+        "user_admin": event_page["is_admin"],
+        "event": event_page["event"],
+        "remaining_capacity": event_page["remaining_capacity"],
+        "participants": event_page["users_registered"],
+        "registered_status": event_page["is_registered"],
     })
 
 def event_unreg(request, event_title):
-    fastapi_response  = requests.post(
-                            f"{FASTAPI_BASE_URL}/event/unregister_event", 
+    user_email = request.COOKIES.get("user_email", "None")
+
+    fastapi_response  = backend_client.post(
+                            "/event/unregister_event", 
                             params={
-                                "email": str(request.COOKIES.get("user_email", "None")),
+                                "email": str(user_email),
                                 "title": str(event_title)
                             }
                         ).json()
+    backend_client.invalidate("/user/get_user", {"email": user_email})
 
     print(fastapi_response["message"])
 
@@ -354,29 +366,23 @@ def event_unreg(request, event_title):
 
 #################################################################################################
 
-def get_user(request, user_email):
+async def get_user(request, user_email):
     username = request.COOKIES.get("username", "None")
-    
-    user_details = requests.get(
-        f"{FASTAPI_BASE_URL}/user/get_user", 
-        params={"email": user_email}
-    ).json()
-
-    user_email = request.COOKIES.get("user_email", "None")
+    current_email = request.COOKIES.get("user_email", "None")
 
-    user_admin  = requests.get(
-        f"{FASTAPI_BASE_URL}/user/is_admin", 
-        params={"email": user_email}
-    ).json()["is_admin"]
+    user_details, admin_response = await asyncio.gather(
+        backend_client.acached_get("/user/get_user", params={"email": user_email}),
+        backend_client.aget("/user/is_admin", params={"email": current_email}),
+    )
 
     return render(request, 'user.html', {
         "username": username,
-        "user_email": user_email,
+        "user_email": current_email,
         "user_details": user_details,
-        "user_admin": user_admin,
+        "user_admin": admin_response.json()["is_admin"],
     })
 
-def user_edit(request, user_email):
+async def user_edit(request, user_email):
     user_email = request.COOKIES.get("user_email", "None")
     username = request.COOKIES.get("username", "None")
 
@@ -398,10 +404,11 @@ def user_edit(request, user_email):
         print(updated_user)
 
         ## Update API request
-        fastapi_response = requests.post(
-            f"{FASTAPI_BASE_URL}/user/update_user", 
+        fastapi_response = (await backend_client.apost(
+            "/user/update_user", 
             json=updated_user
-        ).json()
+        )).json()
+        await backend_client.ainvalidate("/user/get_user", {"email": user_email})
 
         print(fastapi_response["message"])
 
@@ -409,10 +416,10 @@ def user_edit(request, user_email):
         return response
 
     else:
-        user_details = requests.get(
-            f"{FASTAPI_BASE_URL}/user/get_user", 
+        user_details = await backend_client.acached_get(
+            "/user/get_user", 
             params={"email": user_email}
-        ).json()
+        )
 
         return render(request, 'user_edit.html', {
             "username": username,
@@ -421,10 +428,11 @@ def user_edit(request, user_email):
         })
     
 def user_delete(request, user_email):
-    fastapi_response = requests.post(
-        f"{FASTAPI_BASE_URL}/user/delete_user", 
+    fastapi_response = backend_client.post(
+        "/user/delete_user", 
         params={'email': user_email}
     ).json()
+    backend_client.invalidate("/user/get_user", {"email": user_email})
     
     print(f"\n{fastapi_response['message']}\n")
     
@@ -439,13 +447,14 @@ def admin_promote(request, user_email):
     
     admin_email = request.COOKIES.get("user_email", "None")
 
-    fastapi_response = requests.post(
-                            f"{FASTAPI_BASE_URL}/user/promote_admin", 
+    fastapi_response = backend_client.post(
+                            "/user/promote_admin", 
                             json={
                                 "curr_user_email": admin_email,
                                 "new_user_email": user_email
                             }
                         ).json()
+    backend_client.invalidate("/user/get_user", {"email": user_email})
 
     print(fastapi_response["message"])
 
@@ -456,13 +465,14 @@ def admin_demote(request, user_email):
 
     admin_email = request.COOKIES.get("user_email", "None")
 
-    fastapi_response = requests.post(
-                            f"{FASTAPI_BASE_URL}/user/demote_admin", 
+    fastapi_response = backend_client.post(
+                            "/user/demote_admin", 
                             json={
                                 "curr_user_email": admin_email,
                                 "new_user_email": user_email
                             }
                         ).json()
+    backend_client.invalidate("/user/get_user", {"email": user_email})
 
     print(fastapi_response["message"])
 
@@ -470,4 +480,22 @@ def admin_demote(request, user_email):
     return response
 
 #################################################################################################
-    
\ No newline at end of file
+
+def cache_stats(request):
+    """
+    Hit ratios of the backend response cache, admins only
+    """
+
+    user_email = request.COOKIES.get("user_email", "None")
+
+    user_admin = backend_client.get(
+                    "/user/is_admin", 
+                    params={"email": user_email}
+                ).json().get("is_admin", False)
+
+    if not user_admin:
+        return HttpResponseForbidden()
+
+    return JsonResponse(backend_client.cache_stats())
+
+#################################################################################################
@@ -0,0 +1,16 @@
+"""
+Runs the frontend under uvicorn (ASGI) so the async views share one event loop per worker.
+
+Host, port and worker count come from FRONTEND_HOST, FRONTEND_PORT and FRONTEND_WORKERS.
+"""
+import os
+
+import uvicorn
+
+if __name__ == "__main__":
+    uvicorn.run(
+        "hack4good.asgi:application",
+        host=os.environ.get("FRONTEND_HOST", "localhost"),
+        port=int(os.environ.get("FRONTEND_PORT", 5000)),
+        workers=int(os.environ.get("FRONTEND_WORKERS", 1)),
+    )